@@ -1,14 +1,33 @@
-from flask import Flask,flash, request, jsonify, render_template, redirect, url_for, session, make_response
+from flask import Flask,flash, request, jsonify, render_template, redirect, url_for, session, make_response, Response, stream_with_context
 from flask_cors import CORS
-import sqlite3
 import os
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import pyarrow.compute as pc
 import logging
+import threading
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from query_profiler import slow_query_log
+from storage import create_storage, DATABASE_ERRORS
+from sql_dump_parser import InsertStatementParser
+from catalog_snapshot import snapshot, write_snapshot
+from daily_mix_job import DAILY_MIX_SIZE, stale_cutoff
+from play_events import PlayEventConsumer, PlayEventLog, parse_events
+from stats_service import StatsReconciler, catalog_stats
+from recent_plays import recently_played
+from user_cache import user_cache
+from next_track import next_track_index
+from trending import TrendingSnapshotter, trending_tracker
+from facet_index import FACET_COLUMNS, facet_index, parse_year_filter
+from audio_features import AUDIO_FEATURES, audio_feature_store
+from typeahead import SUGGEST_LIMIT, TYPEAHEAD_COLUMNS, trigram_index
+from catalog_ingest import SONG_COLUMNS, SPOTIFY_CSV_SOURCE, SQL_DUMP_SOURCE, keyed_songs, spotify_songs, sync_songs
+import queries
+import json_stream
+from feature_builder import create_feature_builder
+from embeddings import EMBEDDING_DIM, EMBEDDING_MODE, EMBEDDING_REPORT, SongEmbeddings, accuracy_report, format_report
+from sharded_scoring import ShardedScorer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,301 +37,347 @@ app = Flask(__name__)
 app.secret_key = "mysecret123"
 CORS(app)
 
-# Database configuration - SQLite
-DB_PATH = os.path.join(os.path.dirname(__file__), 'music_recommendation.db')
+# Upper bound on scores held in memory per block of batch recommendations
+MAX_BLOCK_CELLS = 1 << 24
+# Catalog rows vectorized per chunk when building the feature matrix
+FEATURE_CHUNK_SIZE = 10000
+# Larger catalog syncs rebuild the in-memory indexes instead of patching them
+INCREMENTAL_SYNC_LIMIT = 1000
+
+class RecommendationModel:
+    """A fitted scorer and the catalog row order it was built on.
+
+    Never changed after construction: a refit builds a new model and swaps it
+    in with one assignment, so a request never pairs the new scorer with the
+    old id list or genre codes.
+    """
+
+    def __init__(self, scorer, catalog):
+        self.scorer = scorer
+        self.music_ids = catalog['id'].to_numpy()
+        self.music_id_to_index = {music_id: idx for idx, music_id in enumerate(self.music_ids.tolist())}
+        # Dictionary-encoded genre per catalog row, for genre_of()
+        genres = catalog['genre'].combine_chunks().dictionary_encode()
+        self.genre_codes = genres.indices.fill_null(-1).to_numpy()
+        self.genre_names = genres.dictionary.to_pylist()
+
 
 class MusicRecommendationSystem:
-    def __init__(self):
-        self.connection = None
-        self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.feature_matrix = None
-        self.music_data = None
+    def __init__(self, storage=None):
+        # Database configuration - SQLite by default, MySQL with DB_BACKEND=mysql
+        self.storage = storage or create_storage()
+        # TF-IDF vocabulary or fixed-width hashing, see FEATURE_MODE
+        self.feature_builder = create_feature_builder()
+        # RecommendationModel over the TF-IDF matrix, or over quantized SVD
+        # embeddings when EMBEDDING_MODE is set; readers take one reference per call
+        self.model = None
+        # Embedding refits after admin edits run in one background thread
+        self.rebuild_lock = threading.Lock()
+        self.rebuild_requested = False
+        self.rebuild_running = False
         self.initialize_database()
         
     def get_database_connection(self):
         try:
-            if self.connection is None:
-                self.connection = sqlite3.connect(DB_PATH, check_same_thread=False)
-                self.connection.row_factory = sqlite3.Row
-                self.connection.execute('PRAGMA foreign_keys = ON;')
-            return self.connection
-        except sqlite3.Error as e:
+            return self.storage.get_connection()
+        except DATABASE_ERRORS as e:
             logger.error(f"Connection error: {e}")
         return None
 
     def initialize_database(self):
-        """Initialize database tables"""
+        """Initialize database tables by applying pending schema migrations"""
         try:
-            connection = self.get_database_connection()
-            if connection:
-                cursor = connection.cursor()
-                
-                # Create users table
-                create_users_table = """
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL DEFAULT 'User',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                
-                # Create music table
-                create_music_table = """
-                CREATE TABLE IF NOT EXISTS music (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    artist TEXT NOT NULL,
-                    album TEXT,
-                    genre TEXT,
-                    year INTEGER,
-                    duration INTEGER,
-                    audio_url TEXT,
-                    features TEXT,
-                    popularity_score INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
+            if self.get_database_connection():
+                version = self.storage.migrate()
+                logger.info(f"Database initialized successfully (schema version {version})")
                 
-                # Create user preferences table (with unique pair)
-                create_preferences_table = """
-                CREATE TABLE IF NOT EXISTS user_preferences (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT,
-                    music_id INTEGER,
-                    preference_score REAL DEFAULT 1.0,
-                    interaction_type TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, music_id),
-                    FOREIGN KEY (music_id) REFERENCES music(id)
-                )
-                """
-                
-                # Create user listening history table
-                create_history_table = """
-                CREATE TABLE IF NOT EXISTS listening_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT,
-                    music_id INTEGER,
-                    play_duration INTEGER,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (music_id) REFERENCES music(id)
-                )
-                """
-
-                # Create liked songs table
-                create_liked_songs_table = """
-                CREATE TABLE IF NOT EXISTS liked_songs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    music_id INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, music_id),
-                    FOREIGN KEY (music_id) REFERENCES music(id)
-                )
-                """
-
-                # Create playlists table
-                create_playlists_table = """
-                CREATE TABLE IF NOT EXISTS playlists (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, name)
-                )
-                """
-
-                # Create playlist songs join table
-                create_playlist_songs_table = """
-                CREATE TABLE IF NOT EXISTS playlist_songs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    playlist_id INTEGER NOT NULL,
-                    music_id INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(playlist_id, music_id),
-                    FOREIGN KEY (playlist_id) REFERENCES playlists(id),
-                    FOREIGN KEY (music_id) REFERENCES music(id)
-                )
-                """
-                
-                cursor.execute(create_users_table)
-                cursor.execute(create_music_table)
-                cursor.execute(create_preferences_table)
-                cursor.execute(create_history_table)
-                cursor.execute(create_liked_songs_table)
-                cursor.execute(create_playlists_table)
-                cursor.execute(create_playlist_songs_table)
-
-                # Migration: add role column if missing (older DBs)
-                cursor.execute("PRAGMA table_info(users)")
-                columns = [row[1] for row in cursor.fetchall()]
-                if 'role' not in columns:
-                    cursor.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'User'")
-                
-                connection.commit()
-                logger.info("Database initialized successfully")
-                
-        except sqlite3.Error as e:
+        except DATABASE_ERRORS as e:
             logger.error(f"Database initialization error: {e}")
     
-    def insert_sample_data(self):
-        """Reload music data from SQL file (force reload)."""
+    def insert_sample_data(self, batch_size=5000):
+        """Sync the music table with the SQL file, applying only the differences."""
+        connection = None
         try:
             connection = self.get_database_connection()
-            cursor = connection.cursor()
-
-            # Ensure table exists
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='music'")
-            if not cursor.fetchone():
-                logger.warning("Music table does not exist yet. initialize_database() should create it.")
-                return
-
-            # Clear existing rows
-            cursor.execute("DELETE FROM music")
-            connection.commit()
-            logger.info("Cleared existing songs from music table.")
 
             sql_file_path = os.path.join(os.path.dirname(__file__), 'music_recommendation_db.sql')
             if not os.path.exists(sql_file_path):
                 logger.warning(f"SQL file not found at {sql_file_path}")
                 return
 
-            with open(sql_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                sql_content = f.read()
-
-            import re
-            # Try to capture both `INSERT INTO \`music\`` and INSERT INTO music (no backticks)
-            pattern = r"INSERT\s+INTO\s+(`?music`?).*?VALUES\s*(.+?)(?=;|INSERT\s+INTO|\Z)"
-            matches = re.findall(pattern, sql_content, re.IGNORECASE | re.DOTALL)
-
-            if not matches:
-                logger.warning("No INSERT INTO music statements found in SQL file (pattern mismatch).")
-                logger.debug("SQL file excerpt (first 800 chars):\n" + sql_content[:800])
-                return
+            # Expect MySQL order: id, title, artist, album, genre, year, duration, audio_url, features, ...
+            default_columns = ('id', 'title', 'artist', 'album', 'genre', 'year', 'duration', 'audio_url', 'features')
 
-            inserted_count = 0
-            for _, values_text in matches:
-                records = re.findall(r'\((.*?)\)(?:,|;|$)', values_text, re.DOTALL)
-                for record in records:
+            skipped_count = 0
+            records = []
+            with open(sql_file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                parser = InsertStatementParser(f, table='music')
+                for columns, values in parser:
+                    record = dict(zip(columns or default_columns, values))
+                    if len(values) < 8 and not columns:
+                        skipped_count += 1
+                        continue
                     try:
-                        parts = []
-                        current = ''
-                        in_quote = False
-                        escape_next = False
-                        for char in record:
-                            if escape_next:
-                                current += char
-                                escape_next = False
-                            elif char == '\\':
-                                escape_next = True
-                            elif char == "'" and not in_quote:
-                                in_quote = True
-                            elif char == "'" and in_quote:
-                                in_quote = False
-                                parts.append(current)
-                                current = ''
-                            elif char == ',' and not in_quote:
-                                if current.strip() and current.strip() != 'NULL':
-                                    parts.append(current.strip())
-                                elif current.strip() == 'NULL':
-                                    parts.append(None)
-                                current = ''
-                            elif in_quote:
-                                current += char
-                            elif not in_quote and char not in (' ', '\t', '\n', '\r'):
-                                current += char
-                        if current.strip():
-                            if current.strip() == 'NULL':
-                                parts.append(None)
-                            else:
-                                parts.append(current.strip())
-                        # Expect MySQL order: id, title, artist, album, genre, year, duration, audio_url, features, ...
-                        if len(parts) >= 8:
-                            title = parts[1] if len(parts) > 1 and parts[1] is not None else ''
-                            artist = parts[2] if len(parts) > 2 and parts[2] is not None else ''
-                            album = parts[3] if len(parts) > 3 and parts[3] is not None else ''
-                            genre = parts[4] if len(parts) > 4 and parts[4] is not None else ''
-                            year = int(parts[5]) if len(parts) > 5 and parts[5] and parts[5] != 'NULL' else None
-                            duration = int(parts[6]) if len(parts) > 6 and parts[6] and parts[6] != 'NULL' else None
-                            audio_url = parts[7] if len(parts) > 7 and parts[7] is not None else ''
-                            features = parts[8] if len(parts) > 8 and parts[8] is not None else ''
-                            cursor.execute(
-                                "INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                                (title, artist, album, genre, year, duration, audio_url, features)
-                            )
-                            inserted_count += 1
-                    except Exception as e:
+                        year = record.get('year')
+                        duration = record.get('duration')
+                        records.append((
+                            record.get('title') or '',
+                            record.get('artist') or '',
+                            record.get('album') or '',
+                            record.get('genre') or '',
+                            int(year) if year not in (None, '') else None,
+                            int(duration) if duration not in (None, '') else None,
+                            record.get('audio_url') or '',
+                            record.get('features') or '',
+                        ))
+                    except (TypeError, ValueError) as e:
+                        skipped_count += 1
                         logger.warning(f"Skipped one record due to parsing error: {e}")
                         continue
 
-            connection.commit()
-            logger.info(f"✅ Reloaded {inserted_count} songs from SQL file.")
+            # parser.statements counts INSERTs into every table; only music rows matter here
+            if parser.rows == 0:
+                logger.warning("No INSERT INTO music rows found in SQL file (pattern mismatch).")
+                return
+
+            # Diff against the stored catalog instead of DELETE FROM music, which
+            # broke the foreign keys from likes, playlists and history
+            songs = keyed_songs(pd.DataFrame(records, columns=SONG_COLUMNS[1:]))
+            changes = sync_songs(connection, songs, SQL_DUMP_SOURCE, prune=True, batch_size=batch_size)
+            self.apply_catalog_changes(changes)
+            stats = parser.stats()
+            logger.info(
+                f"✅ Synced {len(songs)} songs from SQL file: {changes.summary()} "
+                f"(skipped {skipped_count}, parsed {stats['rows_per_second']:.0f} rows/s, "
+                f"{stats['chars_per_second'] / 1e6:.1f}M chars/s)."
+            )
         except Exception as e:
+            if connection:
+                connection.rollback()
             logger.error(f"Error loading music data: {e}")
 
     
-    def get_all_music(self, query=None, genre=None, year=None):
+    @staticmethod
+    def build_music_query(query=None, genre=None, year_min=None, year_max=None, artist=None):
+        """Return (sql, params) for the music listing with optional filters"""
+        sql = "SELECT * FROM music WHERE 1=1"
+        params = []
+        
+        if query:
+            sql += " AND (title LIKE ? OR artist LIKE ? OR album LIKE ?)"
+            query_param = f"%{query}%"
+            params.extend([query_param, query_param, query_param])
+        
+        if genre:
+            sql += " AND genre LIKE ?"
+            params.append(f"%{genre}%")
+        
+        if artist:
+            sql += " AND LOWER(artist) = ?"
+            params.append(artist.strip().lower())
+        
+        if year_min is not None:
+            sql += " AND year >= ?"
+            params.append(year_min)
+        
+        if year_max is not None:
+            sql += " AND year <= ?"
+            params.append(year_max)
+        
+        sql += " ORDER BY popularity_score DESC, created_at DESC"
+        return sql, params
+    
+    @staticmethod
+    def music_filters(genre=None, year=None, artist=None, year_min=None, year_max=None):
+        """Normalise listing filters; ``year`` may be '1994', '90s', '2010s' or '1995-2004'"""
+        low, high = parse_year_filter(year)
+        return {
+            'genre': genre or None,
+            'artist': artist or None,
+            'year_min': year_min if year_min is not None else low,
+            'year_max': year_max if year_max is not None else high,
+        }
+    
+    def facet_music_ids(self, query=None, **filters):
+        """Music ids for facet-only filters from the in-memory index, or None to use SQL"""
+        if query or not facet_index.ready or not any(value is not None for value in filters.values()):
+            return None
+        return facet_index.music_ids_for(**filters)
+    
+    def get_all_music(self, query=None, genre=None, year=None, artist=None):
         """Retrieve music from database with optional filters"""
         try:
+            filters = self.music_filters(genre, year, artist)
+            music_ids = self.facet_music_ids(query, **filters)
+            if music_ids is not None:
+                return self.get_music_by_ids(music_ids)
+            
             connection = self.get_database_connection()
             cursor = connection.cursor()
-            
-            sql = "SELECT * FROM music WHERE 1=1"
-            params = []
-            
-            if query:
-                sql += " AND (title LIKE ? OR artist LIKE ? OR album LIKE ?)"
-                query_param = f"%{query}%"
-                params.extend([query_param, query_param, query_param])
-            
-            if genre:
-                sql += " AND genre LIKE ?"
-                params.append(f"%{genre}%")
-            
-            if year:
-                if year.endswith('s'):
-                    if year == '90s':
-                        sql += " AND year BETWEEN 1990 AND 1999"
-                    elif year == '2000s':
-                        sql += " AND year BETWEEN 2000 AND 2009"
-                    elif year == '2010s':
-                        sql += " AND year BETWEEN 2010 AND 2019"
-                else:
-                    sql += " AND year = ?"
-                    params.append(int(year))
-            
-            sql += " ORDER BY popularity_score DESC, created_at DESC"
-            
-            cursor.execute(sql, params)
+            cursor.execute(*self.build_music_query(query, **filters))
             music_list = cursor.fetchall()
             
             return music_list
             
-        except sqlite3.Error as e:
+        except DATABASE_ERRORS as e:
             logger.error(f"Database query error: {e}")
             return []
     
+    def iter_music(self, query=None, **filters):
+        """Run the filtered music query now and return an iterator of row dicts.
+
+        Facet-only filters are resolved by the facet index and the rows fetched
+        by id; text searches go to SQL. Either way rows are fetched in batches
+        while the caller consumes them, so a streaming response never holds
+        the full result set.
+        """
+        music_ids = self.facet_music_ids(query, **filters)
+        if music_ids is not None:
+            return self.iter_music_by_ids(music_ids)
+        cursor = self.get_database_connection().cursor()
+        cursor.execute(*self.build_music_query(query, **filters))
+        return json_stream.iter_rows(cursor)
+    
+    def iter_music_by_ids(self, music_ids):
+        """Yield music rows as dicts in the order of ``music_ids``, one IN-list chunk at a time"""
+        cursor = self.get_database_connection().cursor()
+        for start in range(0, len(music_ids), queries.MAX_IN_LIST):
+            chunk = music_ids[start:start + queries.MAX_IN_LIST]
+            rows = {row['id']: row for row in queries.fetch_in(cursor, 'music_by_ids', chunk)}
+            for music_id in chunk:
+                if music_id in rows:
+                    yield dict(rows[music_id])
+    
+    def load_catalog(self, columns=None):
+        """Load columns from the catalog snapshot, writing it first if missing"""
+        catalog = snapshot.load(columns)
+        if catalog is None:
+            write_snapshot(self.get_database_connection())
+            catalog = snapshot.load(columns)
+        return catalog
+
+    def refresh_catalog(self, reconcile_stats=False):
+        """Rewrite the catalog snapshot after ingestion or admin edits and rebuild features.
+
+        Bulk loads pass ``reconcile_stats`` to recompute the materialized stats,
+        the facet index and the trigram index; single-song edits update them
+        incrementally instead.
+        The audio-feature trees are always rebuilt from the new snapshot.
+        With embeddings enabled, single-song edits refit them in the background
+        and keep serving the previous model until the refit is done.
+        """
+        try:
+            connection = self.get_database_connection()
+            write_snapshot(connection)
+            if reconcile_stats:
+                catalog_stats.reconcile(connection)
+                facet_index.build(self.load_catalog(FACET_COLUMNS))
+                trigram_index.build(self.load_catalog(TYPEAHEAD_COLUMNS))
+            audio_feature_store.build(self.load_catalog(['id', 'features']))
+        except Exception as e:
+            logger.error(f"Catalog snapshot error: {e}")
+        if EMBEDDING_MODE != 'off' and not reconcile_stats and self.model is not None:
+            self.schedule_feature_rebuild()
+            return True
+        return self.build_feature_matrix()
+
+    def schedule_feature_rebuild(self):
+        """Rebuild the feature matrix in a background thread; edits made meanwhile share one rebuild"""
+        with self.rebuild_lock:
+            self.rebuild_requested = True
+            if self.rebuild_running:
+                return
+            self.rebuild_running = True
+        threading.Thread(target=self.run_feature_rebuilds, daemon=True).start()
+
+    def run_feature_rebuilds(self):
+        while True:
+            with self.rebuild_lock:
+                if not self.rebuild_requested:
+                    self.rebuild_running = False
+                    return
+                self.rebuild_requested = False
+            self.build_feature_matrix()
+
+    def apply_catalog_changes(self, changes):
+        """Apply a catalog sync's change set to the in-memory indexes and refresh the snapshot.
+
+        Small change sets update the stats, facet and trigram indexes song by
+        song; large ones (e.g. a first load) rebuild them like any bulk load.
+        """
+        for song in changes.removed:
+            recently_played.forget_song(song['id'])
+        if not changes:
+            return
+        if len(changes) > INCREMENTAL_SYNC_LIMIT:
+            self.refresh_catalog(reconcile_stats=True)
+            return
+        for index in (catalog_stats, facet_index, trigram_index):
+            for song in changes.removed:
+                index.song_removed(song)
+            for previous, song in changes.updated:
+                index.song_updated(previous, song)
+            for song in changes.added:
+                index.song_added(song)
+        self.refresh_catalog()
+
+    def genre_of(self, music_id):
+        """Genre of a catalog song from the in-memory snapshot, or None"""
+        model = self.model
+        idx = model.music_id_to_index.get(music_id) if model is not None else None
+        if idx is None or model.genre_codes[idx] < 0:
+            return None
+        return model.genre_names[model.genre_codes[idx]]
+    
+    def get_music_by_ids(self, music_ids):
+        """Fetch full music rows for the given ids, in the same order"""
+        if not music_ids:
+            return []
+        connection = self.get_database_connection()
+        cursor = connection.cursor()
+        rows = {row['id']: row for row in queries.fetch_in(cursor, 'music_by_ids', music_ids)}
+        return [rows[music_id] for music_id in music_ids if music_id in rows]
+
+    def exact_feature_matrix(self, catalog=None):
+        """Fit the sparse TF-IDF matrix over the catalog snapshot"""
+        if catalog is None:
+            catalog = self.load_catalog(['id', 'features', 'genre', 'artist'])
+        if catalog is None or catalog.num_rows == 0:
+            return None
+        
+        # "features genre artist", lowercased and joined column-wise in Arrow,
+        # one chunk of the snapshot at a time
+        def text_batches():
+            for batch in catalog.to_batches(max_chunksize=FEATURE_CHUNK_SIZE):
+                yield pc.binary_join_element_wise(
+                    pc.fill_null(batch.column('features'), ''),
+                    pc.utf8_lower(pc.fill_null(batch.column('genre'), '')),
+                    pc.utf8_lower(pc.fill_null(batch.column('artist'), '')),
+                    ' '
+                ).to_pylist()
+        
+        return self.feature_builder.fit_transform(text_batches())
+    
     def build_feature_matrix(self):
         """Build TF-IDF feature matrix for cosine similarity"""
         try:
-            music_data = self.get_all_music()
-            if not music_data:
+            catalog = self.load_catalog(['id', 'features', 'genre', 'artist'])
+            if catalog is None or catalog.num_rows == 0:
                 return None
             
-            feature_texts = []
-            for music in music_data:
-                features = music['features'] if music['features'] else ''
-                genre = music['genre'].lower() if music['genre'] else ''
-                artist = music['artist'].lower() if music['artist'] else ''
-                combined_features = f"{features} {genre} {artist}"
-                feature_texts.append(combined_features)
+            feature_matrix = self.exact_feature_matrix(catalog)
+            if EMBEDDING_MODE != 'off' and catalog.num_rows > 2:
+                # Keep only the compact embeddings; the sparse matrix is dropped
+                embeddings = SongEmbeddings.fit(feature_matrix, EMBEDDING_DIM, EMBEDDING_MODE)
+                if EMBEDDING_REPORT:
+                    logger.info(format_report(accuracy_report(feature_matrix, embeddings)))
+                feature_matrix = embeddings
             
-            self.feature_matrix = self.vectorizer.fit_transform(feature_texts)
-            self.music_data = music_data
-            logger.info(f"Built feature matrix with {len(music_data)} songs")
+            previous, self.model = self.model, RecommendationModel(ShardedScorer(feature_matrix), catalog)
+            # Requests still holding the old model finish before its pool shuts down
+            if previous is not None:
+                previous.scorer.close()
+            logger.info(f"Built {self.feature_builder.mode} feature matrix with {catalog.num_rows} songs")
             return True
             
         except Exception as e:
@@ -322,35 +387,28 @@ class MusicRecommendationSystem:
     def calculate_similarities(self, user_preferences):
         """Calculate cosine similarities based on user preferences"""
         try:
-            if self.feature_matrix is None or self.music_data is None:
+            if self.model is None:
                 if not self.build_feature_matrix():
                     return []
+            model = self.model
             
             # Map music_id to indices
-            music_id_to_index = {music['id']: idx for idx, music in enumerate(self.music_data)}
-            preference_indices = [music_id_to_index.get(pref) for pref in user_preferences if pref in music_id_to_index]
+            preference_indices = [model.music_id_to_index[pref] for pref in user_preferences
+                                  if pref in model.music_id_to_index]
             
             if not preference_indices:
                 return []
             
-            preference_vectors = self.feature_matrix[preference_indices]
-            avg_preference = np.mean(preference_vectors.toarray(), axis=0)
-            avg_preference = avg_preference.reshape(1, -1)
-            
-            similarities = cosine_similarity(avg_preference, self.feature_matrix)[0]
+            # Ties keep the catalog's popularity order
+            top = model.scorer.top_k([preference_indices], 10)[0]
+            scores = {int(model.music_ids[idx]): score for idx, score in top if score > 0.1}
             
             recommendations = []
-            music_similarities = list(enumerate(similarities))
-            music_similarities.sort(key=lambda x: x[1], reverse=True)
-            
-            for idx, similarity in music_similarities:
-                if idx not in preference_indices and similarity > 0.1:
-                    # Convert sqlite3.Row to dict
-                    music = dict(self.music_data[idx])
-                    music['similarity_score'] = float(similarity)
-                    recommendations.append(music)
-                    if len(recommendations) >= 10:
-                        break
+            for row in self.get_music_by_ids(list(scores)):
+                # Convert the database row to dict
+                music = dict(row)
+                music['similarity_score'] = scores[music['id']]
+                recommendations.append(music)
             
             return recommendations
             
@@ -358,37 +416,129 @@ class MusicRecommendationSystem:
             logger.error(f"Similarity calculation error: {e}")
             return []
     
+    def calculate_similarities_batch(self, seed_sets, top_k=10, max_block_cells=MAX_BLOCK_CELLS):
+        """Score many seed sets at once, yielding one list of (music_id, score) per set.
+
+        Seed sets are scored in blocks, each spread over the scorer's catalog
+        shards, so at most ``max_block_cells`` scores are materialised at a
+        time regardless of how many sets are passed.
+        """
+        if self.model is None:
+            if not self.build_feature_matrix():
+                for _ in seed_sets:
+                    yield []
+                return
+        
+        # One model for the whole batch, even if a refit swaps in another meanwhile
+        model = self.model
+        music_ids = model.music_ids
+        id_to_index = model.music_id_to_index
+        n_songs = len(music_ids)
+        k = min(top_k, n_songs)
+        block_rows = max(1, max_block_cells // n_songs)
+        
+        seed_sets = list(seed_sets)
+        for start in range(0, len(seed_sets), block_rows):
+            block = [sorted({id_to_index[seed] for seed in seeds if seed in id_to_index})
+                     for seeds in seed_sets[start:start + block_rows]]
+            for seed_indices, top in zip(block, model.scorer.top_k(block, k)):
+                if not seed_indices:
+                    yield []
+                    continue
+                yield [(int(music_ids[idx]), score) for idx, score in top if score > 0.1]
+    
+    def get_daily_mix(self, user_id, limit=None):
+        """Return the user's precomputed daily mix, or [] if missing or stale"""
+        try:
+            connection = self.get_database_connection()
+            cursor = connection.cursor()
+            queries.execute(cursor, 'user_daily_mix', (str(user_id), stale_cutoff(), limit or DAILY_MIX_SIZE))
+            return [dict(row) for row in cursor.fetchall()]
+        except DATABASE_ERRORS as e:
+            logger.error(f"Daily mix lookup error: {e}")
+            return []
+    
     def record_user_interaction(self, user_id, music_id, interaction_type='play'):
         """Record user interaction for improving recommendations"""
         try:
             connection = self.get_database_connection()
             cursor = connection.cursor()
             
-            insert_pref = """
-            INSERT INTO user_preferences (user_id, music_id, preference_score, interaction_type)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id, music_id) DO UPDATE SET 
-            preference_score = preference_score + excluded.preference_score,
-            created_at = CURRENT_TIMESTAMP
-            """
-            
             score = 1.0 if interaction_type == 'play' else 0.5
-            cursor.execute(insert_pref, (user_id, music_id, score, interaction_type))
+            queries.execute(cursor, 'upsert_preference', (user_id, music_id, score, interaction_type))
             
-            update_popularity = """
-            UPDATE music SET popularity_score = popularity_score + 0.1 WHERE id = ?
-            """
-            cursor.execute(update_popularity, (music_id,))
+            # popularity_score is maintained by popularity_rollup.py from listening_history
             
             connection.commit()
             
-        except sqlite3.Error as e:
+        except DATABASE_ERRORS as e:
             logger.error(f"User interaction recording error: {e}")
 
 # Initialize the recommendation system
 music_system = MusicRecommendationSystem()
 music_system.build_feature_matrix()
 
+# Play pings are staged in a local log and folded into the database in bulk
+play_event_log = PlayEventLog()
+play_event_consumer = PlayEventConsumer(music_system.storage.for_background_thread(), play_event_log)
+
+# Catalog aggregates for /api/stats and the admin pages, kept in memory
+stats_reconciler = StatsReconciler(catalog_stats, music_system.storage.for_background_thread())
+try:
+    catalog_stats.reconcile(music_system.get_database_connection())
+except DATABASE_ERRORS as e:
+    logger.error(f"Initial stats reconciliation error: {e}")
+
+# Genre / year / artist posting lists for filtered listings
+try:
+    catalog = music_system.load_catalog(FACET_COLUMNS)
+    if catalog is not None:
+        facet_index.build(catalog)
+except Exception as e:
+    logger.error(f"Facet index build error: {e}")
+
+# Numeric audio features (energy, tempo, ...) for range and k-NN queries
+try:
+    catalog = music_system.load_catalog(['id', 'features'])
+    if catalog is not None:
+        audio_feature_store.build(catalog)
+except Exception as e:
+    logger.error(f"Audio feature store build error: {e}")
+
+# Title / artist / album trigrams for type-ahead suggestions
+try:
+    catalog = music_system.load_catalog(TYPEAHEAD_COLUMNS)
+    if catalog is not None:
+        trigram_index.build(catalog)
+except Exception as e:
+    logger.error(f"Trigram index build error: {e}")
+
+# Sliding-window trending songs and genres, restored from the last snapshot
+trending_snapshotter = TrendingSnapshotter(trending_tracker)
+try:
+    trending_tracker.load()
+except Exception as e:
+    logger.error(f"Trending snapshot restore error: {e}")
+
+def track_play(user_id, music_id):
+    """Feed one play to the trending tracker"""
+    trending_snapshotter.ensure_started()
+    trending_tracker.record(music_id, user_id, music_system.genre_of(music_id))
+
+def enqueue_play_events(events):
+    """Durably stage parsed play events and make sure the consumer is running"""
+    play_event_consumer.ensure_started()
+    queued = play_event_log.append(events)
+    for user_id, music_id, _, _ in events:
+        recently_played.touch(user_id, music_id)
+        track_play(user_id, music_id)
+    return queued
+
+@app.teardown_appcontext
+def release_database_connection(exception=None):
+    """Return pooled connections to the backend at the end of each request"""
+    music_system.storage.release()
+
 def ensure_admin_account():
     """Bootstrap admin account with secure password and Admin role"""
     try:
@@ -409,6 +559,7 @@ def ensure_admin_account():
             (admin_name, admin_password_hash, admin_role, admin_email)
         )
         connection.commit()
+        user_cache.clear()
         logger.info(f"Admin account ensured: username={admin_name}, email={admin_email}, role={admin_role}")
     except Exception as e:
         logger.error(f"Failed to ensure admin account: {e}")
@@ -418,19 +569,177 @@ def get_music():
     """API endpoint to get music with optional filters"""
     try:
         query = request.args.get('query', '')
-        genre = request.args.get('genre', '')
-        year = request.args.get('year', '')
+        filters = music_system.music_filters(
+            request.args.get('genre', ''),
+            request.args.get('year', ''),
+            request.args.get('artist', ''),
+            request.args.get('year_min', type=int),
+            request.args.get('year_max', type=int),
+        )
         
-        music_list = music_system.get_all_music(query, genre, year)
+        envelope = {'success': True}
+        if request.args.get('facets') and not query and facet_index.ready:
+            envelope['facets'] = facet_index.facet_counts(facet_index.rows(**filters))
         
+        rows = music_system.iter_music(query, **filters)
+        
+        # Rows go from the cursor straight into the response
+        if request.args.get('format') == 'ndjson':
+            body = json_stream.ndjson(rows)
+            mimetype = 'application/x-ndjson'
+        else:
+            body = json_stream.json_array(rows, key='music', envelope=envelope)
+            mimetype = 'application/json'
+        return Response(stream_with_context(body), mimetype=mimetype)
+        
+    except Exception as e:
+        logger.error(f"Get music API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/music/facets', methods=['GET'])
+def get_music_facets():
+    """Genre, decade and artist counts for the songs matching the given filters"""
+    try:
+        if not facet_index.ready:
+            return jsonify({'success': False, 'error': 'Facet index not built'}), 503
+        filters = music_system.music_filters(
+            request.args.get('genre', ''),
+            request.args.get('year', ''),
+            request.args.get('artist', ''),
+            request.args.get('year_min', type=int),
+            request.args.get('year_max', type=int),
+        )
         return jsonify({
             'success': True,
-            'music': music_list,
-            'count': len(music_list)
+            'facets': facet_index.facet_counts(facet_index.rows(**filters))
         })
         
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Get music API error: {e}")
+        logger.error(f"Music facets API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/music/autocomplete', methods=['GET'])
+def autocomplete_music():
+    """Type-ahead suggestions for ``?q=`` ranked by trigram overlap, then popularity"""
+    try:
+        if not trigram_index.ready:
+            return jsonify({'success': False, 'error': 'Trigram index not built'}), 503
+        query = request.args.get('q', '')
+        limit = max(1, min(request.args.get('limit', SUGGEST_LIMIT, type=int), 50))
+        started = datetime.now()
+        suggestions, partial = trigram_index.suggest(query, limit)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'suggestions': suggestions,
+            'partial': partial,
+            'lookup_ms': round((datetime.now() - started).total_seconds() * 1000, 3)
+        })
+        
+    except Exception as e:
+        logger.error(f"Autocomplete API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def parse_feature_ranges(args):
+    """``{feature: (low, high)}`` from ``energy=0.8-1.0`` or ``tempo_min=120&tempo_max=130`` args"""
+    ranges = {}
+    for name in AUDIO_FEATURES:
+        low, high = args.get(f'{name}_min', type=float), args.get(f'{name}_max', type=float)
+        if args.get(name):
+            low_text, separator, high_text = args[name].partition('-')
+            if not separator:
+                raise ValueError(f"Expected {name}=low-high, got {args[name]!r}")
+            low = float(low_text) if low_text.strip() else None
+            high = float(high_text) if high_text.strip() else None
+        if low is not None or high is not None:
+            ranges[name] = (-np.inf if low is None else low, np.inf if high is None else high)
+    return ranges
+
+@app.route('/api/music/by-features', methods=['GET'])
+def get_music_by_features():
+    """Songs by audio-feature ranges (``?energy=0.8-1.0&tempo=120-130``) or
+    nearest to a song (``?like=<id>&features=energy,tempo``)"""
+    try:
+        if not audio_feature_store.ready:
+            return jsonify({'success': False, 'error': 'Audio feature store not built'}), 503
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        started = datetime.now()
+        like = request.args.get('like', type=int)
+        if like is not None:
+            features = [name.strip() for name in request.args.get('features', 'energy,tempo').split(',') if name.strip()]
+            neighbours = audio_feature_store.like(like, features, limit)
+            music_ids = [music_id for music_id, _ in neighbours]
+            distances = dict(neighbours)
+        else:
+            ranges = parse_feature_ranges(request.args)
+            if not ranges:
+                raise ValueError(f"Give a range for at least one of: {', '.join(AUDIO_FEATURES)}")
+            music_ids = audio_feature_store.in_ranges(ranges, limit)
+            distances = {}
+        lookup_ms = (datetime.now() - started).total_seconds() * 1000
+        
+        music = []
+        for row in music_system.get_music_by_ids(music_ids):
+            song = dict(row)
+            song['audio_features'] = audio_feature_store.song_values(song['id'])
+            if song['id'] in distances:
+                song['distance'] = distances[song['id']]
+            music.append(song)
+        return jsonify({
+            'success': True,
+            'music': music,
+            'lookup_ms': round(lookup_ms, 3)
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Music by features API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/music/export', methods=['GET'])
+def export_music():
+    """Stream the full catalog (e.g. for mobile client sync) from the snapshot.
+
+    ``?format=ndjson`` gives one song per line, otherwise a JSON array. Reads
+    the memory-mapped snapshot batch by batch, so memory stays constant and
+    the database is not held open for the length of the download. The ETag
+    changes whenever the catalog is rewritten.
+    """
+    try:
+        catalog = music_system.load_catalog()
+        etag = f'"catalog-{snapshot.version[0]}-{snapshot.version[1]}"' if snapshot.version else None
+        if etag and request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers={'ETag': etag})
+        
+        rows = json_stream.iter_batches(catalog.to_batches(max_chunksize=json_stream.FETCH_SIZE))
+        if request.args.get('format') == 'ndjson':
+            body = json_stream.ndjson(rows)
+            mimetype = 'application/x-ndjson'
+        else:
+            body = json_stream.json_array(rows, key='music', envelope={'success': True})
+            mimetype = 'application/json'
+        response = Response(body, mimetype=mimetype)
+        if etag:
+            response.headers['ETag'] = etag
+        return response
+        
+    except Exception as e:
+        logger.error(f"Catalog export error: {e}")
         return jsonify({
             'success': False,
             'error': str(e)
@@ -469,39 +778,82 @@ def get_recommendations():
             'error': str(e)
         }), 500
 
-@app.route('/api/play', methods=['POST'])
-def record_play():
-    """API endpoint to record music play events"""
+@app.route('/api/recommend/batch', methods=['POST'])
+def get_recommendations_batch():
+    """Batch recommendations for many seed sets, streamed back as NDJSON.
+
+    Body: {"requests": [{"id": "user-1", "preferences": [1, 2]}, ...], "top_k": 10}
+    Each output line is {"id": ..., "recommendations": [{"music_id": ..., "similarity_score": ...}]}.
+    """
     try:
-        data = request.get_json()
-        music_id = data.get('music_id')
-        user_id = data.get('user_id', 'anonymous')
-        duration = data.get('duration', 0)
+        data = request.get_json() or {}
+        batch = data.get('requests', [])
+        try:
+            top_k = max(1, min(int(data.get('top_k', 10)), 100))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'top_k must be an integer'
+            }), 400
         
-        if not music_id:
+        if not isinstance(batch, list) or not all(isinstance(item, dict) for item in batch):
             return jsonify({
                 'success': False,
-                'error': 'Music ID required'
+                'error': 'requests must be a list of objects'
+            }), 400
+        if not batch:
+            return jsonify({
+                'success': False,
+                'error': 'No requests provided'
             }), 400
         
-        connection = music_system.get_database_connection()
-        cursor = connection.cursor()
+        ids = [item.get('id', i) for i, item in enumerate(batch)]
+        seed_sets = [item.get('preferences', []) for item in batch]
         
-        insert_history = """
-        INSERT INTO listening_history (user_id, music_id, play_duration)
-        VALUES (?, ?, ?)
-        """
-        cursor.execute(insert_history, (user_id, music_id, duration))
+        def generate():
+            results = music_system.calculate_similarities_batch(seed_sets, top_k=top_k)
+            for request_id, recommendations in zip(ids, results):
+                yield {
+                    'id': request_id,
+                    'recommendations': [
+                        {'music_id': music_id, 'similarity_score': score}
+                        for music_id, score in recommendations
+                    ]
+                }
         
-        music_system.record_user_interaction(user_id, music_id, 'play')
+        return Response(stream_with_context(json_stream.ndjson(generate())), mimetype='application/x-ndjson')
         
-        connection.commit()
+    except Exception as e:
+        logger.error(f"Batch recommendations API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/play', methods=['POST'])
+def record_play():
+    """API endpoint to record a music play event (acknowledged once staged)"""
+    try:
+        data = request.get_json() or {}
+        if not data.get('music_id'):
+            return jsonify({
+                'success': False,
+                'error': 'Music ID required'
+            }), 400
+        
+        queued = enqueue_play_events(parse_events(data))
         
         return jsonify({
             'success': True,
-            'message': 'Play event recorded'
-        })
+            'message': 'Play event recorded',
+            'queued': queued
+        }), 202
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         logger.error(f"Record play API error: {e}")
         return jsonify({
@@ -509,43 +861,77 @@ def record_play():
             'error': str(e)
         }), 500
 
+@app.route('/api/play/batch', methods=['POST'])
+def record_play_batch():
+    """API endpoint to record a batch of play events.
+
+    Body: ``[{"music_id", "user_id", "duration"}, ...]`` or ``{"events": [...]}``.
+    The events are appended to the staging log and folded in the background.
+    """
+    try:
+        default_user_id = session.get('user_id', 'anonymous')
+        events = parse_events(request.get_json(), default_user_id=default_user_id)
+        queued = enqueue_play_events(events)
+        
+        return jsonify({
+            'success': True,
+            'queued': queued
+        }), 202
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Record play batch API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """API endpoint to get system statistics"""
     try:
-        connection = music_system.get_database_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute("SELECT COUNT(*) as total_songs FROM music")
-        total_songs = cursor.fetchone()['total_songs']
+        # Materialized aggregates: no table scans on the request path
+        stats_reconciler.ensure_started()
+        stats = catalog_stats.summary(popular_limit=5)
         
-        cursor.execute("""
-            SELECT genre, COUNT(*) as count 
-            FROM music 
-            GROUP BY genre 
-            ORDER BY count DESC
-        """)
-        genre_stats = cursor.fetchall()
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
         
-        cursor.execute("""
-            SELECT title, artist, popularity_score 
-            FROM music 
-            ORDER BY popularity_score DESC 
-            LIMIT 5
-        """)
-        popular_songs = cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Stats API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/trending', methods=['GET'])
+def get_trending():
+    """Trending songs and genres over the last TRENDING_WINDOW_SECONDS"""
+    try:
+        limit = min(request.args.get('limit', 10, type=int), trending_tracker.top_k)
+        top_songs = trending_tracker.trending_songs(limit)
+        rows = {row['id']: dict(row) for row in music_system.get_music_by_ids([music_id for music_id, _, _ in top_songs])}
+        songs = []
+        for music_id, plays, listeners in top_songs:
+            if music_id in rows:
+                songs.append({**rows[music_id], 'plays': plays, 'unique_listeners': listeners})
+        genres = [{'genre': genre, 'plays': plays, 'unique_listeners': listeners}
+                  for genre, plays, listeners in trending_tracker.trending_genres(limit)]
         
         return jsonify({
             'success': True,
-            'stats': {
-                'total_songs': total_songs,
-                'genres': genre_stats,
-                'popular_songs': popular_songs
-            }
+            'songs': songs,
+            'genres': genres
         })
         
     except Exception as e:
-        logger.error(f"Stats API error: {e}")
+        logger.error(f"Trending API error: {e}")
         return jsonify({
             'success': False,
             'error': str(e)
@@ -582,6 +968,10 @@ def search():
     
     query = request.form['search_query']
     results = music_system.get_all_music(query=query)
+    if not results:
+        # No exact substring match: fall back to typo-tolerant trigram matches
+        suggestions, _ = trigram_index.suggest(query, limit=50)
+        results = music_system.get_music_by_ids([suggestion['id'] for suggestion in suggestions])
     
     return render_template('dashboard.html',
                          songs=results,
@@ -609,46 +999,26 @@ def dashboard(song_id=None):
             current_song = cursor.fetchone()
 
             # Record to recently played
-            cursor.execute("""
-                INSERT INTO listening_history (user_id, music_id, timestamp)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            """, (user_id, song_id))
+            queries.execute(cursor, 'record_listen', (user_id, song_id))
+            recently_played.record(connection, user_id, song_id)
             connection.commit()
 
-        # Fetch recently played songs
-        cursor.execute("""
-            SELECT DISTINCT m.*
-            FROM music m
-            JOIN listening_history h ON m.id = h.music_id
-            WHERE h.user_id = ?
-            ORDER BY h.timestamp DESC
-            LIMIT 10
-        """, (user_id,))
-        recently_played = cursor.fetchall()
-
-        # Recommend songs
+        # Recently played songs from the per-user LRU
+        history = music_system.get_music_by_ids(recently_played.get(connection, user_id))
+
+        # Recommend random songs (excluding the current one), sampled from the snapshot ids
+        catalog_ids = music_system.load_catalog(['id'])['id'].to_numpy()
         if song_id:
-            # Recommend songs excluding current one
-            cursor.execute("""
-                SELECT * FROM music
-                WHERE id != ?
-                ORDER BY RANDOM()
-                LIMIT 8
-            """, (song_id,))
-        else:
-            # If no song selected, just random songs
-            cursor.execute("""
-                SELECT * FROM music
-                ORDER BY RANDOM()
-                LIMIT 8
-            """)
-        recommended_songs = cursor.fetchall()
+            catalog_ids = catalog_ids[catalog_ids != song_id]
+        sample_size = min(8, len(catalog_ids))
+        sampled_ids = np.random.choice(catalog_ids, size=sample_size, replace=False).tolist()
+        recommended_songs = music_system.get_music_by_ids(sampled_ids)
 
         return render_template(
             'dashboard.html',
             name=name,
             current_song=current_song,
-            history=recently_played,
+            history=history,
             recommendations=recommended_songs
         )
 
@@ -888,7 +1258,7 @@ def signup():
             flash(" Your account has been created successfully. Please log in.")
             return redirect(url_for('login'))  # redirect to login page
 
-        except sqlite3.Error as e:
+        except DATABASE_ERRORS as e:
             logger.error(f"Signup error: {e}")
             return render_template('signup.html', error="Something went wrong. Please try again.")
 
@@ -909,12 +1279,11 @@ def preferences():
         connection = music_system.get_database_connection()
         cursor = connection.cursor()
 
-        genre_placeholders = ','.join(['?'] * len(selected_genres))
-        cursor.execute(f"SELECT id FROM music WHERE genre IN ({genre_placeholders})", selected_genres)
-        songs = cursor.fetchall()
-
-        for song in songs:
-            music_system.record_user_interaction(user_id, song['id'], 'preference')
+        # Bucketed IN list, then one batch of preference upserts
+        songs = queries.fetch_in(cursor, 'music_ids_by_genres', selected_genres) if selected_genres else []
+        queries.executemany(cursor, 'upsert_preference',
+                            [(user_id, song['id'], 0.5, 'preference') for song in songs])
+        connection.commit()
 
         return redirect(url_for('dashboard'))
 
@@ -928,6 +1297,12 @@ def preferences():
 from werkzeug.security import check_password_hash
 from functools import wraps
 
+def current_user():
+    """Cached profile (id, name, email, role) of the logged-in user, or None"""
+    if 'user_id' not in session:
+        return None
+    return user_cache.get(music_system.get_database_connection(), session['user_id'])
+
 # Admin required decorator
 def admin_required(f):
     @wraps(f)
@@ -936,11 +1311,8 @@ def admin_required(f):
             flash('Please log in to access this page.', 'error')
             return redirect(url_for('login'))
         
-        # Check if user is admin
-        connection = music_system.get_database_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT role FROM users WHERE id = ?", (session['user_id'],))
-        user = cursor.fetchone()
+        # Check if user is admin (role comes from the user cache)
+        user = current_user()
         
         if not user or user['role'] != 'Admin':
             flash('Access denied. Admin privileges required.', 'error')
@@ -967,6 +1339,7 @@ def login():
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['user_email'] = user['email']
+            user_cache.put(user)
 
             flash(" Login successful!", "success")
             return redirect(url_for('home'))
@@ -977,7 +1350,6 @@ def login():
     return render_template('login.html')
 
 
-import random
 
 @app.route('/home')
 def home():
@@ -988,44 +1360,33 @@ def home():
         connection = music_system.get_database_connection()
         cursor = connection.cursor()
 
-        # Fetch all songs
-        cursor.execute("SELECT * FROM music")
-        songs = cursor.fetchall()
-
-        # Randomize order of songs
-        random.shuffle(songs)
+        # Fetch all songs (only the columns the page shows) in random order
+        catalog = music_system.load_catalog(['id', 'title', 'artist', 'genre'])
+        songs = catalog.take(np.random.permutation(catalog.num_rows)).to_pylist()
         
-        # Get user preferences for recommendations
-        cursor.execute("""
-            SELECT music_id FROM user_preferences 
-            WHERE user_id = ? 
-            ORDER BY preference_score DESC 
-            LIMIT 5
-        """, (session['user_id'],))
-        user_prefs = cursor.fetchall()
-        user_pref_ids = [pref['music_id'] for pref in user_prefs]
-        
-        # Get personalized recommendations
-        recommended_songs = []
-        if user_pref_ids:
-            recommended_songs = music_system.calculate_similarities(user_pref_ids)
+        # Serve the precomputed daily mix when it is fresh
+        recommended_songs = music_system.get_daily_mix(session['user_id'], limit=4)
+        
+        # New or stale users: score live from their preferences
+        if not recommended_songs:
+            queries.execute(cursor, 'user_top_preferences', (session['user_id'], 5))
+            user_prefs = cursor.fetchall()
+            user_pref_ids = [pref['music_id'] for pref in user_prefs]
+            
+            if user_pref_ids:
+                recommended_songs = music_system.calculate_similarities(user_pref_ids)
         
         # If no personalized recommendations, show popular songs
         if not recommended_songs:
-            cursor.execute("""
-                SELECT * FROM music 
-                ORDER BY popularity_score DESC 
-                LIMIT 4
-            """)
+            queries.execute(cursor, 'popular_music', (4,))
             recommended_songs = cursor.fetchall()
         else:
             # Limit to 4 recommendations
             recommended_songs = recommended_songs[:4]
         
         # Check if user is admin
-        cursor.execute("SELECT role FROM users WHERE id = ?", (session['user_id'],))
-        user = cursor.fetchone()
-        is_admin = user and user['role'] == 'Admin'
+        user = current_user()
+        is_admin = bool(user) and user['role'] == 'Admin'
 
         return render_template('home.html', songs=songs, recommended_songs=recommended_songs, is_admin=is_admin)
     except Exception as e:
@@ -1043,34 +1404,30 @@ def update_recommendation(song_id):
         connection = music_system.get_database_connection()
         cursor = connection.cursor()
 
-        cursor.execute("""
-            INSERT INTO listening_history (user_id, music_id, timestamp)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (user_id, song_id))
+        queries.execute(cursor, 'record_listen', (user_id, song_id))
+        recently_played.record(connection, user_id, song_id)
         connection.commit()
+        track_play(user_id, song_id)
 
         music_system.record_user_interaction(user_id, song_id, 'play')
 
-        cursor.execute("""
-            SELECT DISTINCT m.*
-            FROM music m
-            JOIN listening_history h ON m.id = h.music_id
-            WHERE h.user_id = ?
-            ORDER BY h.timestamp DESC
-            LIMIT 10
-        """, (user_id,))
-        recently_played_rows = cursor.fetchall()
         # Convert Row objects to dictionaries
-        recently_played = [dict(row) for row in recently_played_rows]
+        recent_songs = [dict(row) for row in
+                        music_system.get_music_by_ids(recently_played.get(connection, user_id))]
 
-        # Generate recommendations based on the currently playing song
-        recommendations = music_system.calculate_similarities([song_id])
+        # What listeners actually played after this song, topped up with similar songs
+        recommendations = [dict(row) for row in
+                           music_system.get_music_by_ids(next_track_index.get(connection, song_id))]
+        if len(recommendations) < 10:
+            seen = {song['id'] for song in recommendations}
+            recommendations += [song for song in music_system.calculate_similarities([song_id])
+                                if song['id'] not in seen][:10 - len(recommendations)]
 
         cursor.close()
 
         return jsonify({
             'success': True,
-            'recently_played': recently_played,
+            'recently_played': recent_songs,
             'recommendations': recommendations
         }), 200
 
@@ -1087,17 +1444,8 @@ def listen(song_id):
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
-        user_id = session['user_id']
-        connection = music_system.get_database_connection()
-        cursor = connection.cursor()
-
-        cursor.execute(
-            "INSERT INTO listening_history (user_id, music_id) VALUES (?, ?)",
-            (user_id, song_id)
-        )
-        connection.commit()
-
-        return jsonify({'message': 'Recorded'})
+        enqueue_play_events([(str(session['user_id']), song_id, 0, 'listen')])
+        return jsonify({'message': 'Recorded'}), 202
     except Exception as e:
         logger.error(f"Listen error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1122,7 +1470,11 @@ def admin_songs():
         cursor.execute("SELECT * FROM music ORDER BY created_at DESC")
         all_songs = cursor.fetchall()
 
-        return render_template('admin_songs.html', songs=all_songs)
+        stats_reconciler.ensure_started()
+        stats = catalog_stats.summary()
+        genres = [entry['genre'] for entry in stats['genres'] if entry['genre']]
+
+        return render_template('admin_songs.html', songs=all_songs, genres=genres, stats=stats)
 
     except Exception as e:
         logger.error(f"Error loading songs: {e}")
@@ -1159,8 +1511,14 @@ def admin_add_song():
             )
             connection.commit()
             
-            # Rebuild feature matrix
-            music_system.build_feature_matrix()
+            song = {'id': cursor.lastrowid, 'title': title, 'artist': artist, 'album': album,
+                    'genre': genre, 'year': int(year) if year else None}
+            catalog_stats.song_added(song)
+            facet_index.song_added(song)
+            trigram_index.song_added(song)
+            
+            # Refresh catalog snapshot and feature matrix
+            music_system.refresh_catalog()
             
             flash(f'Successfully added song: {title}', 'success')
             return redirect(url_for('admin_songs'))
@@ -1194,6 +1552,9 @@ def admin_edit_song(song_id):
                 flash('Title, Artist, and Genre are required!', 'error')
                 return redirect(url_for('admin_edit_song', song_id=song_id))
             
+            cursor.execute("SELECT id, artist, genre, year FROM music WHERE id = ?", (song_id,))
+            previous = cursor.fetchone()
+            
             cursor.execute(
                 """UPDATE music SET title=?, artist=?, album=?, genre=?, year=?, 
                    duration=?, audio_url=?, features=? WHERE id=?""",
@@ -1202,8 +1563,15 @@ def admin_edit_song(song_id):
             )
             connection.commit()
             
-            # Rebuild feature matrix
-            music_system.build_feature_matrix()
+            if previous:
+                song = {'id': song_id, 'title': title, 'artist': artist, 'album': album,
+                        'genre': genre, 'year': int(year) if year else None}
+                catalog_stats.song_updated(dict(previous), song)
+                facet_index.song_updated(dict(previous), song)
+                trigram_index.song_updated(dict(previous), song)
+            
+            # Refresh catalog snapshot and feature matrix
+            music_system.refresh_catalog()
             
             flash(f'Successfully updated song: {title}', 'success')
             return redirect(url_for('admin_songs'))
@@ -1231,7 +1599,7 @@ def admin_delete_song(song_id):
         cursor = connection.cursor()
         
         # Get song title for confirmation message
-        cursor.execute("SELECT title FROM music WHERE id = ?", (song_id,))
+        cursor.execute("SELECT id, title, genre, year FROM music WHERE id = ?", (song_id,))
         song = cursor.fetchone()
         
         if not song:
@@ -1243,6 +1611,7 @@ def admin_delete_song(song_id):
         # Delete related records first (due to foreign keys)
         cursor.execute("DELETE FROM user_preferences WHERE music_id = ?", (song_id,))
         cursor.execute("DELETE FROM listening_history WHERE music_id = ?", (song_id,))
+        cursor.execute("DELETE FROM recent_plays WHERE music_id = ?", (song_id,))
         cursor.execute("DELETE FROM liked_songs WHERE music_id = ?", (song_id,))
         cursor.execute("DELETE FROM playlist_songs WHERE music_id = ?", (song_id,))
         
@@ -1250,8 +1619,13 @@ def admin_delete_song(song_id):
         cursor.execute("DELETE FROM music WHERE id = ?", (song_id,))
         connection.commit()
         
-        # Rebuild feature matrix
-        music_system.build_feature_matrix()
+        catalog_stats.song_removed(dict(song))
+        facet_index.song_removed(dict(song))
+        trigram_index.song_removed(dict(song))
+        recently_played.forget_song(song_id)
+        
+        # Refresh catalog snapshot and feature matrix
+        music_system.refresh_catalog()
         
         flash(f'Successfully deleted song: {song_title}', 'success')
         
@@ -1277,64 +1651,14 @@ def reload_songs_from_csv():
         # Read CSV
         df = pd.read_csv(csv_path, encoding='utf-8', on_bad_lines='skip')
         
-        connection = music_system.get_database_connection()
-        cursor = connection.cursor()
-        
-        # Clear existing songs
-        cursor.execute("DELETE FROM music")
-        connection.commit()
+        # One row per track, synced by track_id and content hash so ids and history survive
+        changes = sync_songs(music_system.get_database_connection(), spotify_songs(df), SPOTIFY_CSV_SOURCE, prune=True)
         
-        # Insert songs
-        inserted_count = 0
-        for index, row in df.iterrows():
-            try:
-                title = str(row.get('track_name', 'Unknown'))[:255]
-                artist = str(row.get('track_artist', 'Unknown'))[:255]
-                album = str(row.get('track_album_name', ''))[:255] if pd.notna(row.get('track_album_name')) else ''
-                genre = str(row.get('playlist_genre', ''))[:100] if pd.notna(row.get('playlist_genre')) else ''
-                
-                year = None
-                release_date = row.get('track_album_release_date')
-                if pd.notna(release_date):
-                    try:
-                        year = int(str(release_date)[:4])
-                    except:
-                        pass
-                
-                duration = None
-                duration_ms = row.get('duration_ms')
-                if pd.notna(duration_ms):
-                    try:
-                        duration = int(float(duration_ms) / 1000)
-                    except:
-                        pass
-                
-                features_list = []
-                if pd.notna(row.get('playlist_subgenre')):
-                    features_list.append(str(row['playlist_subgenre']))
-                if pd.notna(row.get('danceability')):
-                    features_list.append(f"danceability:{row['danceability']}")
-                if pd.notna(row.get('energy')):
-                    features_list.append(f"energy:{row['energy']}")
-                
-                features = ' '.join(features_list)[:500]
-                
-                cursor.execute(
-                    """INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features, popularity_score) 
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (title, artist, album, genre, year, duration, '', features, 0)
-                )
-                inserted_count += 1
-            except:
-                continue
-        
-        connection.commit()
-        
-        # Rebuild feature matrix
-        music_system.build_feature_matrix()
+        # Patch (or rebuild) the indexes, catalog snapshot and feature matrix
+        music_system.apply_catalog_changes(changes)
         
-        flash(f'Successfully reloaded {inserted_count} songs from CSV!', 'success')
-        logger.info(f"Reloaded {inserted_count} songs from CSV")
+        flash(f'Successfully reloaded songs from CSV: {changes.summary()}', 'success')
+        logger.info(f"Reloaded songs from CSV: {changes.summary()}")
         
     except Exception as e:
         logger.error(f"Error reloading songs: {e}")
@@ -1342,15 +1666,33 @@ def reload_songs_from_csv():
     
     return redirect(url_for('admin_songs'))
 
+@app.route('/admin/slow-queries')
+@admin_required
+def admin_slow_queries():
+    """List the slowest statements seen since startup with their query plans"""
+    return render_template('admin_slow_queries.html',
+                           queries=slow_query_log.worst(),
+                           statements=queries.statement_timings.summary(),
+                           enabled=slow_query_log.enabled,
+                           threshold_ms=slow_query_log.threshold_ms)
+
+@app.route('/admin/slow-queries/reset', methods=['POST'])
+@admin_required
+def admin_reset_slow_queries():
+    """Clear collected slow-query statistics"""
+    slow_query_log.clear()
+    queries.statement_timings.clear()
+    flash('Slow-query log cleared', 'success')
+    return redirect(url_for('admin_slow_queries'))
+
 @app.route('/')
 def landing():
     return render_template('landing.html')
 
 @app.route('/test')
 def test_get_music():
-    songs = music_system.get_all_music()
-    logger.info(f"Test route - songs fetched: {len(songs)}")
-    return jsonify(songs)
+    rows = music_system.iter_music()
+    return Response(stream_with_context(json_stream.json_array(rows, key='music')), mimetype='application/json')
     
 
 @app.errorhandler(404)
@@ -1369,7 +1711,7 @@ def internal_error(error):
 
 if __name__ == '__main__':
     logger.info("Starting Music Recommendation System API...")
-    logger.info("Database: SQLite (music_recommendation.db)")
+    logger.info(f"Database: {music_system.storage.dialect}")
     logger.info("API will be available at: http://localhost:5000")
     # music_system.insert_sample_data()  # Commented out - use load_songs_from_csv.py instead
     ensure_admin_account()  # Ensure admin exists
@@ -0,0 +1,168 @@
+"""Numeric audio-feature store with KD-tree range and nearest-neighbour queries.
+
+The CSV loaders keep Spotify's audio features only as ``name:value`` tokens
+inside ``music.features`` (``danceability:0.74 energy:0.91 tempo:122.0``).
+``AudioFeatureStore.build()`` extracts them from the catalog snapshot with
+Arrow's regex kernels into one float column per feature, with NaN where a
+song lacks the value. The columns are z-scored, so tempo (BPM) and the 0-1
+features weigh alike.
+
+A scikit-learn ``KDTree`` is built lazily for each feature subset that is
+queried, over the songs that have every feature in the subset, and cached
+until the next build:
+
+* ``nearest({feature: value}, k)`` and ``like(music_id, features, k)`` - k-NN,
+  e.g. "more like this song, by energy and tempo";
+* ``in_ranges({feature: (low, high)})`` - box queries such as "energy >= 0.8,
+  120-130 BPM". The tree returns the ball around the box's centre that
+  encloses the box, and the box bounds are then checked exactly.
+
+The store is rebuilt in bulk whenever the catalog snapshot is refreshed.
+"""
+import logging
+import threading
+import warnings
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sklearn.neighbors import KDTree
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FEATURES = ('danceability', 'energy', 'valence', 'tempo')
+LEAF_SIZE = 40
+VALUE_PATTERN = r'(?:^|\s){name}:(?P<value>-?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)'
+
+
+def extract_feature(features, name):
+    """Float values of ``name:value`` tokens in a string column (NaN where absent)"""
+    matches = pc.extract_regex(features, pattern=VALUE_PATTERN.format(name=name))
+    values = pc.cast(pc.struct_field(matches, [0]), pa.float64())
+    return values.to_numpy(zero_copy_only=False).astype(np.float64)
+
+
+class AudioFeatureStore:
+    """Per-feature float columns plus cached KD-trees per feature subset"""
+
+    def __init__(self, features=AUDIO_FEATURES):
+        self.features = tuple(features)
+        self.lock = threading.Lock()
+        self.music_ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, len(self.features)))
+        self.mean = np.zeros(len(self.features))
+        self.scale = np.ones(len(self.features))
+        self.bounds = np.zeros((2, len(self.features)))
+        self.row_of = {}
+        self.trees = {}
+
+    @property
+    def ready(self):
+        return len(self.music_ids) > 0
+
+    def build(self, catalog):
+        """Parse every song's audio features from a catalog table with id and features columns"""
+        features = catalog.column('features').combine_chunks()
+        values = np.column_stack([extract_feature(features, name) for name in self.features]) \
+            if len(features) else np.empty((0, len(self.features)))
+        music_ids = catalog.column('id').to_numpy()
+        with warnings.catch_warnings():
+            # Features no song has yet are all-NaN columns; they get neutral stats
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(self.features))
+            scale = np.nan_to_num(np.nanstd(values, axis=0), nan=1.0) if len(values) else np.ones(len(self.features))
+            bounds = np.nan_to_num(np.vstack([np.nanmin(values, axis=0), np.nanmax(values, axis=0)])) \
+                if len(values) else np.zeros((2, len(self.features)))
+        scale[scale == 0] = 1.0
+        with self.lock:
+            self.music_ids = music_ids
+            self.values = values
+            self.mean = mean
+            self.scale = scale
+            self.bounds = bounds
+            self.row_of = {music_id: row for row, music_id in enumerate(music_ids.tolist())}
+            self.trees = {}
+        counts = dict(zip(self.features, np.count_nonzero(~np.isnan(values), axis=0).tolist()))
+        logger.info(f"Built audio feature store for {len(music_ids)} songs: {counts}")
+
+    def _canonical(self, features):
+        """Validate a feature subset and put it in store order, so each subset has one tree"""
+        unknown = [name for name in features if name not in self.features]
+        if unknown or not features:
+            raise ValueError(f"Unknown audio features: {', '.join(unknown) or '(none)'}; "
+                             f"choose from {', '.join(self.features)}")
+        return tuple(sorted(set(features), key=self.features.index))
+
+    def _tree(self, features):
+        """(KDTree, row numbers, columns) over songs that have every feature in ``features``"""
+        with self.lock:
+            cached = self.trees.get(features)
+            if cached is None:
+                columns = [self.features.index(name) for name in features]
+                rows = np.flatnonzero(~np.isnan(self.values[:, columns]).any(axis=1))
+                points = (self.values[rows][:, columns] - self.mean[columns]) / self.scale[columns]
+                tree = KDTree(points, leaf_size=LEAF_SIZE) if len(rows) else None
+                cached = self.trees[features] = (tree, rows, columns)
+            return cached
+
+    def song_values(self, music_id, features=None):
+        """``{feature: value}`` for one song (None for missing values)"""
+        row = self.row_of.get(music_id)
+        if row is None:
+            return None
+        return {name: (None if np.isnan(value) else float(value))
+                for name, value in zip(self.features, self.values[row])
+                if features is None or name in features}
+
+    def nearest(self, values, k=10, exclude=None):
+        """[(music_id, distance)] of the ``k`` songs closest to ``{feature: value}``"""
+        features = self._canonical(list(values))
+        tree, rows, columns = self._tree(features)
+        if not len(rows):
+            return []
+        point = (np.array([values[name] for name in features], dtype=np.float64)
+                 - self.mean[columns]) / self.scale[columns]
+        count = min(k + (1 if exclude is not None else 0), len(rows))
+        distances, indices = tree.query(point.reshape(1, -1), k=count)
+        results = [(int(self.music_ids[rows[index]]), float(distance))
+                   for index, distance in zip(indices[0], distances[0])
+                   if self.music_ids[rows[index]] != exclude]
+        return results[:k]
+
+    def like(self, music_id, features, k=10):
+        """Songs nearest to ``music_id`` on ``features`` (excluding itself)"""
+        values = self.song_values(music_id, self._canonical(features))
+        if values is None or None in values.values():
+            return []
+        return self.nearest(values, k, exclude=music_id)
+
+    def in_ranges(self, ranges, limit=None):
+        """Music ids whose features all lie in ``{feature: (low, high)}`` (inclusive, may be +-inf)"""
+        features = self._canonical(list(ranges))
+        tree, rows, columns = self._tree(features)
+        if not len(rows):
+            return []
+        low = np.array([ranges[name][0] for name in features], dtype=np.float64)
+        high = np.array([ranges[name][1] for name in features], dtype=np.float64)
+        if (low > high).any():
+            raise ValueError("Range low bound is above its high bound")
+        # Open-ended bounds are clipped to the observed values so the ball stays finite
+        low = np.maximum(low, self.bounds[0, columns])
+        high = np.minimum(high, self.bounds[1, columns])
+        if (low > high).any():
+            return []
+        low_z = (low - self.mean[columns]) / self.scale[columns]
+        high_z = (high - self.mean[columns]) / self.scale[columns]
+        center = (low_z + high_z) / 2
+        radius = float(np.linalg.norm(high_z - center))
+        candidates = rows[tree.query_radius(center.reshape(1, -1), r=radius)[0]]
+        values = self.values[candidates][:, columns]
+        matches = candidates[((values >= low) & (values <= high)).all(axis=1)]
+        # Catalog (popularity) order
+        matches.sort()
+        if limit is not None:
+            matches = matches[:limit]
+        return self.music_ids[matches].tolist()
+
+
+audio_feature_store = AudioFeatureStore()
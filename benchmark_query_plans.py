@@ -0,0 +1,141 @@
+"""Benchmark the hot-route queries before and after the index migration.
+
+Builds a throwaway SQLite database with synthetic data, applies the schema
+migrations up to the version just before the hot-path indexes, prints the
+EXPLAIN QUERY PLAN and timing for each hot query, then applies the remaining
+migrations and prints them again.
+
+    python benchmark_query_plans.py --songs 30000 --users 500 --plays 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from migrations import HOT_PATH_INDEX_VERSION, run_migrations
+
+GENRES = ['pop', 'rock', 'rap', 'r&b', 'latin', 'edm']
+
+# (route, sql, params) - copied from the routes in app.py
+HOT_QUERIES = [
+    ('dashboard: recently played', """
+        SELECT DISTINCT m.*
+        FROM music m
+        JOIN listening_history h ON m.id = h.music_id
+        WHERE h.user_id = ?
+        ORDER BY h.timestamp DESC
+        LIMIT 10
+    """, ('7',)),
+    ('home: preference seeds', """
+        SELECT music_id FROM user_preferences
+        WHERE user_id = ?
+        ORDER BY preference_score DESC
+        LIMIT 5
+    """, ('7',)),
+    ('home: popular songs', """
+        SELECT * FROM music
+        ORDER BY popularity_score DESC
+        LIMIT 4
+    """, ()),
+    ('preferences: genre filter', "SELECT id FROM music WHERE genre IN (?,?)", ('pop', 'rock')),
+    ('favorites: liked songs', """
+        SELECT m.* FROM music m
+        JOIN liked_songs ls ON m.id = ls.music_id
+        WHERE ls.user_id = ?
+        ORDER BY ls.created_at DESC
+    """, ('7',)),
+    ('api/stats: top popular', """
+        SELECT title, artist, popularity_score
+        FROM music
+        ORDER BY popularity_score DESC
+        LIMIT 5
+    """, ()),
+    ('admin/songs: newest first', "SELECT * FROM music ORDER BY created_at DESC LIMIT 50", ()),
+]
+
+
+def populate(connection, songs, users, plays):
+    """Fill the database with reproducible synthetic data"""
+    rng = random.Random(42)
+    cursor = connection.cursor()
+    cursor.executemany(
+        "INSERT INTO music (title, artist, album, genre, year, duration, features, popularity_score, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now', ?))",
+        ((f"Song {i}", f"Artist {i % 2000}", f"Album {i % 5000}", rng.choice(GENRES),
+          rng.randint(1960, 2024), rng.randint(90, 400), 'synthetic', rng.randint(0, 1000),
+          f"-{rng.randint(0, 100000)} minutes") for i in range(songs))
+    )
+    cursor.executemany(
+        "INSERT INTO listening_history (user_id, music_id, play_duration, timestamp) "
+        "VALUES (?, ?, ?, datetime('now', ?))",
+        ((str(rng.randint(1, users)), rng.randint(1, songs), rng.randint(10, 300),
+          f"-{rng.randint(0, 100000)} minutes") for _ in range(plays))
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO user_preferences (user_id, music_id, preference_score, interaction_type) "
+        "VALUES (?, ?, ?, 'play')",
+        ((str(rng.randint(1, users)), rng.randint(1, songs), rng.random() * 10) for _ in range(plays // 2))
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO liked_songs (user_id, music_id, created_at) VALUES (?, ?, datetime('now', ?))",
+        ((str(rng.randint(1, users)), rng.randint(1, songs), f"-{rng.randint(0, 100000)} minutes")
+         for _ in range(plays // 10))
+    )
+    connection.commit()
+
+
+def measure(connection, repeat):
+    """Return {route: (plan_lines, avg_ms)} for every hot query"""
+    results = {}
+    cursor = connection.cursor()
+    for route, sql, params in HOT_QUERIES:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = [row[3] for row in cursor.fetchall()]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(sql, params)
+            cursor.fetchall()
+        avg_ms = (time.perf_counter() - start) * 1000 / repeat
+        results[route] = (plan, avg_ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=30000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--plays', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        connection = sqlite3.connect(os.path.join(tmp, 'benchmark.db'))
+        run_migrations(connection, target=HOT_PATH_INDEX_VERSION - 1)
+        populate(connection, args.songs, args.users, args.plays)
+
+        before = measure(connection, args.repeat)
+        run_migrations(connection)
+        after = measure(connection, args.repeat)
+        connection.close()
+
+    print("=" * 78)
+    print(f"Hot-route query plans ({args.songs} songs, {args.plays} plays, {args.users} users)")
+    print("=" * 78)
+    for route, _, _ in HOT_QUERIES:
+        plan_before, ms_before = before[route]
+        plan_after, ms_after = after[route]
+        speedup = ms_before / ms_after if ms_after else float('inf')
+        print(f"\n{route}: {ms_before:.2f} ms -> {ms_after:.2f} ms ({speedup:.1f}x)")
+        print("  before:")
+        for line in plan_before:
+            print(f"    {line}")
+        print("  after:")
+        for line in plan_after:
+            print(f"    {line}")
+    print("=" * 78)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""Deduplicated, incremental catalog sync from the Spotify CSV and SQL dump.
+
+``spotify_songs.csv`` has one row per (track, playlist), so a track in five
+playlists appeared five times in ``music``, in the TF-IDF matrix and in
+recommendation lists. ``spotify_songs()`` converts the CSV with vectorized
+pandas operations and collapses it to one row per ``track_id``. Rows without
+a track id, such as the SQL dump's songs (``keyed_songs()``), are keyed on
+their normalised title and artist instead.
+
+* Scalar columns come from a track's first row.
+* ``genre`` is the track's most frequent ``playlist_genre``.
+* Every distinct subgenre, plus the other genres, is merged into the
+  ``features`` tags ahead of the audio-feature tokens. When the column's
+  length limit is reached, the tags are cut back at a word boundary; the
+  audio tokens are always kept intact.
+
+The key is stored in ``music.track_id`` (unique), with a 64-bit hash of the
+row's content in ``music.content_hash`` and the feed it came from in
+``music.source``. ``sync_songs()`` hashes the incoming rows in one
+vectorized pass and compares them with the stored hashes. Only new and
+changed songs are written, in ``SYNC_BATCH_SIZE`` batches, and the whole
+change set commits as one transaction. Song ids, play counts, likes and
+history survive every reload, and rows loaded before ``track_id`` existed
+are adopted by title and artist.
+
+Songs missing from the feed are deleted only when the caller passes
+``prune=True``, and only if that source synced them. Admin-added songs have
+no track id and are never pruned. Deleted songs take the rows that
+reference them along. The returned ``CatalogChanges`` lists the added,
+updated and removed songs, so the in-memory indexes can apply them one by
+one.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+AUDIO_FEATURE_COLUMNS = ('danceability', 'energy', 'valence', 'tempo')
+FEATURES_MAX_LENGTH = 500
+SYNC_BATCH_SIZE = 5000
+# music.source values
+SPOTIFY_CSV_SOURCE = 'spotify_csv'
+SQL_DUMP_SOURCE = 'sql_dump'
+# Tables whose rows point at music.id, cleared before a song is deleted
+SONG_REFERENCES = ('user_preferences', 'listening_history', 'recent_plays', 'liked_songs', 'playlist_songs')
+
+SONG_COLUMNS = ['track_id', 'title', 'artist', 'album', 'genre', 'year', 'duration', 'audio_url', 'features']
+CONTENT_COLUMNS = SONG_COLUMNS[1:]
+# Columns of a song in the change set, as the stats, facet and trigram indexes expect
+CHANGE_COLUMNS = ['id', 'title', 'artist', 'album', 'genre', 'year']
+
+INSERT_SONG = f"""
+    INSERT INTO music ({', '.join(SONG_COLUMNS)}, content_hash, source, popularity_score)
+    VALUES ({', '.join('?' * len(SONG_COLUMNS))}, ?, ?, 0)
+"""
+UPDATE_SONG = f"""
+    UPDATE music SET {', '.join(f'{column} = ?' for column in CONTENT_COLUMNS)}, content_hash = ?
+    WHERE id = ?
+"""
+
+
+def _text(df, column, default=''):
+    values = df[column] if column in df else pd.Series(default, index=df.index)
+    return values.where(values.notna(), default).astype(str)
+
+
+def _fit_tags(tags, budget):
+    """``tags`` cut back to the whole words that fit in ``budget`` characters"""
+    if len(tags) <= budget:
+        return tags
+    cut = tags[:max(budget, 0) + 1]
+    return cut[:max(cut.rfind(' '), 0)]
+
+
+def name_key(title, artist):
+    """Normalised 'title - artist' keys for songs without a Spotify track id"""
+    def normalise(values):
+        return values.str.lower().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    return 'name:' + normalise(title) + ' - ' + normalise(artist)
+
+
+def spotify_songs(df):
+    """One row per track from a Spotify CSV frame, in the columns ``sync_songs`` takes"""
+    title = _text(df, 'track_name', 'Unknown').str[:255]
+    artist = _text(df, 'track_artist', 'Unknown').str[:255]
+    track_id = _text(df, 'track_id').str.strip()
+    release_year = pd.to_numeric(_text(df, 'track_album_release_date').str[:4], errors='coerce')
+    duration_ms = pd.to_numeric(df['duration_ms'], errors='coerce') if 'duration_ms' in df else None
+
+    audio = pd.Series('', index=df.index)
+    for name in AUDIO_FEATURE_COLUMNS:
+        if name in df:
+            audio = audio.str.cat(
+                (f'{name}:' + df[name].astype(str)).where(df[name].notna(), ''), sep=' ')
+    rows = pd.DataFrame({
+        'track_id': track_id.where(track_id != '', name_key(title, artist)),
+        'title': title,
+        'artist': artist,
+        'album': _text(df, 'track_album_name').str[:255],
+        'genre': _text(df, 'playlist_genre').str[:100],
+        'subgenre': _text(df, 'playlist_subgenre'),
+        'year': release_year.astype('Int64'),
+        'duration': (duration_ms // 1000).astype('Int64') if duration_ms is not None else pd.NA,
+        'audio': audio.str.split().str.join(' '),
+    })
+
+    # Most frequent genre per track; ties go to the first seen
+    genres = rows[rows['genre'] != ''].groupby(['track_id', 'genre'], sort=False).size()
+    primary = (genres.sort_values(ascending=False, kind='stable').reset_index()
+               .drop_duplicates('track_id').set_index('track_id')['genre'])
+
+    tags = pd.concat([rows[['track_id', 'subgenre']].set_axis(['track_id', 'tag'], axis=1),
+                      rows[['track_id', 'genre']].set_axis(['track_id', 'tag'], axis=1)])
+    tags = tags[tags['tag'] != ''].drop_duplicates()
+    tags = tags[tags['tag'] != tags['track_id'].map(primary)]
+    tag_text = tags.groupby('track_id', sort=False)['tag'].agg(' '.join)
+
+    songs = rows.drop_duplicates('track_id').set_index('track_id')
+    songs['genre'] = primary.reindex(songs.index).fillna('')
+    # Only the tags give way to the length limit, so tokens like tempo:120.0 stay whole
+    tag_budget = FEATURES_MAX_LENGTH - songs['audio'].str.len() - (songs['audio'] != '')
+    tag_text = pd.Series([_fit_tags(tags, budget) for tags, budget
+                          in zip(tag_text.reindex(songs.index).fillna(''), tag_budget)], index=songs.index)
+    songs['features'] = (tag_text + ' ' + songs['audio']).str.strip().str[:FEATURES_MAX_LENGTH]
+    songs['audio_url'] = ''
+    songs = songs.reset_index()[['track_id', 'title', 'artist', 'album', 'genre', 'year', 'duration',
+                                 'audio_url', 'features']]
+    logger.info(f"Deduplicated {len(df)} CSV rows into {len(songs)} songs")
+    return songs
+
+
+def delete_songs(cursor, music_ids):
+    """Delete songs and every row that references them"""
+    params = [(music_id,) for music_id in music_ids]
+    for table in SONG_REFERENCES:
+        cursor.executemany(f"DELETE FROM {table} WHERE music_id = ?", params)
+    cursor.executemany("DELETE FROM music WHERE id = ?", params)
+
+
+def keyed_songs(frame):
+    """Songs from a frame without track ids (e.g. the SQL dump), keyed and deduplicated on title+artist"""
+    frame = frame.assign(track_id=name_key(frame['title'].fillna('').astype(str),
+                                           frame['artist'].fillna('').astype(str)))
+    frame = frame.drop_duplicates('track_id')[SONG_COLUMNS].reset_index(drop=True)
+    return frame.astype({'year': 'Int64', 'duration': 'Int64'})
+
+
+def content_hashes(songs):
+    """Signed 64-bit hash of each song's content columns (stable across processes)"""
+    content = songs[CONTENT_COLUMNS].astype({'year': 'Int64', 'duration': 'Int64'})
+    for column in ('title', 'artist', 'album', 'genre', 'audio_url', 'features'):
+        content[column] = content[column].fillna('').astype(str)
+    hashes = pd.util.hash_pandas_object(content, index=False).to_numpy().view(np.int64)
+    return pd.array(hashes, dtype='Int64')
+
+
+class CatalogChanges:
+    """Songs a sync added, updated (with their previous values) and removed, as dicts"""
+
+    def __init__(self):
+        self.added = []
+        self.updated = []  # (previous, song)
+        self.removed = []
+
+    def __len__(self):
+        return len(self.added) + len(self.updated) + len(self.removed)
+
+    def summary(self):
+        return f"{len(self.added)} added, {len(self.updated)} updated, {len(self.removed)} removed"
+
+
+def _records(frame):
+    """Rows of a frame as tuples of plain Python values (None for missing)"""
+    return list(frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+def _song_dicts(frame):
+    return [dict(zip(CHANGE_COLUMNS, record)) for record in _records(frame[CHANGE_COLUMNS])]
+
+
+def _in_batches(cursor, sql, records, batch_size):
+    for start in range(0, len(records), batch_size):
+        cursor.executemany(sql, records[start:start + batch_size])
+
+
+def sync_songs(connection, songs, source, prune=False, batch_size=SYNC_BATCH_SIZE):
+    """Apply the difference between ``songs`` from ``source`` and the stored catalog.
+
+    Returns a ``CatalogChanges``. With ``prune``, songs this source synced
+    before but that are missing from ``songs`` are deleted.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, track_id, content_hash, source, title, artist, album, genre, year FROM music")
+    existing = pd.DataFrame([tuple(row) for row in cursor.fetchall()], dtype=object,
+                            columns=['id', 'track_id', 'content_hash', 'source'] + CHANGE_COLUMNS[1:])
+    # Built from Python ints, so the 64-bit hashes never pass through float64
+    existing = existing.astype({'id': 'int64', 'content_hash': 'Int64'})
+    songs = songs.assign(content_hash=content_hashes(songs), source=source)
+    changes = CatalogChanges()
+
+    try:
+        # Adopt rows loaded before track_id existed, so their ids (and history) survive
+        legacy = existing[existing['track_id'].isna()]
+        if len(legacy):
+            names = songs.assign(name=name_key(songs['title'], songs['artist']))
+            names = names.drop_duplicates('name').set_index('name')['track_id']
+            names = names[~names.isin(existing['track_id'].dropna())]
+            legacy_names = name_key(legacy['title'].fillna('').astype(str), legacy['artist'].fillna('').astype(str))
+            adopted = legacy.assign(track_id=legacy_names.map(names)).dropna(subset=['track_id'])
+            adopted = adopted.drop_duplicates('track_id')
+            _in_batches(cursor, "UPDATE music SET track_id = ?, source = ? WHERE id = ?",
+                        [(track_id, source, music_id)
+                         for track_id, music_id in zip(adopted['track_id'], adopted['id'].tolist())], batch_size)
+            existing.loc[adopted.index, 'track_id'] = adopted['track_id']
+            existing.loc[adopted.index, 'source'] = source
+
+        merged = songs.merge(existing[['track_id', 'id', 'content_hash', 'source']], on='track_id', how='left',
+                             suffixes=('', '_stored'))
+        new = merged[merged['id'].isna()]
+        matched = merged[merged['id'].notna()].astype({'id': 'int64'})
+        changed = matched[matched['content_hash'].ne(matched['content_hash_stored']).fillna(True)]
+        # Rows synced before music.source existed belong to the first source that lists them
+        unclaimed = matched[matched['source_stored'].isna()]
+        if prune:
+            stale = existing[existing['track_id'].notna() & (existing['source'] == source)
+                             & ~existing['track_id'].isin(songs['track_id'])]
+        else:
+            stale = existing.iloc[:0]
+
+        _in_batches(cursor, INSERT_SONG, _records(new[SONG_COLUMNS + ['content_hash', 'source']]), batch_size)
+        _in_batches(cursor, UPDATE_SONG, _records(changed[CONTENT_COLUMNS + ['content_hash', 'id']]), batch_size)
+        _in_batches(cursor, "UPDATE music SET source = ? WHERE id = ?",
+                    [(source, music_id) for music_id in unclaimed['id'].tolist()], batch_size)
+        stale_ids = stale['id'].tolist()
+        for start in range(0, len(stale_ids), batch_size):
+            delete_songs(cursor, stale_ids[start:start + batch_size])
+
+        if len(new):
+            cursor.execute("SELECT id, track_id FROM music WHERE source = ?", (source,))
+            ids = {row[1]: row[0] for row in cursor.fetchall()}
+            changes.added = _song_dicts(new.assign(id=new['track_id'].map(ids)))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    previous = existing.set_index('id')
+    changes.updated = list(zip(_song_dicts(previous.loc[changed['id']].reset_index()), _song_dicts(changed)))
+    changes.removed = _song_dicts(stale)
+    logger.info(f"Catalog sync of {len(songs)} {source} songs: {changes.summary()}")
+    return changes
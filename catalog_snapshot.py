@@ -0,0 +1,111 @@
+"""Columnar snapshot of the music catalog.
+
+The catalog is written to an uncompressed Arrow IPC file whenever songs are
+ingested or edited. Readers memory-map the file and select only the columns
+they need, so building the feature matrix or sampling songs never pulls
+unused columns (``audio_url``, timestamps) through Python row objects, and
+the column buffers are shared with the page cache instead of being copied.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.environ.get(
+    'CATALOG_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog_snapshot.arrow')
+)
+BATCH_SIZE = 10000
+# Serializes writers, so the last refresh to start is the one left on disk
+write_lock = threading.Lock()
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('title', pa.string()),
+    ('artist', pa.string()),
+    ('album', pa.string()),
+    ('genre', pa.string()),
+    ('year', pa.int32()),
+    ('duration', pa.int32()),
+    ('audio_url', pa.string()),
+    ('features', pa.string()),
+    ('popularity_score', pa.float64()),
+])
+
+# Same order the recommender used to get from get_all_music(), so similarity
+# ties are still broken by popularity
+SNAPSHOT_QUERY = f"""
+    SELECT {', '.join(SCHEMA.names)} FROM music
+    ORDER BY popularity_score DESC, created_at DESC
+"""
+
+
+def write_snapshot(connection, path=SNAPSHOT_PATH):
+    """Stream the music table into a new snapshot file and swap it in atomically"""
+    with write_lock:
+        cursor = connection.cursor()
+        cursor.execute(SNAPSHOT_QUERY)
+        # A fresh temp file per write: readers may still map the old file, and a
+        # fixed name would let a concurrent writer clobber a half-written one
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                                         prefix=os.path.basename(path), suffix='.tmp', delete=False) as tmp:
+            tmp_path = tmp.name
+        rows_written = 0
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+                while True:
+                    rows = cursor.fetchmany(BATCH_SIZE)
+                    if not rows:
+                        break
+                    columns = list(zip(*rows))
+                    arrays = [pa.array(column, type=field.type) for column, field in zip(columns, SCHEMA)]
+                    writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=SCHEMA))
+                    rows_written += len(rows)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    snapshot.invalidate()
+    logger.info(f"Wrote catalog snapshot with {rows_written} songs to {path}")
+    return rows_written
+
+
+class CatalogSnapshot:
+    """Memory-mapped view of the snapshot file, reopened when the file changes"""
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.table = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.table = None
+            self.version = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, columns=None):
+        """Return a pyarrow Table with ``columns`` (all if None), or None if missing"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        # os.replace gives every write a new inode, even within one mtime tick
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if self.table is None or self.version != version:
+                source = pa.memory_map(self.path, 'r')
+                self.table = pa.ipc.open_file(source).read_all()
+                self.version = version
+            table = self.table
+        return table.select(columns) if columns else table
+
+
+snapshot = CatalogSnapshot()
@@ -1,4 +1,6 @@
-import pandas as pd
+import pyarrow.parquet as pq
+import glob
 
-df = pd.read_csv("static/data/combined_dataset.csv")
-print(df.columns)
+# Schema of the first combined shard written by combine_datasets.py
+shard = sorted(glob.glob("static/data/combined_dataset/part-*.parquet"))[0]
+print(pq.read_schema(shard).names)
@@ -1,23 +1,128 @@
+"""Combine the lyrics and Spotify tracks datasets into columnar shards.
+
+Both sides are normalized with vectorized string operations (lowercase,
+accents, "feat." credits and punctuation stripped), hash-partitioned on the
+normalized (title, artist) key, and each partition pair is deduplicated and
+merged in a process pool. Every partition is written as its own Parquet (or Feather)
+shard, so the importer reads typed columns directly instead of parsing CSV.
+
+    python combine_datasets.py [--partitions N] [--workers N] [--format parquet|feather]
+"""
+import argparse
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
-# Load both datasets
-lyrics_df = pd.read_csv("static/data/spotify_millsongdata.csv")
-tracks_df = pd.read_csv("static/data/spotify_songs.csv")
+LYRICS_PATH = "static/data/spotify_millsongdata.csv"
+TRACKS_PATH = "static/data/spotify_songs.csv"
+OUTPUT_DIR = "static/data/combined_dataset"
+
+KEY_COLUMNS = ['track_name_clean', 'artist_clean']
+
+# "Song (feat. X)", "Song [ft. X]", "Song - featuring X", "A feat. B"
+FEATURING_PATTERN = r"[\(\[]?\s*\b(?:feat\.?|ft\.?|featuring)\s+[^\)\]]*[\)\]]?"
+# Combining marks left by NFKD, so "Beyoncé" and "Beyonce" share a key
+ACCENT_PATTERN = r"[\u0300-\u036f]"
+PUNCTUATION_PATTERN = r"[^\w\s]"
+WHITESPACE_PATTERN = r"\s+"
+
+
+def normalize_key(series):
+    """Vectorized normalization used for near-duplicate matching"""
+    return (
+        series.fillna('')
+        .astype(str)
+        .str.normalize('NFKD')
+        .str.replace(ACCENT_PATTERN, '', regex=True)
+        .str.lower()
+        .str.replace(FEATURING_PATTERN, ' ', regex=True)
+        .str.replace(PUNCTUATION_PATTERN, ' ', regex=True)
+        .str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+        .str.strip()
+    )
+
+
+def hash_partition(df, partitions):
+    """Split ``df`` into ``partitions`` frames by a hash of the merge key"""
+    buckets = pd.util.hash_pandas_object(df[KEY_COLUMNS], index=False).to_numpy() % partitions
+    grouped = dict(tuple(df.groupby(buckets, sort=False)))
+    return [grouped.get(i, df.iloc[0:0]) for i in range(partitions)]
+
+
+def shard_path(output_dir, index, fmt):
+    return os.path.join(output_dir, f"part-{index:05d}.{fmt}")
+
+
+def merge_partition(args):
+    """Merge one partition pair and write it as a shard; returns the row count"""
+    index, tracks_part, lyrics_part, output_dir, fmt = args
+    # Every spelling of a key hashes to this partition, so dropping here is global
+    tracks_part = tracks_part.drop_duplicates(KEY_COLUMNS)
+    lyrics_part = lyrics_part.drop_duplicates(KEY_COLUMNS)
+    combined = pd.merge(tracks_part, lyrics_part, how='inner', on=KEY_COLUMNS)
+    combined = combined.reset_index(drop=True)
+    path = shard_path(output_dir, index, fmt)
+    if fmt == 'feather':
+        combined.to_feather(path)
+    else:
+        combined.to_parquet(path, index=False)
+    return len(combined)
+
+
+def read_combined_dataset(columns=None, input_dir=OUTPUT_DIR):
+    """Read the combined shards back as one DataFrame (only ``columns`` if given)"""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(input_dir, 'part-*'))):
+        if path.endswith('.feather'):
+            frames.append(pd.read_feather(path, columns=columns))
+        else:
+            frames.append(pd.read_parquet(path, columns=columns))
+    if not frames:
+        raise FileNotFoundError(f"No combined dataset shards found in {input_dir}")
+    return pd.concat(frames, ignore_index=True)
+
+
+def combine_datasets(partitions=None, workers=None, fmt='parquet', output_dir=OUTPUT_DIR):
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 4
+    start = time.perf_counter()
+
+    # Load both datasets (pyarrow's multi-threaded CSV reader)
+    lyrics_df = pd.read_csv(LYRICS_PATH, engine='pyarrow')
+    tracks_df = pd.read_csv(TRACKS_PATH, engine='pyarrow')
+
+    # Clean titles and artist names for merging
+    lyrics_df['track_name_clean'] = normalize_key(lyrics_df['song'])
+    lyrics_df['artist_clean'] = normalize_key(lyrics_df['artist'])
+    tracks_df['track_name_clean'] = normalize_key(tracks_df['track_name'])
+    tracks_df['artist_clean'] = normalize_key(tracks_df['track_artist'])
+
+    lyrics_parts = hash_partition(lyrics_df, partitions)
+    tracks_parts = hash_partition(tracks_df, partitions)
+    del lyrics_df, tracks_df
 
-# Clean titles for merging (lowercase and strip whitespace)
-lyrics_df['track_name_clean'] = lyrics_df['song'].str.lower().str.strip()
-tracks_df['track_name_clean'] = tracks_df['track_name'].str.lower().str.strip()
+    # Replace any previous output so stale shards are never mixed in
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
 
-# Optional: Also clean artist names to improve matching
-lyrics_df['artist_clean'] = lyrics_df['artist'].str.lower().str.strip()
-tracks_df['artist_clean'] = tracks_df['track_artist'].str.lower().str.strip()
+    jobs = [(i, tracks_parts[i], lyrics_parts[i], output_dir, fmt) for i in range(partitions)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        total = sum(executor.map(merge_partition, jobs))
 
-# Merge on cleaned song name and artist
-combined_df = pd.merge(tracks_df, lyrics_df, how='inner', 
-                       left_on=['track_name_clean', 'artist_clean'], 
-                       right_on=['track_name_clean', 'artist_clean'])
+    elapsed = time.perf_counter() - start
+    print(f"Datasets combined successfully. Total records: {total} "
+          f"({partitions} {fmt} shards in {output_dir}, {workers} workers, {elapsed:.1f}s)")
+    return total
 
-# Save to new CSV
-combined_df.to_csv("static/data/combined_dataset.csv", index=False)
 
-print("Datasets combined successfully. Total records:", len(combined_df))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--partitions', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', choices=['parquet', 'feather'], default='parquet')
+    args = parser.parse_args()
+    combine_datasets(args.partitions, args.workers, args.format)
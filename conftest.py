@@ -0,0 +1,26 @@
+"""Shared fixtures: the Flask app on throw-away data files"""
+import os
+import tempfile
+
+import pytest
+
+# Set before any module reads its default path, so tests never touch the real files
+DATA_DIR = tempfile.mkdtemp(prefix='music-tests-')
+for name, filename in [('SQLITE_PATH', 'music.db'), ('CATALOG_SNAPSHOT_PATH', 'catalog.arrow'),
+                       ('PLAY_EVENT_LOG_PATH', 'play_events.db'), ('TRENDING_SNAPSHOT_PATH', 'trending.npz')]:
+    os.environ.setdefault(name, os.path.join(DATA_DIR, filename))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    app.ensure_admin_account()
+    return app
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    response = client.post('/login', data={'email': 'admin@gmail.com', 'password': 'admin123'})
+    assert response.status_code == 302
+    return client
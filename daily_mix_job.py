@@ -0,0 +1,120 @@
+"""Offline daily-mix precomputation.
+
+Walks every user with preferences or listening history, scores their seed
+songs in parallel worker processes with the batch recommender and writes the
+top-N per user to ``user_recommendations`` with a generation timestamp.
+``/home`` serves from that table and only falls back to live scoring for new
+users or mixes older than ``DAILY_MIX_MAX_AGE_HOURS``.
+
+Schedule it once a day, e.g. with cron:
+
+    15 4 * * * cd /path/to/app && python daily_mix_job.py --workers 4
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+DAILY_MIX_SIZE = int(os.environ.get('DAILY_MIX_SIZE', '20'))
+DAILY_MIX_MAX_AGE_HOURS = float(os.environ.get('DAILY_MIX_MAX_AGE_HOURS', '26'))
+SEEDS_PER_USER = 5
+CHUNK_SIZE = 500
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Same seeds /home uses: the user's five strongest preferences...
+PREFERENCE_SEEDS = """
+    SELECT user_id, music_id FROM (
+        SELECT user_id, music_id,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY preference_score DESC) AS seed_rank
+        FROM user_preferences
+    ) AS ranked
+    WHERE seed_rank <= ?
+"""
+# ...or, for users who only have history, their most recent plays
+HISTORY_SEEDS = """
+    SELECT user_id, music_id FROM (
+        SELECT user_id, music_id,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC) AS seed_rank
+        FROM listening_history
+        WHERE user_id NOT IN (SELECT user_id FROM user_preferences WHERE user_id IS NOT NULL)
+    ) AS ranked
+    WHERE seed_rank <= ?
+"""
+
+
+def stale_cutoff(max_age_hours=DAILY_MIX_MAX_AGE_HOURS):
+    """Mixes generated before this UTC timestamp are considered stale"""
+    return (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).strftime(TIMESTAMP_FORMAT)
+
+
+def load_user_seeds(connection):
+    """Return {user_id: [seed music ids]} for every user with any activity"""
+    cursor = connection.cursor()
+    seeds = {}
+    for query in (PREFERENCE_SEEDS, HISTORY_SEEDS):
+        cursor.execute(query, (SEEDS_PER_USER,))
+        for row in cursor.fetchall():
+            seeds.setdefault(str(row['user_id']), []).append(row['music_id'])
+    return seeds
+
+
+def score_users(chunk):
+    """Worker: score one chunk of (user_id, seeds) with the batch recommender"""
+    from app import music_system  # built once per worker process
+
+    user_ids = [user_id for user_id, _ in chunk]
+    seed_sets = [seeds for _, seeds in chunk]
+    results = music_system.calculate_similarities_batch(seed_sets, top_k=DAILY_MIX_SIZE)
+    return list(zip(user_ids, results))
+
+
+def write_mixes(connection, scored, generated_at):
+    """Replace the stored mixes of the scored users in one transaction"""
+    cursor = connection.cursor()
+    cursor.executemany("DELETE FROM user_recommendations WHERE user_id = ?",
+                       [(user_id,) for user_id, _ in scored])
+    cursor.executemany(
+        "INSERT INTO user_recommendations (user_id, position, music_id, score, generated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(user_id, position, music_id, score, generated_at)
+         for user_id, recommendations in scored
+         for position, (music_id, score) in enumerate(recommendations)]
+    )
+    connection.commit()
+
+
+def run_daily_mix(workers=None, chunk_size=CHUNK_SIZE):
+    from app import music_system
+
+    start = time.perf_counter()
+    connection = music_system.get_database_connection()
+    seeds = load_user_seeds(connection)
+    items = list(seeds.items())
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    generated_at = datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+    logger.info(f"Generating daily mixes for {len(items)} users in {len(chunks)} chunks")
+
+    users_written = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for scored in executor.map(score_users, chunks):
+            write_mixes(connection, scored, generated_at)
+            users_written += len(scored)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"✅ Wrote daily mixes for {users_written} users in {elapsed:.1f}s")
+    return users_written
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    # The job already runs one process per core; don't shard each worker's scoring too
+    os.environ.setdefault('SCORING_SHARDS', '1')
+    run_daily_mix(args.workers, args.chunk_size)
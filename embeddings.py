@@ -0,0 +1,166 @@
+"""Low-dimensional, quantized song embeddings for compact scoring.
+
+With ``EMBEDDING_MODE`` set to ``float16`` or ``int8``, the sparse TF-IDF
+matrix is reduced with ``TruncatedSVD`` to ``EMBEDDING_DIM`` dense
+dimensions (default 128). The rows are L2-normalised and stored either as
+float16 or as int8 with one float32 scale per row. The sparse matrix is then
+dropped, and scoring a preference vector is a blocked GEMV with float32
+accumulation whose temporaries never exceed ``SCORE_BLOCK_ROWS`` rows.
+
+``accuracy_report()`` compares the embeddings with the exact TF-IDF
+ranking: top-k overlap and score error on a sample of seed songs, plus the
+memory footprint. The exact scores stay sparse and the seeds are scored
+``REPORT_BLOCK_SEEDS`` at a time, but the report still costs a pass over
+the catalog per block. It is therefore offline by default: run
+``python embeddings.py`` to print it for the current catalog, or set
+``EMBEDDING_REPORT=1`` to also log it on every full rebuild.
+"""
+import logging
+import os
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODE = os.environ.get('EMBEDDING_MODE', 'off').lower()
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', '128'))
+SCORE_BLOCK_ROWS = 8192
+EMBEDDING_REPORT = os.environ.get('EMBEDDING_REPORT', '0') == '1'
+REPORT_SAMPLE = 200
+REPORT_TOP_K = 10
+REPORT_BLOCK_SEEDS = 32
+
+
+def sparse_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+class SongEmbeddings:
+    """Quantized, L2-normalised dense song vectors"""
+
+    def __init__(self, vectors, scales, explained_variance):
+        self.vectors = vectors
+        self.scales = scales
+        self.explained_variance = explained_variance
+
+    @classmethod
+    def fit(cls, feature_matrix, dim=EMBEDDING_DIM, dtype='int8', random_state=0):
+        """Reduce ``feature_matrix`` with TruncatedSVD and quantize the rows"""
+        n_songs, n_features = feature_matrix.shape
+        dim = max(1, min(dim, n_features - 1, n_songs - 1))
+        svd = TruncatedSVD(n_components=dim, random_state=random_state)
+        dense = normalize(svd.fit_transform(feature_matrix).astype(np.float32))
+        explained = float(svd.explained_variance_ratio_.sum())
+
+        if dtype == 'float16':
+            return cls(dense.astype(np.float16), None, explained)
+        if dtype != 'int8':
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        scales = np.abs(dense).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        vectors = np.round(dense / scales[:, None]).astype(np.int8)
+        return cls(vectors, scales.astype(np.float32), explained)
+
+    @property
+    def dtype(self):
+        return self.vectors.dtype.name
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def rows(self, indices):
+        """Dequantized float32 vectors for ``indices``"""
+        rows = self.vectors[indices].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[indices][:, None]
+        return rows
+
+    def preference_vectors(self, seed_index_sets):
+        """Normalised mean vector per seed set (zero rows for empty sets)"""
+        queries = np.zeros((len(seed_index_sets), self.vectors.shape[1]), dtype=np.float32)
+        for row, seed_indices in enumerate(seed_index_sets):
+            if seed_indices:
+                queries[row] = self.rows(list(seed_indices)).mean(axis=0)
+        return normalize(queries)
+
+    def scores(self, queries):
+        """Cosine scores of every song against each query: shape (n_queries, n_songs)"""
+        queries = np.atleast_2d(queries).astype(np.float32)
+        n_songs = self.vectors.shape[0]
+        out = np.empty((queries.shape[0], n_songs), dtype=np.float32)
+        for start in range(0, n_songs, SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            block_scores = queries @ block.T
+            if self.scales is not None:
+                block_scores *= self.scales[start:start + SCORE_BLOCK_ROWS]
+            out[:, start:start + SCORE_BLOCK_ROWS] = block_scores
+        return out
+
+
+def accuracy_report(feature_matrix, embeddings, sample=REPORT_SAMPLE, top_k=REPORT_TOP_K, random_state=0):
+    """Compare embedding rankings with exact TF-IDF cosine rankings on sampled seeds"""
+    n_songs = feature_matrix.shape[0]
+    rng = np.random.default_rng(random_state)
+    seeds = rng.choice(n_songs, size=min(sample, n_songs), replace=False)
+    k = min(top_k, n_songs - 1)
+
+    overlaps, errors = [], []
+    for start in range(0, len(seeds), REPORT_BLOCK_SEEDS):
+        block = seeds[start:start + REPORT_BLOCK_SEEDS]
+        # Sparse seeds x songs product; only songs sharing a term with the seed are stored
+        exact = (normalize(feature_matrix[block]) @ feature_matrix.T).tocsr()
+        approx = embeddings.scores(embeddings.preference_vectors([[seed] for seed in block]))
+        for row, seed in enumerate(block.tolist()):
+            columns = exact.indices[exact.indptr[row]:exact.indptr[row + 1]]
+            values = exact.data[exact.indptr[row]:exact.indptr[row + 1]]
+            keep = (columns != seed) & (values > 0)
+            columns, values = columns[keep], values[keep]
+            if len(columns) > k:
+                top = np.argpartition(-values, k - 1)[:k]
+                columns, values = columns[top], values[top]
+            approx[row, seed] = -1.0
+            approx_top = np.argpartition(-approx[row], k - 1)[:k]
+            if len(columns):
+                overlaps.append(len(np.intersect1d(columns, approx_top)) / len(columns))
+                errors.append(np.abs(values - approx[row, columns]))
+
+    return {
+        'dtype': embeddings.dtype,
+        'dim': embeddings.vectors.shape[1],
+        'explained_variance': embeddings.explained_variance,
+        f'recall_at_{k}': float(np.mean(overlaps)) if overlaps else 1.0,
+        'mean_abs_score_error': float(np.mean(np.concatenate(errors))) if errors else 0.0,
+        'sparse_bytes': sparse_nbytes(feature_matrix),
+        'embedding_bytes': embeddings.nbytes,
+        'seeds': len(seeds),
+    }
+
+
+def format_report(report):
+    ratio = report['sparse_bytes'] / max(report['embedding_bytes'], 1)
+    recall_key = next(key for key in report if key.startswith('recall_at_'))
+    return (f"{report['dim']}-dim {report['dtype']} embeddings: "
+            f"{recall_key}={report[recall_key]:.3f}, "
+            f"mean |score error|={report['mean_abs_score_error']:.4f}, "
+            f"explained variance={report['explained_variance']:.2f}, "
+            f"memory {report['embedding_bytes'] / 1e6:.1f} MB vs {report['sparse_bytes'] / 1e6:.1f} MB sparse "
+            f"(ratio {ratio:.1f}x)")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import music_system
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM)
+    parser.add_argument('--dtype', choices=['int8', 'float16'], default='int8')
+    args = parser.parse_args()
+
+    matrix = music_system.exact_feature_matrix()
+    song_embeddings = SongEmbeddings.fit(matrix, args.dim, args.dtype)
+    print(format_report(accuracy_report(matrix, song_embeddings)))
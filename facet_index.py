@@ -0,0 +1,242 @@
+"""In-memory facet index for genre / year / artist filtering.
+
+``build_music_query`` filtered with ``genre LIKE '%x%'`` and a few
+hard-coded decades, so every filter combination scanned the music table.
+``FacetIndex`` instead keeps one posting list per genre, per year and per
+artist. Each list is a sorted NumPy array of catalog row numbers, in
+snapshot (popularity) order. A combined filter intersects the lists,
+smallest first. An arbitrary year range is the union of the per-year lists
+it covers. Facet counts for the UI are ``bincount`` over per-row code arrays
+restricted to the matching rows.
+
+Like ``CatalogStats``, the index is rebuilt from the catalog snapshot on
+bulk loads and updated incrementally on admin adds, edits and deletes.
+Added and edited songs are appended after the snapshot rows. Removed rows
+are masked until the next rebuild.
+"""
+import logging
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FACET_COLUMNS = ['id', 'genre', 'year', 'artist']
+TOP_ARTIST_FACETS = 20
+NO_YEAR = -1
+
+DECADE_PATTERN = re.compile(r'^(\d{2}|\d{4})s$')
+RANGE_PATTERN = re.compile(r'^(\d{4})\s*-\s*(\d{4})$')
+
+
+def parse_year_filter(year):
+    """Turn '1994', '90s', '2010s' or '1995-2004' into an inclusive (low, high) range"""
+    year = (year or '').strip().lower()
+    if not year:
+        return None, None
+    decade = DECADE_PATTERN.match(year)
+    if decade:
+        start = int(decade.group(1))
+        if start < 100:
+            start += 1900 if start >= 30 else 2000
+        return start, start + 9
+    year_range = RANGE_PATTERN.match(year)
+    if year_range:
+        low, high = int(year_range.group(1)), int(year_range.group(2))
+        return min(low, high), max(low, high)
+    return int(year), int(year)
+
+
+class PostingLists:
+    """Sorted row-number arrays per normalised key, with a display label per code"""
+
+    def __init__(self):
+        self.codes = {}  # key -> code
+        self.labels = []  # code -> display label
+        self.postings = []  # code -> sorted np.int64 row numbers
+
+    def code(self, key, label):
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.labels)
+            self.labels.append(label)
+            self.postings.append(np.empty(0, dtype=np.int64))
+        return code
+
+    def add(self, code, row):
+        self.postings[code] = np.append(self.postings[code], row)
+
+    def remove(self, code, row):
+        postings = self.postings[code]
+        self.postings[code] = postings[postings != row]
+
+    def rows(self, key):
+        code = self.codes.get(key)
+        return self.postings[code] if code is not None else np.empty(0, dtype=np.int64)
+
+
+def _key(value):
+    return value.strip().lower() if value else None
+
+
+class FacetIndex:
+    """Posting-list index over the catalog's genre, year and artist columns"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ready = False
+        self.music_ids = np.empty(0, dtype=np.int64)
+        self.live = np.empty(0, dtype=bool)
+        self.years = np.empty(0, dtype=np.int64)
+        self.genre_codes = np.empty(0, dtype=np.int64)
+        self.artist_codes = np.empty(0, dtype=np.int64)
+        self.row_of = {}
+        self.genres = PostingLists()
+        self.artists = PostingLists()
+        self.by_year = {}
+
+    def build(self, catalog):
+        """Rebuild every posting list from a catalog snapshot table"""
+        columns = catalog.select(FACET_COLUMNS).to_pydict()
+        with self.lock:
+            self._reset()
+            n_rows = len(columns['id'])
+            genre_codes = np.full(n_rows, -1, dtype=np.int64)
+            artist_codes = np.full(n_rows, -1, dtype=np.int64)
+            for row, (genre, artist) in enumerate(zip(columns['genre'], columns['artist'])):
+                if _key(genre):
+                    genre_codes[row] = self.genres.code(_key(genre), genre.strip())
+                if _key(artist):
+                    artist_codes[row] = self.artists.code(_key(artist), artist.strip())
+            years = np.array([NO_YEAR if year is None else year for year in columns['year']], dtype=np.int64)
+
+            # A stable argsort groups rows by code and keeps each group ascending
+            for lists, codes in ((self.genres, genre_codes), (self.artists, artist_codes)):
+                order = np.argsort(codes, kind='stable')
+                boundaries = np.searchsorted(codes[order], np.arange(len(lists.labels) + 1))
+                lists.postings = [order[start:end] for start, end in zip(boundaries[:-1], boundaries[1:])]
+            order = np.argsort(years, kind='stable')
+            unique_years, starts = np.unique(years[order], return_index=True)
+            for year, rows in zip(unique_years.tolist(), np.split(order, starts[1:])):
+                if year != NO_YEAR:
+                    self.by_year[year] = rows
+
+            self.music_ids = np.asarray(columns['id'], dtype=np.int64)
+            self.live = np.ones(n_rows, dtype=bool)
+            self.years = years
+            self.genre_codes = genre_codes
+            self.artist_codes = artist_codes
+            self.row_of = {music_id: row for row, music_id in enumerate(columns['id'])}
+            self.ready = True
+        logger.info(f"Built facet index: {n_rows} songs, {len(self.genres.labels)} genres, "
+                    f"{len(self.artists.labels)} artists, {len(self.by_year)} years")
+
+    def song_added(self, song):
+        """Append a song (dict with id, genre, year, artist)"""
+        with self.lock:
+            if not self.ready or song['id'] in self.row_of:
+                return
+            row = len(self.music_ids)
+            genre, artist = song.get('genre'), song.get('artist')
+            genre_code = self.genres.code(_key(genre), genre.strip()) if _key(genre) else -1
+            artist_code = self.artists.code(_key(artist), artist.strip()) if _key(artist) else -1
+            year = NO_YEAR if song.get('year') in (None, '') else int(song['year'])
+
+            self.music_ids = np.append(self.music_ids, song['id'])
+            self.live = np.append(self.live, True)
+            self.years = np.append(self.years, year)
+            self.genre_codes = np.append(self.genre_codes, genre_code)
+            self.artist_codes = np.append(self.artist_codes, artist_code)
+            if genre_code >= 0:
+                self.genres.add(genre_code, row)
+            if artist_code >= 0:
+                self.artists.add(artist_code, row)
+            if year != NO_YEAR:
+                self.by_year[year] = np.append(self.by_year.get(year, np.empty(0, dtype=np.int64)), row)
+            self.row_of[song['id']] = row
+
+    def song_removed(self, song):
+        """Drop a song from every posting list"""
+        with self.lock:
+            row = self.row_of.pop(song['id'], None)
+            if row is None:
+                return
+            self.live[row] = False
+            if self.genre_codes[row] >= 0:
+                self.genres.remove(self.genre_codes[row], row)
+            if self.artist_codes[row] >= 0:
+                self.artists.remove(self.artist_codes[row], row)
+            if self.years[row] != NO_YEAR:
+                year = int(self.years[row])
+                self.by_year[year] = self.by_year[year][self.by_year[year] != row]
+
+    def song_updated(self, previous, song):
+        self.song_removed(previous)
+        self.song_added(song)
+
+    def _year_rows(self, low, high):
+        lists = [rows for year, rows in self.by_year.items()
+                 if (low is None or year >= low) and (high is None or year <= high)]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(lists))
+
+    def _genre_rows(self, genre):
+        # Substring match, like the old ``genre LIKE '%x%'``; there are few genres
+        needle = _key(genre)
+        lists = [self.genres.postings[code] for key, code in self.genres.codes.items() if needle in key]
+        if len(lists) == 1:
+            return lists[0]
+        return np.sort(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+
+    def rows(self, genre=None, artist=None, year_min=None, year_max=None):
+        """Sorted row numbers matching every given filter"""
+        with self.lock:
+            candidates = []
+            if _key(genre):
+                candidates.append(self._genre_rows(genre))
+            if _key(artist):
+                candidates.append(self.artists.rows(_key(artist)))
+            if year_min is not None or year_max is not None:
+                candidates.append(self._year_rows(year_min, year_max))
+            if not candidates:
+                return np.flatnonzero(self.live)
+            candidates.sort(key=len)
+            rows = candidates[0]
+            for other in candidates[1:]:
+                if not len(rows):
+                    break
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            return rows
+
+    def music_ids_for(self, **filters):
+        """Matching music ids in catalog (popularity) order"""
+        return self.music_ids[self.rows(**filters)].tolist()
+
+    def facet_counts(self, rows, top_artists=TOP_ARTIST_FACETS):
+        """Genre, decade and top-artist counts over ``rows``"""
+        with self.lock:
+            genre_counts = np.bincount(self.genre_codes[rows][self.genre_codes[rows] >= 0],
+                                       minlength=len(self.genres.labels))
+            artist_counts = np.bincount(self.artist_codes[rows][self.artist_codes[rows] >= 0],
+                                        minlength=len(self.artists.labels))
+            years = self.years[rows]
+            decades, decade_counts = np.unique(years[years != NO_YEAR] // 10 * 10, return_counts=True)
+            top = np.argsort(-artist_counts, kind='stable')[:top_artists]
+            return {
+                'total': int(len(rows)),
+                'genres': [{'genre': self.genres.labels[code], 'count': int(count)}
+                           for code, count in sorted(enumerate(genre_counts.tolist()), key=lambda e: -e[1])
+                           if count],
+                'decades': [{'decade': f"{decade}s", 'count': int(count)}
+                            for decade, count in zip(decades.tolist(), decade_counts.tolist())],
+                'artists': [{'artist': self.artists.labels[code], 'count': int(artist_counts[code])}
+                            for code in top.tolist() if artist_counts[code]],
+            }
+
+
+facet_index = FacetIndex()
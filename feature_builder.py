@@ -0,0 +1,105 @@
+"""Text feature builders for the recommender.
+
+Two modes, selected with ``FEATURE_MODE``:
+
+* ``tfidf`` (default) - ``TfidfVectorizer`` with a learned vocabulary, as
+  before. The vocabulary dict and the fit pass grow with the corpus.
+* ``hashing`` - terms are hashed into ``HASHING_N_FEATURES`` columns with a
+  stateless ``HashingVectorizer``. Document frequencies are accumulated in one
+  streaming pass over catalog chunks, into a fixed-width array. Memory is
+  bounded by the hash width plus the output matrix rather than by
+  vocabulary size, and new songs can be transformed without any stored
+  vocabulary. Suited to lyrics-scale ``features`` text.
+
+Both produce L2-normalised TF-IDF rows with smoothed IDF, so cosine scores
+are comparable between modes apart from hash collisions.
+"""
+import logging
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+logger = logging.getLogger(__name__)
+
+FEATURE_MODE = os.environ.get('FEATURE_MODE', 'tfidf').lower()
+HASHING_N_FEATURES = int(os.environ.get('HASHING_N_FEATURES', str(1 << 18)))
+STOP_WORDS = 'english'
+
+
+class VocabularyTfidfBuilder:
+    """In-memory ``TfidfVectorizer`` fit over the whole catalog"""
+
+    mode = 'tfidf'
+
+    def __init__(self):
+        self.vectorizer = TfidfVectorizer(stop_words=STOP_WORDS)
+
+    def fit_transform(self, text_batches):
+        texts = [text for batch in text_batches for text in batch]
+        return self.vectorizer.fit_transform(texts)
+
+    def transform(self, texts):
+        return self.vectorizer.transform(texts)
+
+
+class HashedTfidfBuilder:
+    """Fixed-width hashed term counts with IDF accumulated over streamed chunks"""
+
+    mode = 'hashing'
+
+    def __init__(self, n_features=HASHING_N_FEATURES, dtype=np.float32):
+        self.n_features = n_features
+        self.dtype = dtype
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            stop_words=STOP_WORDS,
+            alternate_sign=False,
+            norm=None,
+            dtype=dtype,
+        )
+        self.idf = None
+
+    def fit_transform(self, text_batches):
+        """Hash each batch once, counting document frequencies as it goes"""
+        document_frequency = np.zeros(self.n_features, dtype=np.int64)
+        n_documents = 0
+        counts = []
+        for texts in text_batches:
+            batch = self.hasher.transform(texts)
+            batch.sum_duplicates()
+            document_frequency += np.bincount(batch.indices, minlength=self.n_features)
+            n_documents += batch.shape[0]
+            counts.append(batch)
+        if not counts:
+            return sparse.csr_matrix((0, self.n_features), dtype=self.dtype)
+
+        # Same smoothing as TfidfVectorizer(smooth_idf=True)
+        self.idf = (np.log((1 + n_documents) / (1 + document_frequency)) + 1).astype(self.dtype)
+        matrix = sparse.vstack(counts, format='csr')
+        logger.info(f"Hashed {n_documents} documents into {self.n_features} features "
+                    f"({np.count_nonzero(document_frequency)} buckets used)")
+        return self._weight(matrix)
+
+    def transform(self, texts):
+        """Vectorize new songs with the fitted IDF; no vocabulary needed"""
+        if self.idf is None:
+            raise RuntimeError("HashedTfidfBuilder.transform() called before fit_transform()")
+        return self._weight(self.hasher.transform(texts))
+
+    def _weight(self, counts):
+        counts = counts.tocsr()
+        counts.data *= self.idf[counts.indices]
+        return normalize(counts, norm='l2', copy=False)
+
+
+def create_feature_builder(mode=None):
+    """Build the feature builder selected by ``FEATURE_MODE``"""
+    mode = (mode or FEATURE_MODE).lower()
+    if mode == 'hashing':
+        return HashedTfidfBuilder()
+    if mode != 'tfidf':
+        raise ValueError(f"Unknown FEATURE_MODE: {mode}")
+    return VocabularyTfidfBuilder()
@@ -1,46 +1,56 @@
 import pandas as pd
-import mysql.connector
 from mysql.connector import Error
 
-# Database config
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'music_recommendation_db',
-    'user': 'root',
-    'password': ''
-}
+from combine_datasets import read_combined_dataset
+from storage import MySQLStorage, MYSQL_CONFIG
+
+COLUMNS = ['track_name', 'track_artist', 'track_album_name', 'playlist_name',
+           'track_album_release_date', 'duration_ms', 'text']
+
+# Database config (overridable with the MYSQL_* environment variables)
+DB_CONFIG = MYSQL_CONFIG
 
 def insert_combined_data():
+    storage = None
     try:
-        df = pd.read_csv("static/data/combined_dataset.csv")
+        # Columnar shards written by combine_datasets.py (no CSV parsing)
+        df = read_combined_dataset(columns=COLUMNS)
         df.fillna('', inplace=True)  # Avoid NaNs
 
         # Clean and convert date
         df['year'] = pd.to_datetime(df['track_album_release_date'], errors='coerce').dt.year.fillna(0).astype(int)
 
-        connection = mysql.connector.connect(**DB_CONFIG)
+        storage = MySQLStorage(DB_CONFIG, pool_size=1)
+        storage.migrate()
+        connection = storage.get_connection()
         cursor = connection.cursor()
 
+        insert_query = """
+            INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        rows = []
         for index, row in df.iterrows():
-            insert_query = """
-                INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(insert_query, (
+            rows.append((
                 row.get('track_name', ''),
                 row.get('track_artist', ''),
                 row.get('track_album_name', ''),
                 row.get('playlist_name', ''),  # ✅ Corrected genre
                 int(row.get('year', 0)),
-                int(row.get('duration_ms', 0)) // 1000,
+                int(row.get('duration_ms', 0) or 0) // 1000,
                 '',  # Placeholder for audio_url
                 f"{row.get('playlist_name', '')} {row.get('track_artist', '')} {row.get('text', '')}"
             ))
+        cursor.executemany(insert_query, rows)
 
         connection.commit()
         print("✅ Combined dataset inserted into database successfully.")
 
     except Error as e:
         print("❌ MySQL error:", e)
+    finally:
+        if storage:
+            storage.close()
 
-insert_combined_data()
+if __name__ == '__main__':
+    insert_combined_data()
@@ -0,0 +1,106 @@
+"""Streaming JSON and NDJSON serialization for large API payloads.
+
+Rows are pulled from a cursor with ``fetchmany`` (or from Arrow record
+batches), encoded one at a time and flushed in chunks of about
+``CHUNK_BYTES``. Memory stays constant however many rows the response holds,
+and the first bytes leave before the query has finished. ``orjson`` is used
+when installed. It encodes rows several times faster and handles datetimes
+natively. Otherwise the standard library encoder is used.
+"""
+import datetime
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # optional fast encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 500
+CHUNK_BYTES = 64 * 1024
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if hasattr(value, 'keys'):  # sqlite3.Row / storage.Row
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(obj):
+    """Encode ``obj`` as compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def iter_rows(cursor, fetch_size=FETCH_SIZE):
+    """Yield the cursor's remaining rows as dicts, ``fetch_size`` rows at a time"""
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def iter_batches(batches):
+    """Yield the rows of Arrow record batches as dicts, one batch in memory at a time"""
+    for batch in batches:
+        yield from batch.to_pylist()
+
+
+def _chunked(pieces):
+    """Group small encoded pieces into chunks of about CHUNK_BYTES"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def json_array(rows, key='items', envelope=None, count_key='count'):
+    """Stream ``{**envelope, key: [rows...], count_key: n}`` as JSON bytes.
+
+    The count is only known at the end, so it is written after the array.
+    """
+    def pieces():
+        head = dict(envelope or {})
+        prefix = encode(head)[:-1]
+        yield prefix + (b',' if head else b'') + encode(key) + b':['
+        count = 0
+        try:
+            for row in rows:
+                yield (b',' if count else b'') + encode(row)
+                count += 1
+        except Exception as e:
+            # Headers are already sent; end the document so clients see valid JSON
+            logger.error(f"Streaming JSON error after {count} rows: {e}")
+            yield b'],' + encode('error') + b':' + encode(str(e)) + b'}'
+            return
+        yield b'],' + encode(count_key) + b':' + encode(count) + b'}'
+    return _chunked(pieces())
+
+
+def ndjson(rows):
+    """Stream one JSON document per line"""
+    def pieces():
+        try:
+            for row in rows:
+                yield encode(row) + b'\n'
+        except Exception as e:
+            logger.error(f"Streaming NDJSON error: {e}")
+            yield encode({'error': str(e)}) + b'\n'
+    return _chunked(pieces())
@@ -1,8 +1,11 @@
-import sqlite3
 import pandas as pd
 import os
 import logging
 
+from catalog_ingest import SPOTIFY_CSV_SOURCE, spotify_songs, sync_songs
+from catalog_snapshot import write_snapshot
+from storage import SQLiteStorage
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,90 +27,24 @@ def load_songs_from_csv():
         df = pd.read_csv(CSV_PATH, encoding='utf-8', on_bad_lines='skip')
         logger.info(f"Found {len(df)} songs in CSV file")
         
-        # Connect to database
-        connection = sqlite3.connect(DB_PATH)
-        cursor = connection.cursor()
-        
-        # Clear existing music data
-        cursor.execute("DELETE FROM music")
-        connection.commit()
-        logger.info("Cleared existing songs from database")
+        # Collapse the per-playlist rows into one row per track
+        songs = spotify_songs(df)
         
-        # Insert songs from CSV
-        inserted_count = 0
-        skipped_count = 0
+        # Connect to database (migrating it so music.track_id exists)
+        storage = SQLiteStorage(DB_PATH)
+        storage.migrate()
+        connection = storage.get_connection()
         
-        for index, row in df.iterrows():
-            try:
-                # Extract data from CSV
-                title = str(row.get('track_name', 'Unknown'))[:255]
-                artist = str(row.get('track_artist', 'Unknown'))[:255]
-                album = str(row.get('track_album_name', ''))[:255] if pd.notna(row.get('track_album_name')) else ''
-                genre = str(row.get('playlist_genre', ''))[:100] if pd.notna(row.get('playlist_genre')) else ''
-                
-                # Extract year from release date
-                year = None
-                release_date = row.get('track_album_release_date')
-                if pd.notna(release_date):
-                    try:
-                        year = int(str(release_date)[:4])
-                    except:
-                        year = None
-                
-                # Duration in seconds (convert from milliseconds)
-                duration = None
-                duration_ms = row.get('duration_ms')
-                if pd.notna(duration_ms):
-                    try:
-                        duration = int(float(duration_ms) / 1000)
-                    except:
-                        duration = None
-                
-                # Audio URL (placeholder - you can add actual URLs if available)
-                audio_url = ''
-                
-                # Create features string from audio features
-                features_list = []
-                if pd.notna(row.get('playlist_subgenre')):
-                    features_list.append(str(row['playlist_subgenre']))
-                if pd.notna(row.get('danceability')):
-                    features_list.append(f"danceability:{row['danceability']}")
-                if pd.notna(row.get('energy')):
-                    features_list.append(f"energy:{row['energy']}")
-                if pd.notna(row.get('valence')):
-                    features_list.append(f"valence:{row['valence']}")
-                if pd.notna(row.get('tempo')):
-                    features_list.append(f"tempo:{row['tempo']}")
-                
-                features = ' '.join(features_list)[:500]
-                
-                # Insert into database
-                cursor.execute(
-                    """INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features, popularity_score) 
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (title, artist, album, genre, year, duration, audio_url, features, 0)
-                )
-                inserted_count += 1
-                
-                # Log progress every 1000 songs
-                if inserted_count % 1000 == 0:
-                    logger.info(f"Inserted {inserted_count} songs...")
-                    
-            except Exception as e:
-                skipped_count += 1
-                if skipped_count <= 10:  # Only log first 10 errors
-                    logger.warning(f"Skipped row {index}: {str(e)}")
-                continue
+        # Apply only new, changed and removed songs instead of clearing the catalog
+        changes = sync_songs(connection, songs, SPOTIFY_CSV_SOURCE, prune=True)
         
-        # Commit all changes
-        connection.commit()
-        connection.close()
+        # Keep the columnar catalog snapshot in sync for the recommender
+        write_snapshot(connection)
+        storage.close()
         
-        logger.info(f"✅ Successfully loaded {inserted_count} songs into database")
-        if skipped_count > 0:
-            logger.info(f"⚠️ Skipped {skipped_count} songs due to errors")
+        logger.info(f"✅ Successfully loaded {len(songs)} songs into database ({changes.summary()})")
         
-        return inserted_count
+        return len(songs)
         
     except Exception as e:
         logger.error(f"Error loading songs from CSV: {e}")
@@ -0,0 +1,514 @@
+"""Versioned schema migrations for the SQLite and MySQL databases.
+
+Each migration is a ``(version, description, steps)`` tuple. A step is a SQL
+string, a dict mapping a dialect ('sqlite' or 'mysql') to a SQL string or a
+list of them, or a callable that receives ``(cursor, dialect)``. Applied
+versions are recorded in the ``schema_version`` table, so every step runs
+exactly once per database and new migrations only need to be appended to
+``MIGRATIONS``.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+SQLITE_INITIAL_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'User',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS music (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        album TEXT,
+        genre TEXT,
+        year INTEGER,
+        duration INTEGER,
+        audio_url TEXT,
+        features TEXT,
+        popularity_score INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_preferences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        music_id INTEGER,
+        preference_score REAL DEFAULT 1.0,
+        interaction_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, music_id),
+        FOREIGN KEY (music_id) REFERENCES music(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS listening_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        music_id INTEGER,
+        play_duration INTEGER,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (music_id) REFERENCES music(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS liked_songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        music_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, music_id),
+        FOREIGN KEY (music_id) REFERENCES music(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS playlist_songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        playlist_id INTEGER NOT NULL,
+        music_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(playlist_id, music_id),
+        FOREIGN KEY (playlist_id) REFERENCES playlists(id),
+        FOREIGN KEY (music_id) REFERENCES music(id)
+    )
+    """,
+]
+
+
+# Mirrors the SQLite schema; init_db.py used to create a subset of these
+MYSQL_TABLE_OPTIONS = "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"
+
+MYSQL_INITIAL_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        role VARCHAR(20) NOT NULL DEFAULT 'User',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS music (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        title VARCHAR(255) NOT NULL,
+        artist VARCHAR(255) NOT NULL,
+        album VARCHAR(255),
+        genre VARCHAR(100),
+        year INT,
+        duration INT,
+        audio_url VARCHAR(500),
+        features TEXT,
+        popularity_score INT DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS user_preferences (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(100),
+        music_id INT,
+        preference_score FLOAT DEFAULT 1.0,
+        interaction_type VARCHAR(50),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_user_preferences_user_music (user_id, music_id),
+        FOREIGN KEY (music_id) REFERENCES music(id) ON DELETE CASCADE
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS listening_history (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(100),
+        music_id INT,
+        play_duration INT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (music_id) REFERENCES music(id) ON DELETE CASCADE
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS liked_songs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(100) NOT NULL,
+        music_id INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_liked_songs_user_music (user_id, music_id),
+        FOREIGN KEY (music_id) REFERENCES music(id) ON DELETE CASCADE
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(100) NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_playlists_user_name (user_id, name)
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS playlist_songs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        playlist_id INT NOT NULL,
+        music_id INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_playlist_songs_playlist_music (playlist_id, music_id),
+        FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE,
+        FOREIGN KEY (music_id) REFERENCES music(id) ON DELETE CASCADE
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+]
+
+
+def get_table_columns(cursor, dialect, table):
+    """Return the column names of ``table``"""
+    if dialect == 'mysql':
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ?",
+            (table,)
+        )
+    else:
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in cursor.fetchall()]
+    return [row[0] for row in cursor.fetchall()]
+
+
+def add_users_role_column(cursor, dialect):
+    """Older databases were created before users.role existed"""
+    if 'role' not in get_table_columns(cursor, dialect, 'users'):
+        role_type = 'VARCHAR(20)' if dialect == 'mysql' else 'TEXT'
+        cursor.execute(f"ALTER TABLE users ADD COLUMN role {role_type} NOT NULL DEFAULT 'User'")
+    if dialect == 'mysql':
+        # init_db.py created user_preferences without the unique pair the upsert relies on
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+            "AND TABLE_NAME = 'user_preferences' AND INDEX_NAME = 'uq_user_preferences_user_music'"
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                "ALTER TABLE user_preferences ADD UNIQUE KEY uq_user_preferences_user_music (user_id, music_id)"
+            )
+
+
+# Covering indexes for the hot routes: recently played (dashboard,
+# update_recommendation), genre filters (/preferences), popularity shelves
+# (/home, /api/stats), favorites and the personalised seeds on /home.
+HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_listening_history_user_time ON listening_history(user_id, timestamp, music_id)",
+    "CREATE INDEX IF NOT EXISTS idx_music_genre ON music(genre)",
+    "CREATE INDEX IF NOT EXISTS idx_music_popularity ON music(popularity_score, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_music_created_at ON music(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_liked_songs_user_created ON liked_songs(user_id, created_at, music_id)",
+    "CREATE INDEX IF NOT EXISTS idx_user_preferences_user_score ON user_preferences(user_id, preference_score, music_id)",
+]
+
+HOT_PATH_INDEX_VERSION = 3
+
+# Precomputed daily mixes written by daily_mix_job.py and served on /home
+USER_RECOMMENDATIONS_TABLE = {
+    'sqlite': """
+    CREATE TABLE IF NOT EXISTS user_recommendations (
+        user_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        music_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        generated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, position)
+    )
+    """,
+    'mysql': f"""
+    CREATE TABLE IF NOT EXISTS user_recommendations (
+        user_id VARCHAR(100) NOT NULL,
+        position INT NOT NULL,
+        music_id INT NOT NULL,
+        score FLOAT NOT NULL,
+        generated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, position)
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+}
+
+# Last play-event log id folded into the tables above, per consumer (play_events.py)
+PLAY_EVENT_OFFSETS_TABLE = {
+    'sqlite': """
+    CREATE TABLE IF NOT EXISTS play_event_offsets (
+        consumer TEXT PRIMARY KEY,
+        last_event_id INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    'mysql': f"""
+    CREATE TABLE IF NOT EXISTS play_event_offsets (
+        consumer VARCHAR(100) PRIMARY KEY,
+        last_event_id BIGINT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+}
+
+# Watermark of the decayed popularity rollup (popularity_rollup.py)
+POPULARITY_ROLLUP_STATE_TABLE = {
+    'sqlite': """
+    CREATE TABLE IF NOT EXISTS popularity_rollup_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_history_id INTEGER NOT NULL,
+        rolled_up_at REAL NOT NULL
+    )
+    """,
+    'mysql': f"""
+    CREATE TABLE IF NOT EXISTS popularity_rollup_state (
+        id INT PRIMARY KEY,
+        last_history_id BIGINT NOT NULL,
+        rolled_up_at DOUBLE NOT NULL
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+}
+
+# Bounded per-user recently-played list (recent_plays.py)
+RECENT_PLAYS_TABLE = {
+    'sqlite': """
+    CREATE TABLE IF NOT EXISTS recent_plays (
+        user_id TEXT NOT NULL,
+        music_id INTEGER NOT NULL,
+        played_at REAL NOT NULL,
+        PRIMARY KEY (user_id, music_id)
+    )
+    """,
+    'mysql': f"""
+    CREATE TABLE IF NOT EXISTS recent_plays (
+        user_id VARCHAR(100) NOT NULL,
+        music_id INT NOT NULL,
+        played_at DOUBLE NOT NULL,
+        PRIMARY KEY (user_id, music_id)
+    ) {MYSQL_TABLE_OPTIONS}
+    """,
+}
+
+# Seed it with each user's 10 (RECENT_PLAYS_SIZE) most recently played distinct songs
+RECENT_PLAYS_BACKFILL = """
+INSERT INTO recent_plays (user_id, music_id, played_at)
+SELECT user_id, music_id, played_at FROM (
+    SELECT user_id, music_id, {epoch} AS played_at,
+           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY MAX(timestamp) DESC) AS recency
+    FROM listening_history
+    WHERE user_id IS NOT NULL AND timestamp IS NOT NULL
+    GROUP BY user_id, music_id
+) AS ranked
+WHERE recency <= 10
+"""
+
+# Next-track model (next_track.py): decayed song->song transition counts,
+# each song's top successors, the last play per user and the watermark
+NEXT_TRACK_TABLES = {
+    'sqlite': [
+        """
+        CREATE TABLE IF NOT EXISTS song_transitions (
+            from_music_id INTEGER NOT NULL,
+            to_music_id INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (from_music_id, to_music_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS next_track_top (
+            music_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            next_music_id INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (music_id, position)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS next_track_session_tails (
+            user_id TEXT PRIMARY KEY,
+            music_id INTEGER NOT NULL,
+            played_at REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS next_track_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_history_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ],
+    'mysql': [
+        f"""
+        CREATE TABLE IF NOT EXISTS song_transitions (
+            from_music_id INT NOT NULL,
+            to_music_id INT NOT NULL,
+            weight DOUBLE NOT NULL,
+            PRIMARY KEY (from_music_id, to_music_id)
+        ) {MYSQL_TABLE_OPTIONS}
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS next_track_top (
+            music_id INT NOT NULL,
+            position INT NOT NULL,
+            next_music_id INT NOT NULL,
+            weight DOUBLE NOT NULL,
+            PRIMARY KEY (music_id, position)
+        ) {MYSQL_TABLE_OPTIONS}
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS next_track_session_tails (
+            user_id VARCHAR(100) PRIMARY KEY,
+            music_id INT NOT NULL,
+            played_at DOUBLE NOT NULL
+        ) {MYSQL_TABLE_OPTIONS}
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS next_track_state (
+            id INT PRIMARY KEY,
+            last_history_id BIGINT NOT NULL,
+            updated_at DOUBLE NOT NULL
+        ) {MYSQL_TABLE_OPTIONS}
+        """,
+    ],
+}
+
+def add_music_track_id_column(cursor, dialect):
+    """Spotify track id, so CSV reloads upsert songs instead of re-inserting them"""
+    if 'track_id' not in get_table_columns(cursor, dialect, 'music'):
+        track_id_type = 'VARCHAR(255)' if dialect == 'mysql' else 'TEXT'
+        cursor.execute(f"ALTER TABLE music ADD COLUMN track_id {track_id_type}")
+
+
+
+def add_music_content_hash_column(cursor, dialect):
+    """Hash of a song's source row, so a sync only rewrites songs whose content changed"""
+    if 'content_hash' not in get_table_columns(cursor, dialect, 'music'):
+        hash_type = 'BIGINT' if dialect == 'mysql' else 'INTEGER'
+        cursor.execute(f"ALTER TABLE music ADD COLUMN content_hash {hash_type}")
+
+
+def add_popularity_epoch_column(cursor, dialect):
+    """Time the stored popularity scores are decayed to, so a rollup only touches played songs"""
+    if 'epoch' not in get_table_columns(cursor, dialect, 'popularity_rollup_state'):
+        epoch_type = 'DOUBLE' if dialect == 'mysql' else 'REAL'
+        cursor.execute(f"ALTER TABLE popularity_rollup_state ADD COLUMN epoch {epoch_type}")
+
+
+def add_next_track_epoch_columns(cursor, dialect):
+    """Epoch of the stored transition weights, and the run that wrote each next_track_top row"""
+    time_type = 'DOUBLE' if dialect == 'mysql' else 'REAL'
+    if 'epoch' not in get_table_columns(cursor, dialect, 'next_track_state'):
+        cursor.execute(f"ALTER TABLE next_track_state ADD COLUMN epoch {time_type}")
+    if 'updated_at' not in get_table_columns(cursor, dialect, 'next_track_top'):
+        cursor.execute(f"ALTER TABLE next_track_top ADD COLUMN updated_at {time_type}")
+
+
+def add_music_source_column(cursor, dialect):
+    """Catalog source (e.g. the Spotify CSV) a synced song came from; NULL for admin-added songs"""
+    if 'source' not in get_table_columns(cursor, dialect, 'music'):
+        source_type = 'VARCHAR(20)' if dialect == 'mysql' else 'TEXT'
+        cursor.execute(f"ALTER TABLE music ADD COLUMN source {source_type}")
+
+
+MIGRATIONS = [
+    (1, 'initial schema', [{'sqlite': SQLITE_INITIAL_SCHEMA, 'mysql': MYSQL_INITIAL_SCHEMA}]),
+    (2, 'add users.role', [add_users_role_column]),
+    (HOT_PATH_INDEX_VERSION, 'hot-path covering indexes', HOT_PATH_INDEXES + [{
+        'sqlite': "ANALYZE",
+        'mysql': "ANALYZE TABLE music, listening_history, liked_songs, user_preferences",
+    }]),
+    (4, 'user_recommendations table', [USER_RECOMMENDATIONS_TABLE]),
+    (5, 'play_event_offsets table', [PLAY_EVENT_OFFSETS_TABLE]),
+    # Decayed scores are fractional; SQLite's INTEGER affinity already keeps REALs
+    (6, 'decayed popularity rollup', [POPULARITY_ROLLUP_STATE_TABLE, {
+        'mysql': "ALTER TABLE music MODIFY popularity_score DOUBLE DEFAULT 0",
+    }]),
+    (7, 'recent_plays table', [RECENT_PLAYS_TABLE, {
+        'sqlite': RECENT_PLAYS_BACKFILL.format(epoch="CAST(strftime('%s', MAX(timestamp)) AS REAL)"),
+        'mysql': RECENT_PLAYS_BACKFILL.format(epoch="UNIX_TIMESTAMP(MAX(timestamp))"),
+    }]),
+    (8, 'next-track transition tables', [NEXT_TRACK_TABLES]),
+    (9, 'music.track_id for idempotent CSV upserts', [
+        add_music_track_id_column,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_music_track_id ON music(track_id)",
+    ]),
+    (10, 'music.content_hash for incremental catalog sync', [add_music_content_hash_column]),
+    (11, 'popularity rollup epoch for lazy decay', [add_popularity_epoch_column]),
+    (12, 'next-track epoch and per-song reloads', [
+        add_next_track_epoch_columns,
+        "CREATE INDEX IF NOT EXISTS idx_next_track_top_updated ON next_track_top(updated_at)",
+    ]),
+    (13, 'music.source so a sync only prunes its own songs', [add_music_source_column]),
+]
+
+
+def get_schema_version(connection):
+    """Return the highest applied migration version (0 for a new database)"""
+    cursor = connection.cursor()
+    cursor.execute(CREATE_SCHEMA_VERSION_TABLE)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+def run_step(cursor, step, dialect):
+    """Execute a single migration step for ``dialect``"""
+    if callable(step):
+        step(cursor, dialect)
+        return
+    if isinstance(step, dict):
+        step = step.get(dialect, [])
+    statements = [step] if isinstance(step, str) else step
+    for statement in statements:
+        cursor.execute(statement)
+        if cursor.description:
+            cursor.fetchall()
+
+
+def run_migrations(connection, target=None, dialect='sqlite'):
+    """Apply all pending migrations up to ``target`` (default: latest).
+
+    Every migration runs in its own transaction together with its
+    schema_version row, so a failure leaves the database at the last
+    successfully applied version.
+    """
+    current = get_schema_version(connection)
+    cursor = connection.cursor()
+    for version, description, steps in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        try:
+            for step in steps:
+                run_step(cursor, step, dialect)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            connection.commit()
+            current = version
+            logger.info(f"Applied migration {version}: {description}")
+        except Exception as e:
+            connection.rollback()
+            logger.error(f"Migration {version} ({description}) failed: {e}")
+            raise
+    return current
@@ -0,0 +1,321 @@
+"""Next-track model learned from listening sessions.
+
+``listening_history`` is split into sessions per user: two consecutive plays
+belong to the same session when they are at most ``SESSION_GAP_SECONDS``
+apart. Every consecutive pair of different songs in a session is a
+transition. ``song_transitions`` holds the sparse song->song matrix of
+decayed transition counts. Like the popularity rollup, decay is lazy. Weights
+are stored as of the ``epoch`` in ``next_track_state``, and each run only
+adds the new transitions past the watermark, so edges without new plays are
+never written. Decay is the same factor for every edge (``transition_scale()``),
+so it never changes a song's ranking. Once the epoch is
+``REBASE_AFTER_HALF_LIVES`` half-lives old, all weights are rescaled to a new
+epoch and edges below ``MIN_TRANSITION_WEIGHT`` are pruned. History is read in
+``FETCH_SIZE`` chunks and sessionized with numpy, so millions of rows never
+go through per-row Python. Each user's last play is kept in
+``next_track_session_tails``, so sessions that span runs are stitched
+together.
+
+After each run, the songs whose transitions changed get their top
+``NEXT_TRACK_TOP_N`` successors rewritten in ``next_track_top``, stamped with
+the run's time. ``NextTrackIndex`` keeps that table in a dict, so serving
+"up next" is a constant-time lookup. When a newer run has finished, the index
+reloads only the songs that run rewrote. After a rebase it reloads the whole
+table.
+
+    */10 * * * * cd /path/to/app && python next_track.py
+"""
+import argparse
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SESSION_GAP_SECONDS = float(os.environ.get('SESSION_GAP_SECONDS', str(30 * 60)))
+NEXT_TRACK_HALF_LIFE_DAYS = float(os.environ.get('NEXT_TRACK_HALF_LIFE_DAYS', '30'))
+NEXT_TRACK_TOP_N = 20
+NEXT_TRACK_RELOAD_SECONDS = 60
+# Decayed transitions below this weight are pruned to keep the matrix sparse
+MIN_TRANSITION_WEIGHT = 0.01
+REBASE_AFTER_HALF_LIVES = 8
+FETCH_SIZE = 50000
+
+CREATE_INCREMENTS_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS transition_increments (
+    from_music_id INTEGER NOT NULL,
+    to_music_id INTEGER NOT NULL,
+    delta REAL NOT NULL,
+    PRIMARY KEY (from_music_id, to_music_id)
+)
+"""
+
+CREATE_DIRTY_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS next_track_dirty (
+    music_id INTEGER PRIMARY KEY
+)
+"""
+
+# SQLite needs a WHERE clause to parse ON CONFLICT after INSERT ... SELECT
+APPLY_INCREMENTS = """
+INSERT INTO song_transitions (from_music_id, to_music_id, weight)
+SELECT from_music_id, to_music_id, delta FROM transition_increments
+WHERE 1 = 1
+ON CONFLICT(from_music_id, to_music_id) DO UPDATE SET
+weight = weight + excluded.weight
+"""
+
+# Edges that have decayed below the pruning weight since the epoch are left out
+REBUILD_TOP = """
+INSERT INTO next_track_top (music_id, position, next_music_id, weight, updated_at)
+SELECT from_music_id, position, to_music_id, weight, ? FROM (
+    SELECT t.from_music_id, t.to_music_id, t.weight,
+           ROW_NUMBER() OVER (PARTITION BY t.from_music_id
+                              ORDER BY t.weight DESC, t.to_music_id) AS position
+    FROM song_transitions t
+    JOIN next_track_dirty d ON d.music_id = t.from_music_id
+    WHERE t.weight >= ?
+) AS ranked
+WHERE position <= ?
+"""
+
+
+def decay_rate(half_life_days=NEXT_TRACK_HALF_LIFE_DAYS):
+    return math.log(2) / (half_life_days * 86400)
+
+
+def get_watermark(cursor):
+    """Return (last_history_id, epoch) or None before the first run"""
+    cursor.execute("SELECT last_history_id, updated_at, epoch FROM next_track_state WHERE id = 1")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    # Weights written before the epoch column existed were decayed to each run's time
+    return row[0], row[2] if row[2] is not None else row[1]
+
+
+def transition_scale(cursor, half_life_days=NEXT_TRACK_HALF_LIFE_DAYS, now=None):
+    """Factor that turns stored transition weights into weights as of ``now``"""
+    now = time.time() if now is None else now
+    watermark = get_watermark(cursor)
+    if watermark is None:
+        return 1.0
+    return math.exp(-decay_rate(half_life_days) * max(now - watermark[1], 0.0))
+
+
+def load_tails(cursor):
+    cursor.execute("SELECT user_id, music_id, played_at FROM next_track_session_tails")
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def sessionize(user_ids, music_ids, seconds, history_ids, tails, gap=SESSION_GAP_SECONDS):
+    """Transitions in one chunk of plays, stitched to each user's previous tail.
+
+    Returns ``(from_ids, to_ids, played_at)`` arrays and updates ``tails``
+    in place with each user's last play.
+    """
+    codes, users = pd.factorize(pd.Series(user_ids, dtype=object))
+    # Carried-over tails go first in each user's run of plays
+    tail_users = [code for code, user in enumerate(users) if user in tails]
+    tail_music = [tails[users[code]][0] for code in tail_users]
+    tail_seconds = [tails[users[code]][1] for code in tail_users]
+
+    codes = np.concatenate([np.asarray(tail_users, dtype=np.int64), codes])
+    music = np.concatenate([np.asarray(tail_music, dtype=np.int64), music_ids])
+    played = np.concatenate([np.asarray(tail_seconds, dtype=np.float64), seconds])
+    order_key = np.concatenate([np.full(len(tail_users), -1, dtype=np.int64), history_ids])
+
+    order = np.lexsort((order_key, played, codes))
+    codes, music, played = codes[order], music[order], played[order]
+
+    same_session = ((codes[1:] == codes[:-1])
+                    & (played[1:] - played[:-1] <= gap)
+                    & (music[1:] != music[:-1]))
+    from_ids = music[:-1][same_session]
+    to_ids = music[1:][same_session]
+    to_played = played[1:][same_session]
+
+    last = np.flatnonzero(np.append(codes[1:] != codes[:-1], True))
+    for code, music_id, played_at in zip(codes[last].tolist(), music[last].tolist(), played[last].tolist()):
+        tails[users[code]] = (music_id, played_at)
+    return from_ids, to_ids, to_played
+
+
+def transition_increments(cursor, after_id, up_to_id, now, epoch, rate, tails, touched):
+    """Transition counts over history rows in (after_id, up_to_id], decayed to ``epoch``.
+
+    Returns ``(DataFrame[from_music_id, to_music_id, delta], rows_read)``;
+    users whose tail moved are added to ``touched``.
+    """
+    cursor.execute(
+        "SELECT id, user_id, music_id, timestamp FROM listening_history "
+        "WHERE id > ? AND id <= ? AND user_id IS NOT NULL ORDER BY id",
+        (after_id, up_to_id)
+    )
+    parts = []
+    rows_read = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        rows_read += len(rows)
+        frame = pd.DataFrame.from_records([tuple(row) for row in rows],
+                                          columns=['id', 'user_id', 'music_id', 'timestamp'])
+        played_at = pd.to_datetime(frame['timestamp'], errors='coerce', format='ISO8601')
+        frame = frame[played_at.notna() & frame['music_id'].notna()]
+        if frame.empty:
+            continue
+        seconds = played_at[frame.index].values.astype('datetime64[ms]').astype(np.float64) / 1000
+        user_ids = frame['user_id'].astype(str).to_numpy()
+        from_ids, to_ids, to_played = sessionize(
+            user_ids, frame['music_id'].to_numpy(dtype=np.int64),
+            seconds, frame['id'].to_numpy(dtype=np.int64), tails
+        )
+        touched.update(user_ids.tolist())
+        weights = np.exp(rate * (np.minimum(to_played, now) - epoch))
+        parts.append(pd.DataFrame({'from_music_id': from_ids, 'to_music_id': to_ids, 'delta': weights})
+                     .groupby(['from_music_id', 'to_music_id'], as_index=False)['delta'].sum())
+
+    if not parts:
+        return pd.DataFrame(columns=['from_music_id', 'to_music_id', 'delta']), rows_read
+    increments = pd.concat(parts).groupby(['from_music_id', 'to_music_id'], as_index=False)['delta'].sum()
+    return increments, rows_read
+
+
+def run_transitions(connection, half_life_days=NEXT_TRACK_HALF_LIFE_DAYS, now=None, top_n=NEXT_TRACK_TOP_N):
+    """Fold new sessions into the transition matrix; returns the number of plays read"""
+    now = time.time() if now is None else now
+    rate = decay_rate(half_life_days)
+    cursor = connection.cursor()
+    try:
+        watermark = get_watermark(cursor)
+        cursor.execute("SELECT MAX(id) FROM listening_history")
+        up_to_id = cursor.fetchone()[0] or 0
+        after_id, epoch = (0, now) if watermark is None else watermark
+        tails = load_tails(cursor)
+        touched = set()
+
+        cursor.execute(CREATE_DIRTY_TABLE)
+        cursor.execute("DELETE FROM next_track_dirty")
+        if now - epoch > REBASE_AFTER_HALF_LIVES * half_life_days * 86400:
+            # Decay is uniform, so only pruned songs change rank
+            cursor.execute("UPDATE song_transitions SET weight = weight * ?", (math.exp(-rate * (now - epoch)),))
+            cursor.execute(
+                "INSERT INTO next_track_dirty (music_id) "
+                "SELECT DISTINCT from_music_id FROM song_transitions WHERE weight < ?",
+                (MIN_TRANSITION_WEIGHT,)
+            )
+            cursor.execute("DELETE FROM song_transitions WHERE weight < ?", (MIN_TRANSITION_WEIGHT,))
+            logger.info(f"Rebased transition weights from epoch {epoch:.0f} to {now:.0f}")
+            epoch = now
+
+        increments, plays = transition_increments(cursor, after_id, up_to_id, now, epoch, rate, tails, touched)
+
+        cursor.execute(CREATE_INCREMENTS_TABLE)
+        cursor.execute("DELETE FROM transition_increments")
+        cursor.executemany(
+            "INSERT INTO transition_increments (from_music_id, to_music_id, delta) VALUES (?, ?, ?)",
+            list(increments.itertuples(index=False, name=None))
+        )
+        cursor.execute(APPLY_INCREMENTS)
+        cursor.executemany(
+            "INSERT INTO next_track_dirty (music_id) VALUES (?) ON CONFLICT(music_id) DO NOTHING",
+            [(int(music_id),) for music_id in increments['from_music_id'].unique()]
+        )
+
+        cursor.execute("DELETE FROM next_track_top WHERE music_id IN (SELECT music_id FROM next_track_dirty)")
+        cursor.execute(REBUILD_TOP, (now, MIN_TRANSITION_WEIGHT * math.exp(rate * (now - epoch)), top_n))
+
+        cursor.executemany(
+            """
+            INSERT INTO next_track_session_tails (user_id, music_id, played_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+            music_id = excluded.music_id,
+            played_at = excluded.played_at
+            """,
+            [(user_id, *tails[user_id]) for user_id in touched]
+        )
+        cursor.execute(
+            """
+            INSERT INTO next_track_state (id, last_history_id, updated_at, epoch) VALUES (1, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+            last_history_id = excluded.last_history_id,
+            updated_at = excluded.updated_at,
+            epoch = excluded.epoch
+            """,
+            (up_to_id, now, epoch)
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    logger.info(f"Next-track model folded {plays} plays into {len(increments)} transitions")
+    return plays
+
+
+class NextTrackIndex:
+    """In-memory ``{music_id: [next_music_id, ...]}`` loaded from next_track_top"""
+
+    def __init__(self, reload_seconds=NEXT_TRACK_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self.next_tracks = {}
+        self.version = None
+        self.epoch = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT updated_at, epoch FROM next_track_state WHERE id = 1")
+        row = cursor.fetchone()
+        version, epoch = (row[0], row[1]) if row else (None, None)
+        if version is not None and version != self.version:
+            # A rebase may prune songs from the table, which only a full load notices
+            full = self.version is None or epoch != self.epoch
+            if full:
+                cursor.execute("SELECT music_id, next_music_id FROM next_track_top ORDER BY music_id, position")
+            else:
+                cursor.execute(
+                    "SELECT music_id, next_music_id FROM next_track_top WHERE updated_at > ? "
+                    "ORDER BY music_id, position",
+                    (self.version,)
+                )
+            changed = {}
+            for music_id, next_music_id in cursor.fetchall():
+                changed.setdefault(music_id, []).append(next_music_id)
+            self.next_tracks = changed if full else {**self.next_tracks, **changed}
+            self.version, self.epoch = version, epoch
+            logger.info(f"Loaded next-track candidates for {len(changed)} songs"
+                        f"{'' if full else ' changed in the latest runs'}")
+        self.checked_at = time.monotonic()
+
+    def get(self, connection, music_id, limit=10):
+        """Most likely next songs after ``music_id``; reloads at most every reload_seconds"""
+        if time.monotonic() - self.checked_at >= self.reload_seconds:
+            with self.lock:
+                if time.monotonic() - self.checked_at >= self.reload_seconds:
+                    self.load(connection)
+        return self.next_tracks.get(music_id, [])[:limit]
+
+
+next_track_index = NextTrackIndex()
+
+
+if __name__ == '__main__':
+    from storage import create_storage
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--half-life-days', type=float, default=NEXT_TRACK_HALF_LIFE_DAYS)
+    parser.add_argument('--top-n', type=int, default=NEXT_TRACK_TOP_N)
+    args = parser.parse_args()
+
+    storage = create_storage()
+    storage.migrate()
+    run_transitions(storage.get_connection(), args.half_life_days, top_n=args.top_n)
+    storage.close()
@@ -0,0 +1,276 @@
+"""Batched, durable ingestion of play telemetry.
+
+Play pings are appended to a local staging log, a separate SQLite file in WAL
+mode, and acknowledged as soon as that append commits. They never wait on
+the main database's write lock. A consumer thread (or
+``python play_events.py`` as a separate process) folds the log into
+``listening_history``, ``user_preferences`` and ``recent_plays`` with one
+bulk transaction per batch. Preference increments are aggregated per (user, song) first, and
+popularity is derived from the history by ``popularity_rollup.py``.
+
+The id of the last folded event is stored in ``play_event_offsets`` in the
+same transaction as the fold, so a crash between folding and truncating the
+log never applies an event twice.
+
+Run a single consumer per log. With several app processes, set
+``PLAY_EVENT_CONSUMER=0`` and run ``python play_events.py`` next to them.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import queries
+from recent_plays import persist_plays
+
+logger = logging.getLogger(__name__)
+
+PLAY_EVENT_LOG_PATH = os.environ.get(
+    'PLAY_EVENT_LOG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'play_events.db')
+)
+CONSUMER_ENABLED = os.environ.get('PLAY_EVENT_CONSUMER', '1') != '0'
+DRAIN_INTERVAL_SECONDS = float(os.environ.get('PLAY_EVENT_DRAIN_SECONDS', '1.0'))
+DRAIN_BATCH_SIZE = 5000
+MAX_EVENTS_PER_REQUEST = 1000
+CONSUMER_NAME = 'default'
+
+# Same weight record_user_interaction() applies to a single play
+PLAY_PREFERENCE_SCORE = 1.0
+
+CREATE_LOG_TABLE = """
+CREATE TABLE IF NOT EXISTS play_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    music_id INTEGER NOT NULL,
+    play_duration INTEGER,
+    interaction_type TEXT NOT NULL,
+    received_at TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+)
+"""
+
+
+def parse_events(payload, default_user_id='anonymous', interaction_type='play'):
+    """Validate a single event, a list of events or ``{"events": [...]}``.
+
+    ``'play'`` events update history and preferences; ``'listen'``
+    events (the player's ``/listen`` ping) only add to the history.
+
+    Returns a list of ``(user_id, music_id, play_duration, interaction_type)``
+    tuples, or raises ``ValueError`` describing the first bad event.
+    """
+    if isinstance(payload, dict) and 'events' in payload:
+        payload = payload['events']
+    events = payload if isinstance(payload, list) else [payload]
+    if not events:
+        raise ValueError('No play events given')
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        raise ValueError(f'At most {MAX_EVENTS_PER_REQUEST} events per request')
+
+    parsed = []
+    for position, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError(f'Event {position} is not an object')
+        try:
+            music_id = int(event.get('music_id'))
+            duration = int(event.get('duration') or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f'Event {position}: music_id and duration must be integers')
+        user_id = str(event.get('user_id') or default_user_id)
+        parsed.append((user_id, music_id, duration, interaction_type))
+    return parsed
+
+
+class PlayEventLog:
+    """Append-only staging log of play events in a WAL-mode SQLite file"""
+
+    def __init__(self, path=PLAY_EVENT_LOG_PATH):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False,
+                                              cached_statements=queries.STATEMENT_CACHE_SIZE)
+            self.connection.row_factory = sqlite3.Row
+            # WAL appends are sequential writes; NORMAL still survives an app crash
+            self.connection.execute('PRAGMA journal_mode = WAL;')
+            self.connection.execute('PRAGMA synchronous = NORMAL;')
+            self.connection.execute(CREATE_LOG_TABLE)
+        return self.connection
+
+    def append(self, events):
+        """Durably append parsed events; returns how many were written"""
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT INTO play_events (user_id, music_id, play_duration, interaction_type) "
+                    "VALUES (?, ?, ?, ?)",
+                    events
+                )
+        return len(events)
+
+    def read(self, after_id, limit=DRAIN_BATCH_SIZE):
+        """Return up to ``limit`` events with an id greater than ``after_id``"""
+        with self.lock:
+            cursor = self._connect().execute(
+                "SELECT * FROM play_events WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)
+            )
+            return cursor.fetchall()
+
+    def truncate(self, up_to_id):
+        """Drop events that have been folded into the main database"""
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM play_events WHERE id <= ?", (up_to_id,))
+
+    def pending(self):
+        with self.lock:
+            return self._connect().execute("SELECT COUNT(*) FROM play_events").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def received_epoch(received_at):
+    """UTC ``received_at`` text (millisecond precision) as epoch seconds"""
+    return datetime.fromisoformat(received_at).replace(tzinfo=timezone.utc).timestamp()
+
+
+def get_offset(connection, consumer=CONSUMER_NAME):
+    cursor = connection.cursor()
+    cursor.execute("SELECT last_event_id FROM play_event_offsets WHERE consumer = ?", (consumer,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def existing_music_ids(cursor, music_ids):
+    """Subset of ``music_ids`` still in the catalog (deleted songs are dropped)"""
+    return {row[0] for row in queries.fetch_in(cursor, 'existing_music_ids', music_ids)}
+
+
+def fold_events(connection, events, consumer=CONSUMER_NAME):
+    """Apply a batch of logged events and advance the offset in one transaction"""
+    # The offset moves past every event read, including any whose song has
+    # since been deleted and is skipped below
+    last_event_id = events[-1]['id']
+    cursor = connection.cursor()
+    try:
+        known = existing_music_ids(cursor, {event['music_id'] for event in events})
+        events = [event for event in events if event['music_id'] in known]
+
+        cursor.executemany(
+            "INSERT INTO listening_history (user_id, music_id, play_duration, timestamp) "
+            "VALUES (?, ?, ?, ?)",
+            [(e['user_id'], e['music_id'], e['play_duration'], e['received_at']) for e in events]
+        )
+
+        persist_plays(cursor, [
+            (e['user_id'], e['music_id'], received_epoch(e['received_at'])) for e in events
+        ])
+
+        plays = [event for event in events if event['interaction_type'] == 'play']
+        preference_counts = Counter((event['user_id'], event['music_id']) for event in plays)
+        queries.executemany(cursor, 'upsert_preference', [
+            (user_id, music_id, count * PLAY_PREFERENCE_SCORE, 'play')
+            for (user_id, music_id), count in preference_counts.items()
+        ])
+
+        cursor.execute(
+            """
+            INSERT INTO play_event_offsets (consumer, last_event_id) VALUES (?, ?)
+            ON CONFLICT(consumer) DO UPDATE SET
+            last_event_id = excluded.last_event_id,
+            updated_at = CURRENT_TIMESTAMP
+            """,
+            (consumer, last_event_id)
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return last_event_id
+
+
+def drain(storage, log, batch_size=DRAIN_BATCH_SIZE, consumer=CONSUMER_NAME):
+    """Fold everything currently in the log; returns the number of events applied"""
+    folded = 0
+    try:
+        connection = storage.get_connection()
+        offset = get_offset(connection, consumer)
+        while True:
+            events = log.read(offset, batch_size)
+            if not events:
+                break
+            offset = fold_events(connection, events, consumer)
+            log.truncate(offset)
+            folded += len(events)
+    finally:
+        storage.release()
+    return folded
+
+
+class PlayEventConsumer(threading.Thread):
+    """Background thread draining the log every ``interval`` seconds"""
+
+    def __init__(self, storage, log, interval=DRAIN_INTERVAL_SECONDS):
+        super().__init__(name='play-event-consumer', daemon=True)
+        self.storage = storage
+        self.log = log
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the thread on first use (so importing the app never spawns it)"""
+        if not CONSUMER_ENABLED or self.is_alive():
+            return
+        with self.start_lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                folded = drain(self.storage, self.log)
+                if folded:
+                    logger.info(f"Folded {folded} play events into the database")
+            except Exception as e:
+                logger.error(f"Play event consumer error: {e}")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    from storage import create_storage
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='drain the log once and exit')
+    parser.add_argument('--interval', type=float, default=DRAIN_INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    storage = create_storage()
+    storage.migrate()
+    log = PlayEventLog()
+    if args.once:
+        logger.info(f"Folded {drain(storage, log)} play events")
+    else:
+        while True:
+            folded = drain(storage, log)
+            if folded:
+                logger.info(f"Folded {folded} play events")
+            time.sleep(args.interval)
@@ -0,0 +1,160 @@
+"""Time-decayed popularity rollup.
+
+``music.popularity_score`` is an exponentially decayed play count: each play
+adds 1 and then halves every ``POPULARITY_HALF_LIFE_DAYS``. Decay is applied
+lazily. Stored scores are all expressed as of one shared ``epoch`` (kept in
+``popularity_rollup_state``), so a play at time t adds exp(rate * (t - epoch)).
+The score as of now is the stored score times ``popularity_scale()``. Every
+song shares that factor, so ``ORDER BY popularity_score`` ranks by the
+current score without rewriting any row.
+
+The rollup is incremental. Each run reads only the ``listening_history``
+rows past the stored watermark and adds their weights to the songs that were
+played, one keyed UPDATE per song. Songs without new plays are never written.
+Once the epoch is ``REBASE_AFTER_HALF_LIVES`` half-lives old, the nonzero
+scores are rescaled to a new epoch in one pass, which keeps the stored
+numbers small. With the default half-life that happens about every eight
+weeks. Plays never update ``music`` directly, so popular songs are no longer
+hot rows.
+
+The first run has no watermark. It rebuilds every score from the full
+history and discards the old undecayed counters. Schedule it every few
+minutes, e.g. with cron:
+
+    */5 * * * * cd /path/to/app && python popularity_rollup.py
+"""
+import argparse
+import logging
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+POPULARITY_HALF_LIFE_DAYS = float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', '7'))
+ROLLUP_INTERVAL_SECONDS = 300
+FETCH_SIZE = 10000
+
+REBASE_AFTER_HALF_LIVES = 8
+
+# Keyed on the primary key, so only played songs are touched (and MySQL never
+# has to reopen a temporary table)
+APPLY_INCREMENT = "UPDATE music SET popularity_score = popularity_score + ? WHERE id = ?"
+RESCALE_SCORES = "UPDATE music SET popularity_score = popularity_score * ? WHERE popularity_score <> 0"
+
+
+def decay_rate(half_life_days=POPULARITY_HALF_LIFE_DAYS):
+    """Exponential decay constant per second for the given half-life"""
+    return math.log(2) / (half_life_days * 86400)
+
+
+def get_watermark(cursor):
+    """Return (last_history_id, epoch) or None before the first run"""
+    cursor.execute("SELECT last_history_id, rolled_up_at, epoch FROM popularity_rollup_state WHERE id = 1")
+    row = cursor.fetchone()
+    if not row:
+        return None
+    # Scores written before the epoch column existed were decayed to each run's time
+    return row[0], row[2] if row[2] is not None else row[1]
+
+
+def popularity_scale(cursor, half_life_days=POPULARITY_HALF_LIFE_DAYS, now=None):
+    """Factor that turns stored popularity scores into scores as of ``now``"""
+    now = time.time() if now is None else now
+    watermark = get_watermark(cursor)
+    if watermark is None:
+        return 1.0
+    return math.exp(-decay_rate(half_life_days) * max(now - watermark[1], 0.0))
+
+
+def decayed_increments(cursor, after_id, up_to_id, now, epoch, rate):
+    """Sum exp(rate * (played_at - epoch)) per song over the history rows in (after_id, up_to_id].
+
+    Returns ``({music_id: increment}, rows_read)``.
+    """
+    cursor.execute(
+        "SELECT music_id, timestamp FROM listening_history WHERE id > ? AND id <= ?",
+        (after_id, up_to_id)
+    )
+    increments = {}
+    rows_read = 0
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        rows_read += len(rows)
+        music_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        # ISO8601 accepts both CURRENT_TIMESTAMP and the consumer's millisecond timestamps
+        played_at = pd.to_datetime([row[1] for row in rows], errors='coerce', format='ISO8601')
+        seconds = played_at.values.astype('datetime64[s]').astype(np.float64)
+        # Missing timestamps count as plays right now
+        seconds[played_at.isna()] = now
+        weights = np.exp(rate * (np.minimum(seconds, now) - epoch))
+        unique_ids, inverse = np.unique(music_ids, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights)
+        for music_id, total in zip(unique_ids.tolist(), sums.tolist()):
+            increments[music_id] = increments.get(music_id, 0.0) + total
+    return increments, rows_read
+
+
+def run_rollup(connection, half_life_days=POPULARITY_HALF_LIFE_DAYS, now=None):
+    """Fold new plays into the decayed scores; returns the number of plays read"""
+    now = time.time() if now is None else now
+    rate = decay_rate(half_life_days)
+    cursor = connection.cursor()
+    try:
+        watermark = get_watermark(cursor)
+        cursor.execute("SELECT MAX(id) FROM listening_history")
+        up_to_id = cursor.fetchone()[0] or 0
+        if watermark is None:
+            after_id, epoch = 0, now
+            cursor.execute("UPDATE music SET popularity_score = 0 WHERE popularity_score <> 0")
+        else:
+            after_id, epoch = watermark
+            if now - epoch > REBASE_AFTER_HALF_LIVES * half_life_days * 86400:
+                cursor.execute(RESCALE_SCORES, (math.exp(-rate * (now - epoch)),))
+                logger.info(f"Rebased popularity scores from epoch {epoch:.0f} to {now:.0f}")
+                epoch = now
+
+        increments, plays = decayed_increments(cursor, after_id, up_to_id, now, epoch, rate)
+        cursor.executemany(APPLY_INCREMENT, [(delta, music_id) for music_id, delta in increments.items()])
+        cursor.execute(
+            """
+            INSERT INTO popularity_rollup_state (id, last_history_id, rolled_up_at, epoch) VALUES (1, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+            last_history_id = excluded.last_history_id,
+            rolled_up_at = excluded.rolled_up_at,
+            epoch = excluded.epoch
+            """,
+            (up_to_id, now, epoch)
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    logger.info(f"Popularity rollup folded {plays} plays into {len(increments)} songs")
+    return plays
+
+
+if __name__ == '__main__':
+    from storage import create_storage
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--half-life-days', type=float, default=POPULARITY_HALF_LIFE_DAYS)
+    parser.add_argument('--interval', type=float, default=None,
+                        help=f'keep running every N seconds (e.g. {ROLLUP_INTERVAL_SECONDS}) instead of once')
+    args = parser.parse_args()
+
+    storage = create_storage()
+    storage.migrate()
+    connection = storage.get_connection()
+    while True:
+        run_rollup(connection, args.half_life_days)
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
+    storage.close()
@@ -0,0 +1,165 @@
+"""Named, fixed-shape SQL statements for the data access layer.
+
+Every statement a hot path runs is registered here by name, and its text
+never varies between calls, so sqlite3's per-connection statement cache (and
+``translate_sql``'s cache on MySQL) prepares it once. Variable-length
+``IN (...)`` lists are padded to a small set of bucket sizes by repeating
+the last value, since duplicates in an IN list are harmless. A list of any
+length then maps onto at most ``len(IN_BUCKETS)`` prepared texts per
+statement. Longer lists are split into ``MAX_IN_LIST``-sized chunks.
+
+``execute()`` is also the single place where named statements are timed.
+The timings are kept per statement name, and extra hooks can be attached
+with ``add_timing_hook()``.
+
+    rows = queries.fetch_in(cursor, 'music_by_ids', music_ids)
+"""
+import threading
+import time
+
+# Sized for every registered text (statements x buckets) plus the app's inline SQL
+STATEMENT_CACHE_SIZE = 512
+IN_BUCKETS = (1, 4, 16, 64, 256)
+MAX_IN_LIST = IN_BUCKETS[-1]
+
+STATEMENTS = {
+    # Catalog lookups; {values} is replaced by a bucket-sized placeholder list
+    'music_by_ids': "SELECT * FROM music WHERE id IN ({values})",
+    'existing_music_ids': "SELECT id FROM music WHERE id IN ({values})",
+    'music_ids_by_genres': "SELECT id FROM music WHERE genre IN ({values})",
+    'popular_music': "SELECT * FROM music ORDER BY popularity_score DESC LIMIT ?",
+    # Per-user reads on authenticated routes
+    'user_profile': "SELECT id, name, email, role FROM users WHERE id = ?",
+    'user_top_preferences': """
+        SELECT music_id FROM user_preferences
+        WHERE user_id = ?
+        ORDER BY preference_score DESC
+        LIMIT ?
+    """,
+    'user_daily_mix': """
+        SELECT m.*, r.score AS similarity_score
+        FROM user_recommendations r
+        JOIN music m ON m.id = r.music_id
+        WHERE r.user_id = ? AND r.generated_at >= ?
+        ORDER BY r.position
+        LIMIT ?
+    """,
+    'user_recent_plays': "SELECT music_id FROM recent_plays WHERE user_id = ? ORDER BY played_at DESC LIMIT ?",
+    # Interaction writes
+    'record_listen': """
+        INSERT INTO listening_history (user_id, music_id, timestamp)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+    """,
+    'upsert_preference': """
+        INSERT INTO user_preferences (user_id, music_id, preference_score, interaction_type)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, music_id) DO UPDATE SET
+        preference_score = preference_score + excluded.preference_score,
+        created_at = CURRENT_TIMESTAMP
+    """,
+}
+
+
+def bucket_size(count):
+    """Smallest IN-list bucket that holds ``count`` values"""
+    for size in IN_BUCKETS:
+        if count <= size:
+            return size
+    return MAX_IN_LIST
+
+
+# Every text is built once at import; lookups never format SQL
+COMPILED = {}
+for _name, _sql in STATEMENTS.items():
+    if '{values}' in _sql:
+        for _size in IN_BUCKETS:
+            COMPILED[(_name, _size)] = _sql.format(values=','.join('?' * _size))
+    else:
+        COMPILED[(_name, None)] = _sql
+
+
+def statement(name, in_size=None):
+    """Return the registered SQL text for ``name`` (bucketed IN lists need ``in_size``)"""
+    return COMPILED[(name, in_size)]
+
+
+class StatementTimings:
+    """Call counts and time spent per registered statement name"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, sql, params, elapsed_ms):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = {'name': name, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+                self.entries[name] = entry
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+    def summary(self):
+        """Return the entries ordered by total time spent"""
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        for entry in entries:
+            entry['avg_ms'] = entry['total_ms'] / entry['count']
+        entries.sort(key=lambda e: e['total_ms'], reverse=True)
+        return entries
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+statement_timings = StatementTimings()
+timing_hooks = [statement_timings.observe]
+
+
+def add_timing_hook(hook):
+    """Call ``hook(name, sql, params, elapsed_ms)`` after every named statement"""
+    timing_hooks.append(hook)
+
+
+def execute(cursor, name, params=(), in_size=None):
+    """Run a registered statement on ``cursor`` and report its timing"""
+    sql = COMPILED[(name, in_size)]
+    start = time.perf_counter()
+    try:
+        return cursor.execute(sql, params)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for hook in timing_hooks:
+            hook(name, sql, params, elapsed_ms)
+
+
+def executemany(cursor, name, seq_of_params):
+    """Run a registered statement once per parameter tuple and report its timing"""
+    sql = COMPILED[(name, None)]
+    seq_of_params = list(seq_of_params)
+    start = time.perf_counter()
+    try:
+        return cursor.executemany(sql, seq_of_params)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for hook in timing_hooks:
+            hook(name, sql, seq_of_params[0] if seq_of_params else (), elapsed_ms)
+
+
+def fetch_in(cursor, name, values, params=()):
+    """Fetch all rows of a bucketed IN-list statement for any number of ``values``.
+
+    ``params`` are bound before the IN list. Values are de-duplicated; rows
+    come back in whatever order the database returns them.
+    """
+    values = list(dict.fromkeys(values))
+    rows = []
+    for start in range(0, len(values), MAX_IN_LIST):
+        chunk = values[start:start + MAX_IN_LIST]
+        size = bucket_size(len(chunk))
+        padded = chunk + [chunk[-1]] * (size - len(chunk))
+        execute(cursor, name, tuple(params) + tuple(padded), in_size=size)
+        rows.extend(cursor.fetchall())
+    return rows
@@ -0,0 +1,156 @@
+"""Slow-query detector with automatic EXPLAIN QUERY PLAN capture.
+
+Enable it with ``QUERY_DIAGNOSTICS=1`` (threshold via ``SLOW_QUERY_MS``,
+default 50 ms). Connections opened with ``ProfiledConnection`` time every
+statement; anything over the threshold is logged together with its query
+plan, and plans that fall back to full table scans or temporary B-trees are
+flagged so missing indexes show up from real traffic.
+
+Statements are keyed on their text with string literals replaced by ``?``,
+so values inlined into SQL (emails, search terms) never reach the log or
+``/admin/slow-queries``. Bound parameters are only used to run the plan. At
+most ``MAX_SLOW_QUERIES`` distinct statements are kept; the least recently
+seen one is dropped to make room.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUERY_DIAGNOSTICS = os.environ.get('QUERY_DIAGNOSTICS', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '50'))
+MAX_SLOW_QUERIES = 200
+
+# "SCAN music" / "SCAN TABLE music" without an index is a full table scan
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$')
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and redact string literals so one statement maps to one entry"""
+    return ' '.join(STRING_LITERAL_PATTERN.sub('?', sql).split())
+
+
+class SlowQueryLog:
+    """Aggregates slow statements by SQL text and keeps their query plans"""
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, enabled=QUERY_DIAGNOSTICS, max_entries=MAX_SLOW_QUERIES):
+        self.threshold_ms = threshold_ms
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # least recently seen first
+        self.lock = threading.Lock()
+
+    def observe(self, connection, sql, params, elapsed_ms):
+        """Record a finished statement if it ran over the threshold"""
+        if not self.enabled or elapsed_ms < self.threshold_ms:
+            return
+        key = normalize_sql(sql)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {
+                    'sql': key,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'plan': None,
+                    'full_scan': False,
+                    'temp_btree': False,
+                    'last_seen': None,
+                }
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(key)
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['last_seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            needs_plan = entry['plan'] is None
+
+        if needs_plan:
+            plan = self.explain(connection, sql, params)
+            with self.lock:
+                entry['plan'] = plan
+                entry['full_scan'] = any(FULL_SCAN_PATTERN.match(line) for line in plan)
+                entry['temp_btree'] = any('USE TEMP B-TREE' in line for line in plan)
+
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms): {key}")
+        for line in entry['plan'] or []:
+            logger.warning(f"    plan: {line}")
+
+    @staticmethod
+    def explain(connection, sql, params):
+        """Run EXPLAIN QUERY PLAN for a statement on an unprofiled cursor"""
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        try:
+            cursor = sqlite3.Cursor(connection)
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.debug(f"Could not explain query: {e}")
+            return []
+
+    def worst(self, limit=25):
+        """Return the worst offenders, ordered by total time spent"""
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        for entry in entries:
+            entry['avg_ms'] = entry['total_ms'] / entry['count']
+        entries.sort(key=lambda e: e['total_ms'], reverse=True)
+        return entries[:limit]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that reports the time spent in execute() to the slow-query log.
+
+    sqlite3 runs the first step of a statement inside execute(), so sorts and
+    scans that happen before the first row is produced are included.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            slow_query_log.observe(self.connection, sql, parameters, elapsed_ms)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            params = seq_of_parameters[0] if seq_of_parameters else ()
+            slow_query_log.observe(self.connection, sql, params, elapsed_ms)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose cursors are profiled"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,117 @@
+"""Per-user recently-played lists.
+
+The dashboard sidebar and ``/update_recommendation`` used to rebuild each
+user's recent songs with a DISTINCT join over the whole
+``listening_history``. That grows without bound, and the DISTINCT cannot
+honour ``ORDER BY h.timestamp``. ``RecentlyPlayed`` keeps the last
+``RECENT_PLAYS_SIZE`` distinct song ids per user as an LRU, most recent
+last, in memory for recently active users. The ``recent_plays`` table holds
+at most that many rows per user and backs the LRU, so reading a user's list
+is a dictionary lookup once the user is cached.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+
+logger = logging.getLogger(__name__)
+
+RECENT_PLAYS_SIZE = 10
+MAX_CACHED_USERS = int(os.environ.get('RECENT_PLAYS_CACHED_USERS', '10000'))
+
+# Rows past each user's newest RECENT_PLAYS_SIZE; the derived table lets MySQL
+# delete from the table it ranks
+TRIM_QUERY = """
+DELETE FROM recent_plays
+WHERE user_id = ? AND music_id IN (
+    SELECT music_id FROM (
+        SELECT music_id,
+               ROW_NUMBER() OVER (ORDER BY played_at DESC) AS recency
+        FROM recent_plays
+        WHERE user_id = ?
+    ) AS ranked
+    WHERE recency > ?
+)
+"""
+
+
+class RecentlyPlayed:
+    """LRU of the last ``size`` distinct songs per user, backed by ``recent_plays``"""
+
+    def __init__(self, size=RECENT_PLAYS_SIZE, max_users=MAX_CACHED_USERS):
+        self.size = size
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _cache(self, user_id, music_ids):
+        """Store a user's list (oldest first) and evict the least recently seen users"""
+        self.users[user_id] = OrderedDict.fromkeys(music_ids)
+        self.users.move_to_end(user_id)
+        while len(self.users) > self.max_users:
+            self.users.popitem(last=False)
+
+    def get(self, connection, user_id):
+        """Return the user's recently played song ids, most recent first"""
+        user_id = str(user_id)
+        with self.lock:
+            songs = self.users.get(user_id)
+            if songs is not None:
+                self.users.move_to_end(user_id)
+                return list(reversed(songs))
+
+        cursor = connection.cursor()
+        queries.execute(cursor, 'user_recent_plays', (user_id, self.size))
+        music_ids = [row[0] for row in cursor.fetchall()]
+        with self.lock:
+            if user_id not in self.users:
+                self._cache(user_id, reversed(music_ids))
+        return music_ids
+
+    def touch(self, user_id, music_id):
+        """Move a song to the front of a cached user's list (memory only)"""
+        user_id = str(user_id)
+        with self.lock:
+            songs = self.users.get(user_id)
+            if songs is None:
+                return
+            songs[music_id] = None
+            songs.move_to_end(music_id)
+            while len(songs) > self.size:
+                songs.popitem(last=False)
+
+    def record(self, connection, user_id, music_id, played_at=None):
+        """Record a play in memory and in ``recent_plays``; the caller commits"""
+        self.touch(user_id, music_id)
+        played_at = time.time() if played_at is None else played_at
+        persist_plays(connection.cursor(), [(str(user_id), music_id, played_at)], self.size)
+
+    def forget_song(self, music_id):
+        """Drop a deleted song from every cached list"""
+        with self.lock:
+            for songs in self.users.values():
+                songs.pop(music_id, None)
+
+
+def persist_plays(cursor, plays, size=RECENT_PLAYS_SIZE):
+    """Upsert ``(user_id, music_id, played_at)`` plays and trim each user's rows to ``size``"""
+    latest = {}
+    for user_id, music_id, played_at in plays:
+        key = (user_id, music_id)
+        latest[key] = max(played_at, latest.get(key, played_at))
+    cursor.executemany(
+        """
+        INSERT INTO recent_plays (user_id, music_id, played_at) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, music_id) DO UPDATE SET
+        played_at = CASE WHEN excluded.played_at > played_at THEN excluded.played_at ELSE played_at END
+        """,
+        [(user_id, music_id, played_at) for (user_id, music_id), played_at in latest.items()]
+    )
+    user_ids = {user_id for user_id, _ in latest}
+    cursor.executemany(TRIM_QUERY, [(user_id, user_id, size) for user_id in user_ids])
+
+
+recently_played = RecentlyPlayed()
@@ -0,0 +1,206 @@
+"""Sharded top-k scoring over the song feature matrix.
+
+The catalog matrix (sparse TF-IDF or quantized embeddings) is split into
+``SCORING_SHARDS`` contiguous row shards once per build. A request scores
+every shard in parallel. Each shard keeps only its local top-k, and the
+sorted shard lists are combined with a k-way ``heapq.merge``. No worker
+materialises more than one shard's scores, and the merge touches only
+``shards * k`` candidates.
+
+``SCORING_EXECUTOR`` picks how the shards run:
+
+* ``threads`` (default) - a persistent thread pool. The matrix products run
+  in BLAS / SciPy's C loops, which release the GIL, so shards use separate
+  cores without copying the matrix.
+* ``processes`` - a persistent process pool. Each worker receives the shards
+  once at start-up, and each request only ships the query vectors.
+
+Catalogs smaller than ``MIN_SHARD_ROWS`` per shard are scored inline in one
+shard, where pool overhead would outweigh the gain.
+"""
+import bisect
+import heapq
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from embeddings import SongEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# 0 = one shard per core, capped so no shard is smaller than MIN_SHARD_ROWS
+SCORING_SHARDS = int(os.environ.get('SCORING_SHARDS', '0'))
+SCORING_EXECUTOR = os.environ.get('SCORING_EXECUTOR', 'threads').lower()
+MIN_SHARD_ROWS = 100000
+
+# Shards held by a process-pool worker, set once by _init_worker
+_worker_shards = None
+
+
+def shard_count(n_rows, shards=SCORING_SHARDS):
+    if shards > 0:
+        return max(1, min(shards, n_rows))
+    return max(1, min(os.cpu_count() or 1, n_rows // MIN_SHARD_ROWS))
+
+
+def shard_scores(shard, queries):
+    """Dense (n_queries, shard_rows) cosine scores for one shard"""
+    if isinstance(shard, SongEmbeddings):
+        return shard.scores(queries)
+    return np.asarray((queries @ shard.T).todense(), dtype=np.float32)
+
+
+def shard_top_k(shard, offset, queries, exclude, k):
+    """Local top-k per query as [(index, score), ...], best first, ties by index.
+
+    ``exclude`` holds each query's global seed indices, which score -1.
+    """
+    if k <= 0:
+        return [[] for _ in exclude]
+    scores = shard_scores(shard, queries)
+    n_rows = scores.shape[1]
+    k = min(k, n_rows)
+    results = []
+    for row, seeds in zip(scores, exclude):
+        local = [seed - offset for seed in seeds if offset <= seed < offset + n_rows]
+        row[local] = -1.0
+        kth = row[np.argpartition(-row, k - 1)[k - 1]]
+        # Songs tied with the k-th best fill the remaining slots in catalog order
+        above = np.flatnonzero(row > kth)
+        top = np.concatenate([above, np.flatnonzero(row == kth)[:k - len(above)]])
+        top = top[np.lexsort((top, -row[top]))]
+        results.append(list(zip((top + offset).tolist(), row[top].tolist())))
+    return results
+
+
+def _init_worker(shards):
+    global _worker_shards
+    _worker_shards = shards
+
+
+def _worker_top_k(shard_no, offset, queries, exclude, k):
+    return shard_top_k(_worker_shards[shard_no], offset, queries, exclude, k)
+
+
+class ShardedScorer:
+    """Top-k cosine scoring of seed sets against a row-sharded song matrix"""
+
+    def __init__(self, matrix, shards=SCORING_SHARDS, executor=SCORING_EXECUTOR):
+        self.embeddings = matrix if isinstance(matrix, SongEmbeddings) else None
+        self.n_rows = matrix.shape[0] if self.embeddings is None else matrix.vectors.shape[0]
+        n_shards = shard_count(self.n_rows, shards)
+        bounds = np.linspace(0, self.n_rows, n_shards + 1).astype(int)
+        self.offsets = bounds[:-1].tolist()
+
+        if n_shards == 1:
+            self.shards = [matrix]
+        elif self.embeddings is not None:
+            # Row slices of the dense arrays are views, not copies
+            self.shards = [SongEmbeddings(matrix.vectors[start:end],
+                                          None if matrix.scales is None else matrix.scales[start:end],
+                                          matrix.explained_variance)
+                           for start, end in zip(bounds[:-1], bounds[1:])]
+        else:
+            self.shards = [matrix[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        self.executor = None
+        self.pid = os.getpid()
+        # Queries in flight; close() leaves the pool running until they finish
+        self.lock = threading.Lock()
+        self.active = 0
+        self.closing = False
+        if n_shards > 1:
+            if executor == 'processes':
+                self.executor = ProcessPoolExecutor(max_workers=n_shards, initializer=_init_worker,
+                                                    initargs=(self.shards,))
+            elif executor == 'threads':
+                self.executor = ThreadPoolExecutor(max_workers=n_shards, thread_name_prefix='scoring-shard')
+            else:
+                raise ValueError(f"Unknown SCORING_EXECUTOR: {executor}")
+        self.executor_kind = executor if self.executor is not None else 'inline'
+        logger.info(f"Scoring {self.n_rows} songs in {n_shards} shard(s) ({self.executor_kind})")
+
+    @property
+    def shard_count(self):
+        return len(self.shards)
+
+    def rows(self, indices):
+        """Sparse feature rows for global ``indices``"""
+        rows = []
+        for index in indices:
+            shard_no = bisect.bisect_right(self.offsets, index) - 1
+            rows.append(self.shards[shard_no][index - self.offsets[shard_no]])
+        return sparse.vstack(rows, format='csr')
+
+    def preference_vectors(self, seed_index_sets):
+        """Normalised average seed vector per set (zero rows for empty sets)"""
+        if self.embeddings is not None:
+            return self.embeddings.preference_vectors(seed_index_sets)
+        vectors = []
+        for seed_indices in seed_index_sets:
+            if seed_indices:
+                vectors.append(sparse.csr_matrix(self.rows(seed_indices).mean(axis=0)))
+            else:
+                vectors.append(sparse.csr_matrix((1, self.shards[0].shape[1]), dtype=np.float32))
+        return normalize(sparse.vstack(vectors, format='csr'))
+
+    def top_k(self, seed_index_sets, k=10):
+        """Best ``k`` (index, score) pairs per seed set, never including the seeds themselves"""
+        seed_index_sets = [list(seed_indices) for seed_indices in seed_index_sets]
+        if not seed_index_sets:
+            return []
+        queries = self.preference_vectors(seed_index_sets)
+
+        executor = self._acquire()
+        try:
+            if executor is None:
+                shard_results = [shard_top_k(shard, offset, queries, seed_index_sets, k)
+                                 for shard, offset in zip(self.shards, self.offsets)]
+            elif self.executor_kind == 'processes':
+                futures = [executor.submit(_worker_top_k, shard_no, offset, queries, seed_index_sets, k)
+                           for shard_no, offset in enumerate(self.offsets)]
+                shard_results = [future.result() for future in futures]
+            else:
+                futures = [executor.submit(shard_top_k, shard, offset, queries, seed_index_sets, k)
+                           for shard, offset in zip(self.shards, self.offsets)]
+                shard_results = [future.result() for future in futures]
+        finally:
+            if executor is not None:
+                self._release()
+
+        # k-way merge of the per-shard lists, each already best-first
+        return [list(islice(heapq.merge(*lists, key=lambda item: (-item[1], item[0])), k))
+                for lists in zip(*shard_results)]
+
+    def _acquire(self):
+        """The pool, counted as in use, or None to score inline"""
+        with self.lock:
+            # A forked child (e.g. a daily-mix worker) inherits the pool but not its workers
+            if self.executor is None or self.closing or os.getpid() != self.pid:
+                return None
+            self.active += 1
+            return self.executor
+
+    def _release(self):
+        with self.lock:
+            self.active -= 1
+            if self.closing and self.active == 0:
+                self._shutdown()
+
+    def _shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def close(self):
+        """Shut the pool down once the queries still using it have finished"""
+        with self.lock:
+            self.closing = True
+            if self.active == 0:
+                self._shutdown()
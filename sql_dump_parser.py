@@ -0,0 +1,218 @@
+"""Streaming parser for MySQL ``INSERT ... VALUES`` statements in SQL dumps.
+
+The dump is read in fixed-size chunks and scanned with precompiled regular
+expressions, so memory stays bounded by the chunk size (plus the longest
+single value) and every byte is looked at once. Quoted strings support
+MySQL backslash escapes and doubled quotes, bare ``NULL`` becomes ``None``
+and numeric literals become ``int``/``float``. Multi-row statements yield one
+tuple per row.
+
+    with open('music_recommendation_db.sql', encoding='utf-8') as f:
+        parser = InsertStatementParser(f, table='music')
+        for columns, row in parser:
+            ...
+        print(parser.stats())
+"""
+import re
+import time
+
+CHUNK_SIZE = 1 << 20
+HEADER_LOOKBEHIND = 4096
+
+INSERT_HEADER = re.compile(
+    r"INSERT\s+(?:IGNORE\s+)?INTO\s+`?(\w+)`?\s*(?:\(([^)]*)\))?\s*VALUES\s*",
+    re.IGNORECASE
+)
+# One token inside a VALUES list: a quoted string, punctuation or a bare literal.
+# Possessive quantifiers keep failed matches on truncated strings linear.
+VALUE_TOKEN = re.compile(
+    r"""\s*+(?:('(?:[^'\\]++|\\.|'')*+')|([(),;])|([^\s'(),;]++))""",
+    re.DOTALL
+)
+STRING = r"'(?:[^'\\]++|\\.|'')*+'"
+BARE = r"[^\s'(),;]++"
+# The rest of a tuple after its opening paren, and the values inside it, matched in C
+ROW_BODY = re.compile(
+    rf"(?:\s*+(?:{STRING}|{BARE})\s*+(?:,\s*+(?:{STRING}|{BARE})\s*+)*+)?\)",
+    re.DOTALL
+)
+ROW_VALUE = re.compile(r"'((?:[^'\\]++|\\.|'')*+)'|([^\s'(),;]++)", re.DOTALL)
+ESCAPE_SEQUENCE = re.compile(r"\\(.)|''", re.DOTALL)
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', '%': '\\%', '_': '\\_'}
+INTEGER_LITERAL = re.compile(r"[-+]?\d+")
+FLOAT_LITERAL = re.compile(r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?")
+
+
+class SQLDumpParseError(ValueError):
+    """Raised when a VALUES list is malformed"""
+
+
+def _replace_escape(match):
+    char = match.group(1)
+    if char is None:
+        return "'"
+    return ESCAPES.get(char, char)
+
+
+def unescape_string(literal):
+    """Decode the body of a quoted MySQL string literal"""
+    if '\\' not in literal and "''" not in literal:
+        return literal
+    return ESCAPE_SEQUENCE.sub(_replace_escape, literal)
+
+
+def convert_literal(token):
+    """Convert a bare (unquoted) literal into a Python value"""
+    if token.upper() == 'NULL':
+        return None
+    if INTEGER_LITERAL.fullmatch(token):
+        return int(token)
+    if FLOAT_LITERAL.fullmatch(token):
+        return float(token)
+    return token
+
+
+class InsertStatementParser:
+    """Iterates over ``(columns, row)`` pairs for every INSERT into ``table``.
+
+    ``columns`` is the statement's column list as a tuple, or ``None`` when the
+    INSERT relies on the table's column order. INSERTs into other tables are
+    tokenized and skipped so their string contents cannot confuse the scanner.
+    """
+
+    def __init__(self, fileobj, table='music', chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.table = table.lower()
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.chars_read = 0
+        self.rows = 0
+        self.statements = 0
+        self.started = None
+        self.finished = None
+
+    def _fill(self):
+        """Drop consumed text and append the next chunk; False at end of file"""
+        if self.eof:
+            return False
+        read_size = self.chunk_size
+        # A single value larger than the buffer: grow the read instead of rescanning often
+        if len(self.buffer) - self.pos >= self.chunk_size:
+            read_size = len(self.buffer) - self.pos
+        chunk = self.fileobj.read(read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.chars_read += len(chunk)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _offset(self):
+        return self.chars_read - len(self.buffer) + self.pos
+
+    def _next_header(self):
+        """Advance to the next INSERT header and return its match, or None"""
+        while True:
+            match = INSERT_HEADER.search(self.buffer, self.pos)
+            # The header must be followed by more text to be sure it is complete
+            if match and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.end()
+                return match
+            if not match:
+                self.pos = max(self.pos, len(self.buffer) - HEADER_LOOKBEHIND)
+            if not self._fill():
+                return None
+
+    def _next_token(self):
+        """Return (string, punctuation, literal) for the next token in VALUES"""
+        while True:
+            match = VALUE_TOKEN.match(self.buffer, self.pos)
+            if match and (match.end() < len(self.buffer) or self.eof):
+                self.pos = match.end()
+                return match.groups()
+            if not self._fill():
+                if match:
+                    self.pos = match.end()
+                    return match.groups()
+                if self.buffer[self.pos:].strip():
+                    raise SQLDumpParseError("Unterminated value at end of dump")
+                return None, ';', None
+
+    def _match_row(self):
+        """Fast path: match the rest of a tuple at once, or None if it does not parse"""
+        while True:
+            match = ROW_BODY.match(self.buffer, self.pos)
+            if match:
+                values = tuple(
+                    convert_literal(literal) if literal else unescape_string(string)
+                    for string, literal in ROW_VALUE.findall(self.buffer, self.pos, match.end() - 1)
+                )
+                self.pos = match.end()
+                return values
+            # Usually the tuple is just truncated at the end of the buffer: read more and
+            # retry; genuinely malformed input falls back to the token-by-token reader
+            if len(self.buffer) - self.pos > self.chunk_size * 64 or not self._fill():
+                return None
+
+    def _read_row(self):
+        """Read one parenthesised tuple (the opening paren is already consumed)"""
+        row = []
+        expect_value = True
+        while True:
+            string, punct, literal = self._next_token()
+            if string is not None and expect_value:
+                row.append(unescape_string(string[1:-1]))
+                expect_value = False
+            elif literal is not None and expect_value:
+                row.append(convert_literal(literal))
+                expect_value = False
+            elif punct == ',' and not expect_value:
+                expect_value = True
+            elif punct == ')' and (not expect_value or not row):
+                return tuple(row)
+            else:
+                raise SQLDumpParseError(f"Unexpected token in VALUES near offset {self._offset()}")
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        while True:
+            header = self._next_header()
+            if header is None:
+                break
+            self.statements += 1
+            wanted = header.group(1).lower() == self.table
+            columns = None
+            if header.group(2):
+                columns = tuple(c.strip().strip('`') for c in header.group(2).split(','))
+            while True:
+                string, punct, literal = self._next_token()
+                if punct == '(':
+                    row = self._match_row()
+                    if row is None:
+                        row = self._read_row()
+                    if wanted:
+                        self.rows += 1
+                        yield columns, row
+                elif punct == ',':
+                    continue
+                elif punct == ';':
+                    break
+                else:
+                    raise SQLDumpParseError(f"Expected '(' in VALUES near offset {self._offset()}")
+        self.finished = time.perf_counter()
+
+    def stats(self):
+        """Return parse throughput for the rows consumed so far"""
+        end = self.finished or time.perf_counter()
+        elapsed = max(end - (self.started or end), 1e-9)
+        return {
+            'statements': self.statements,
+            'rows': self.rows,
+            'chars': self.chars_read,
+            'seconds': elapsed,
+            'rows_per_second': self.rows / elapsed,
+            'chars_per_second': self.chars_read / elapsed,
+        }
@@ -0,0 +1,164 @@
+"""Materialized catalog statistics.
+
+``/api/stats`` and the admin songs page used to aggregate the whole music
+table (COUNT, GROUP BY genre, ORDER BY popularity_score) on every request.
+``CatalogStats`` keeps the song total, the per-genre and per-year counts and
+the top-N most popular songs in memory instead. Serving them is a dictionary
+read.
+
+Admin adds, edits and deletes update the counters incrementally. Bulk loads
+call ``reconcile()``, which recomputes everything from the database. A
+background thread also reconciles every ``STATS_RECONCILE_SECONDS``. That
+picks up writes from other processes and the popularity rollup, and corrects
+any drift in the incremental counters.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from popularity_rollup import popularity_scale
+
+logger = logging.getLogger(__name__)
+
+STATS_RECONCILE_SECONDS = float(os.environ.get('STATS_RECONCILE_SECONDS', '300'))
+TOP_POPULAR_SIZE = 20
+POPULAR_FIELDS = ('id', 'title', 'artist', 'popularity_score')
+
+
+class CatalogStats:
+    """In-memory catalog aggregates, updated incrementally and reconciled"""
+
+    def __init__(self, top_n=TOP_POPULAR_SIZE):
+        self.top_n = top_n
+        self.lock = threading.Lock()
+        self.total_songs = 0
+        self.genres = Counter()
+        self.years = Counter()
+        self.popular = []
+        self.reconciled_at = None
+        self.cached_summary = None
+
+    def reconcile(self, connection):
+        """Recompute every aggregate from the music table"""
+        cursor = connection.cursor()
+        cursor.execute("SELECT genre, year, COUNT(*) FROM music GROUP BY genre, year")
+        genres = Counter()
+        years = Counter()
+        for genre, year, count in cursor.fetchall():
+            genres[genre] += count
+            years[year] += count
+        cursor.execute(f"""
+            SELECT {', '.join(POPULAR_FIELDS)} FROM music
+            ORDER BY popularity_score DESC
+            LIMIT ?
+        """, (self.top_n,))
+        popular = [dict(zip(POPULAR_FIELDS, row)) for row in cursor.fetchall()]
+        # Stored scores are decayed to the rollup's epoch; report them as of now
+        scale = popularity_scale(cursor)
+        for entry in popular:
+            entry['popularity_score'] = (entry['popularity_score'] or 0) * scale
+
+        with self.lock:
+            self.total_songs = sum(genres.values())
+            self.genres = genres
+            self.years = years
+            self.popular = popular
+            self.reconciled_at = time.time()
+            self.cached_summary = None
+        logger.info(f"Reconciled catalog stats: {self.total_songs} songs, {len(genres)} genres")
+
+    def song_added(self, song):
+        """Count a newly inserted song (a dict with at least genre and year)"""
+        with self.lock:
+            self.total_songs += 1
+            self.genres[song.get('genre')] += 1
+            self.years[song.get('year')] += 1
+            if len(self.popular) < self.top_n and 'id' in song:
+                self.popular.append({field: song.get(field, 0) for field in POPULAR_FIELDS})
+            self.cached_summary = None
+
+    def song_removed(self, song):
+        """Uncount a deleted song (a dict with id, genre and year)"""
+        with self.lock:
+            self.total_songs -= 1
+            self._decrement(self.genres, song.get('genre'))
+            self._decrement(self.years, song.get('year'))
+            self.popular = [entry for entry in self.popular if entry['id'] != song.get('id')]
+            self.cached_summary = None
+
+    def song_updated(self, old, new):
+        """Move an edited song between genre/year buckets and refresh its title"""
+        with self.lock:
+            self._decrement(self.genres, old.get('genre'))
+            self._decrement(self.years, old.get('year'))
+            self.genres[new.get('genre')] += 1
+            self.years[new.get('year')] += 1
+            for entry in self.popular:
+                if entry['id'] == old.get('id'):
+                    entry['title'] = new.get('title', entry['title'])
+                    entry['artist'] = new.get('artist', entry['artist'])
+            self.cached_summary = None
+
+    @staticmethod
+    def _decrement(counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def summary(self, popular_limit=5):
+        """Return the aggregates in /api/stats shape; built once per change"""
+        with self.lock:
+            if self.cached_summary is None:
+                self.cached_summary = {
+                    'total_songs': self.total_songs,
+                    'genres': [{'genre': genre, 'count': count}
+                               for genre, count in self.genres.most_common()],
+                    'years': [{'year': year, 'count': count}
+                              for year, count in sorted(self.years.items(), key=lambda item: item[0] or 0)],
+                    'popular': [{field: entry[field] for field in ('title', 'artist', 'popularity_score')}
+                                for entry in self.popular],
+                }
+            summary = self.cached_summary
+        return {
+            'total_songs': summary['total_songs'],
+            'genres': summary['genres'],
+            'years': summary['years'],
+            'popular_songs': summary['popular'][:popular_limit],
+        }
+
+
+class StatsReconciler(threading.Thread):
+    """Background thread reconciling ``stats`` every ``interval`` seconds"""
+
+    def __init__(self, stats, storage, interval=STATS_RECONCILE_SECONDS):
+        super().__init__(name='stats-reconciler', daemon=True)
+        self.stats = stats
+        self.storage = storage
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the thread on first use (so importing the app never spawns it)"""
+        if self.is_alive():
+            return
+        with self.start_lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.stats.reconcile(self.storage.get_connection())
+            except Exception as e:
+                logger.error(f"Stats reconciliation error: {e}")
+            finally:
+                self.storage.release()
+
+    def stop(self):
+        self.stopped.set()
+
+
+catalog_stats = CatalogStats()
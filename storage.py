@@ -0,0 +1,285 @@
+"""Pluggable storage backends for the recommendation system.
+
+``MusicRecommendationSystem`` and the Flask routes only talk to a
+``StorageBackend``. Two implementations are provided:
+
+* ``SQLiteStorage`` - the default, a single shared connection to a local file.
+* ``MySQLStorage`` - connections checked out per thread from a
+  ``mysql.connector.pooling`` pool, for deployments with concurrent writers.
+
+Application SQL is written once in SQLite's dialect (``?`` placeholders,
+``INSERT OR IGNORE``, ``ON CONFLICT ... DO UPDATE``); the MySQL adapter
+rewrites those constructs, and rows from both backends support key and index
+access like ``sqlite3.Row``. Select the backend with ``DB_BACKEND=mysql`` and
+the ``MYSQL_*`` environment variables.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+from migrations import run_migrations
+from queries import STATEMENT_CACHE_SIZE
+from query_profiler import ProfiledConnection, slow_query_log
+
+logger = logging.getLogger(__name__)
+
+try:
+    import mysql.connector
+    from mysql.connector import pooling
+    DATABASE_ERRORS = (sqlite3.Error, mysql.connector.Error)
+except ImportError:  # MySQL support is optional for SQLite deployments
+    mysql = None
+    pooling = None
+    DATABASE_ERRORS = (sqlite3.Error,)
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'music_recommendation.db')
+
+MYSQL_CONFIG = {
+    'host': os.environ.get('MYSQL_HOST', 'localhost'),
+    'port': int(os.environ.get('MYSQL_PORT', '3306')),
+    'database': os.environ.get('MYSQL_DATABASE', 'music_recommendation_db'),
+    'user': os.environ.get('MYSQL_USER', 'root'),
+    'password': os.environ.get('MYSQL_PASSWORD', ''),
+}
+
+
+class StorageBackend:
+    """Common interface for the database backends"""
+
+    dialect = None
+
+    def get_connection(self):
+        """Return the connection the current thread should use"""
+        raise NotImplementedError
+
+    def release(self):
+        """Give the current thread's connection back (end of request)"""
+
+    def migrate(self, target=None):
+        """Apply pending schema migrations and return the schema version"""
+        return run_migrations(self.get_connection(), target=target, dialect=self.dialect)
+
+    def close(self):
+        """Close every connection held by the backend"""
+
+    def for_background_thread(self):
+        """Backend a long-running worker thread should use instead of this one"""
+        return self
+
+
+class SQLiteStorage(StorageBackend):
+    """Single shared sqlite3 connection (SQLite serialises writers anyway)"""
+
+    dialect = 'sqlite'
+
+    def __init__(self, db_path=DEFAULT_SQLITE_PATH):
+        self.db_path = db_path
+        self.connection = None
+
+    def get_connection(self):
+        if self.connection is None:
+            factory = ProfiledConnection if slow_query_log.enabled else sqlite3.Connection
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False, factory=factory,
+                                              cached_statements=STATEMENT_CACHE_SIZE)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.execute('PRAGMA foreign_keys = ON;')
+        return self.connection
+
+    def for_background_thread(self):
+        # The shared connection's transaction would interleave with requests'
+        return SQLiteStorage(self.db_path)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Row:
+    """Row supporting both ``row['column']`` and ``row[0]`` like sqlite3.Row"""
+
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = tuple(values)
+
+    def keys(self):
+        return list(self._columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return self._values[key]
+        try:
+            return self._values[self._columns.index(key)]
+        except ValueError:
+            raise IndexError(f"No item with that key: {key}")
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._columns, self._values))!r})"
+
+
+PLACEHOLDER_PATTERN = re.compile(r"('(?:[^'\\]|\\.|'')*')|\?")
+ON_CONFLICT_UPDATE_PATTERN = re.compile(r"ON\s+CONFLICT\s*\([^)]*\)\s*DO\s+UPDATE\s+SET", re.IGNORECASE)
+ON_CONFLICT_NOTHING_PATTERN = re.compile(r"\s*ON\s+CONFLICT\s*(\([^)]*\))?\s*DO\s+NOTHING", re.IGNORECASE)
+EXCLUDED_PATTERN = re.compile(r"\bexcluded\.(\w+)", re.IGNORECASE)
+INSERT_OR_IGNORE_PATTERN = re.compile(r"\bINSERT\s+OR\s+IGNORE\b", re.IGNORECASE)
+INSERT_OR_REPLACE_PATTERN = re.compile(r"\bINSERT\s+OR\s+REPLACE\b", re.IGNORECASE)
+CREATE_INDEX_IF_NOT_EXISTS_PATTERN = re.compile(r"\bCREATE\s+(UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def translate_sql(sql):
+    """Rewrite a statement written for SQLite into MySQL's dialect"""
+    sql = PLACEHOLDER_PATTERN.sub(lambda m: m.group(1) or '%s', sql)
+    if ON_CONFLICT_NOTHING_PATTERN.search(sql):
+        sql = ON_CONFLICT_NOTHING_PATTERN.sub('', sql)
+        sql = re.sub(r"\bINSERT\b", 'INSERT IGNORE', sql, count=1, flags=re.IGNORECASE)
+    sql = ON_CONFLICT_UPDATE_PATTERN.sub('ON DUPLICATE KEY UPDATE', sql)
+    sql = EXCLUDED_PATTERN.sub(r'VALUES(\1)', sql)
+    sql = INSERT_OR_IGNORE_PATTERN.sub('INSERT IGNORE', sql)
+    sql = INSERT_OR_REPLACE_PATTERN.sub('REPLACE', sql)
+    sql = CREATE_INDEX_IF_NOT_EXISTS_PATTERN.sub(lambda m: f"CREATE {m.group(1) or ''}INDEX", sql)
+    sql = re.sub(r"\bRANDOM\(\)", 'RAND()', sql, flags=re.IGNORECASE)
+    return sql
+
+
+class MySQLCursor:
+    """DB-API cursor wrapper that translates SQL and returns ``Row`` objects"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _row(self, values):
+        if values is None:
+            return None
+        columns = tuple(self.cursor.column_names)
+        return Row(columns, values)
+
+    def execute(self, sql, parameters=()):
+        self.cursor.execute(translate_sql(sql), tuple(parameters) or None)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self.cursor.executemany(translate_sql(sql), [tuple(p) for p in seq_of_parameters])
+        return self
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchmany(self, size=100):
+        columns = tuple(self.cursor.column_names)
+        return [Row(columns, values) for values in self.cursor.fetchmany(size)]
+
+    def fetchall(self):
+        columns = tuple(self.cursor.column_names or ())
+        return [Row(columns, values) for values in self.cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+
+class MySQLConnection:
+    """Pooled mysql.connector connection exposing the sqlite3 API used by the app"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self):
+        # Buffered so callers may issue the next statement without draining rows
+        return MySQLCursor(self.connection.cursor(buffered=True))
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        # Returns the underlying connection to the pool
+        self.connection.close()
+
+
+class MySQLStorage(StorageBackend):
+    """MySQL backend backed by ``mysql.connector.pooling.MySQLConnectionPool``.
+
+    Each thread checks a connection out on first use and keeps it until
+    ``release()`` is called at the end of the request.
+    """
+
+    dialect = 'mysql'
+
+    def __init__(self, config=None, pool_size=None, pool_name='music_pool'):
+        if pooling is None:
+            raise RuntimeError("mysql-connector-python is required for the MySQL backend")
+        self.config = dict(config or MYSQL_CONFIG)
+        pool_size = pool_size or int(os.environ.get('MYSQL_POOL_SIZE', '5'))
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name=pool_name,
+            pool_size=pool_size,
+            pool_reset_session=True,
+            autocommit=False,
+            **self.config
+        )
+        self.local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = MySQLConnection(self.pool.get_connection())
+            self.local.connection = connection
+        return connection
+
+    def release(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            try:
+                connection.rollback()
+            finally:
+                connection.close()
+                self.local.connection = None
+
+    def close(self):
+        self.release()
+
+
+def create_storage(backend=None):
+    """Build the backend selected by ``DB_BACKEND`` (sqlite or mysql)"""
+    backend = (backend or os.environ.get('DB_BACKEND', 'sqlite')).lower()
+    if backend == 'mysql':
+        logger.info(f"Using MySQL storage at {MYSQL_CONFIG['host']}/{MYSQL_CONFIG['database']}")
+        return MySQLStorage()
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown DB_BACKEND: {backend}")
+    db_path = os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
+    return SQLiteStorage(db_path)
@@ -0,0 +1,54 @@
+"""Tests for the audio-feature KD-tree store"""
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from audio_features import AudioFeatureStore
+
+
+@pytest.fixture
+def store():
+    rng = np.random.default_rng(7)
+    features = [f"pop danceability:{d:.3f} energy:{e:.3f} tempo:{t:.1f}"
+                for d, e, t in zip(rng.random(500), rng.random(500), rng.uniform(60, 180, 500))]
+    features += ['rock energy:0.95', 'no audio features', 'tempo:125.0 energy:0.9 valence:-1e-1']
+    catalog = pa.table({'id': list(range(1, len(features) + 1)), 'features': features})
+    store = AudioFeatureStore()
+    store.build(catalog)
+    return store
+
+
+def test_build_parses_tokens(store):
+    assert store.song_values(503) == {'danceability': None, 'energy': 0.9, 'valence': -0.1, 'tempo': 125.0}
+    assert store.song_values(502) == dict.fromkeys(store.features)
+    assert store.song_values(9999) is None
+
+
+def test_range_query_matches_brute_force(store):
+    ranges = {'energy': (0.8, 1.0), 'tempo': (120, 130)}
+    expected = [music_id for music_id in range(1, 504)
+                if all(value is not None and ranges[name][0] <= value <= ranges[name][1]
+                       for name, value in store.song_values(music_id, ranges).items())]
+    assert expected and 503 in expected
+    assert store.in_ranges({'tempo': (120, 130), 'energy': (0.8, 1.0)}) == expected
+    assert store.in_ranges(ranges, limit=2) == expected[:2]
+    assert store.in_ranges({'energy': (0.8, np.inf), 'tempo': (120, 130)}) == expected
+    assert store.in_ranges({'energy': (2.0, np.inf)}) == []
+    with pytest.raises(ValueError):
+        store.in_ranges({'loudness': (0, 1)})
+
+
+def test_like_returns_nearest_on_feature_subset(store):
+    neighbours = store.like(1, ['tempo', 'energy'], k=5)
+    assert len(neighbours) == 5 and 1 not in dict(neighbours)
+
+    def distance(music_id):
+        values = store.song_values(music_id)
+        return np.hypot((values['energy'] - target['energy']) / store.scale[1],
+                        (values['tempo'] - target['tempo']) / store.scale[3])
+
+    target = store.song_values(1)
+    candidates = [music_id for music_id in range(2, 504)
+                  if None not in store.song_values(music_id, ('energy', 'tempo')).values()]
+    assert [music_id for music_id, _ in neighbours] == sorted(candidates, key=distance)[:5]
+    assert store.like(502, ['energy']) == []
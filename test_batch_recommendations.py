@@ -0,0 +1,67 @@
+"""Tests for batch scoring and the streamed /api/recommend/batch endpoint"""
+import json
+
+import pytest
+
+SONGS = [
+    ('Batch Rock 1', 'rock guitar loud drums'),
+    ('Batch Rock 2', 'rock guitar drums fast'),
+    ('Batch Rock 3', 'rock drums loud anthem'),
+    ('Batch Jazz 1', 'jazz piano smooth sax'),
+    ('Batch Jazz 2', 'jazz piano sax late'),
+    ('Batch Jazz 3', 'jazz smooth trumpet late'),
+]
+
+
+@pytest.fixture(scope='module')
+def song_ids(app_module):
+    music_system = app_module.music_system
+    connection = music_system.get_database_connection()
+    cursor = connection.cursor()
+    ids = []
+    for title, features in SONGS:
+        cursor.execute(
+            "INSERT INTO music (title, artist, album, genre, year, duration, audio_url, features) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (title, 'Batch Band', '', features.split()[0], 2020, 200, '', features),
+        )
+        ids.append(cursor.lastrowid)
+    connection.commit()
+    music_system.refresh_catalog(reconcile_stats=True)
+    return ids
+
+
+def test_batch_matches_single_user_scoring(app_module, song_ids):
+    music_system = app_module.music_system
+    seed_sets = [song_ids[:1], song_ids[3:5], [song_ids[0], song_ids[3]]]
+    for seeds, batch in zip(seed_sets, music_system.calculate_similarities_batch(seed_sets)):
+        single = [(song['id'], song['similarity_score']) for song in music_system.calculate_similarities(seeds)]
+        assert batch
+        assert [music_id for music_id, _ in batch] == [music_id for music_id, _ in single]
+        assert [score for _, score in batch] == pytest.approx([score for _, score in single])
+        assert not set(seeds) & {music_id for music_id, _ in batch}
+
+
+def test_unknown_ids_are_ignored(app_module, song_ids):
+    unknown = max(song_ids) + 1000
+    only_unknown, mixed, known = app_module.music_system.calculate_similarities_batch(
+        [[unknown], [song_ids[0], unknown], [song_ids[0]]]
+    )
+    assert only_unknown == []
+    assert mixed == known
+
+
+def test_streamed_lines_are_well_formed(app_module, song_ids):
+    client = app_module.app.test_client()
+    response = client.post('/api/recommend/batch', json={
+        'requests': [{'id': 'rock', 'preferences': song_ids[:2]}, {'id': 'none', 'preferences': [-1]}],
+        'top_k': 3,
+    })
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['id'] for line in lines] == ['rock', 'none']
+    rock, none = lines
+    assert 0 < len(rock['recommendations']) <= 3
+    assert all(set(item) == {'music_id', 'similarity_score'} for item in rock['recommendations'])
+    assert not set(song_ids[:2]) & {item['music_id'] for item in rock['recommendations']}
+    assert none['recommendations'] == []
@@ -0,0 +1,125 @@
+"""Tests for deduplicated, idempotent CSV ingestion"""
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+import catalog_ingest
+from catalog_ingest import SPOTIFY_CSV_SOURCE, SQL_DUMP_SOURCE, keyed_songs, spotify_songs, sync_songs
+from storage import SQLiteStorage
+
+CSV_ROWS = pd.DataFrame({
+    'track_id': ['t1', 't2', 't1', 't1', None],
+    'track_name': ['Hey Jude', 'Yesterday', 'Hey Jude', 'Hey Jude', 'Loose Song'],
+    'track_artist': ['The Beatles', 'The Beatles', 'The Beatles', 'The Beatles', 'X'],
+    'track_album_name': ['Hey Jude', None, 'Hey Jude', 'Hey Jude', 'Z'],
+    'track_album_release_date': ['1968-08-26', '1965', '1968-08-26', '1968-08-26', None],
+    'playlist_genre': ['rock', 'pop', 'pop', 'pop', 'edm'],
+    'playlist_subgenre': ['classic rock', 'dance pop', 'post-teen pop', 'dance pop', 'big room'],
+    'energy': [0.7, 0.8, 0.7, 0.7, 0.9],
+    'tempo': [120.0, 90.0, 120.0, 120.0, None],
+    'duration_ms': [431000, 125666, 431000, 431000, None],
+})
+
+
+@pytest.fixture
+def connection():
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    storage.migrate()
+    yield storage.get_connection()
+    storage.close()
+
+
+def test_spotify_songs_merges_duplicate_tracks():
+    songs = spotify_songs(CSV_ROWS).set_index('track_id')
+    assert list(songs.index) == ['t1', 't2', 'name:loose song - x']
+    hey_jude = songs.loc['t1']
+    assert (hey_jude['genre'], hey_jude['year'], hey_jude['duration']) == ('pop', 1968, 431)
+    assert hey_jude['features'] == 'classic rock post-teen pop dance pop rock energy:0.7 tempo:120.0'
+    assert pd.isna(songs.loc['name:loose song - x', 'year'])
+
+
+def test_long_tag_lists_keep_audio_tokens_whole():
+    subgenres = [f'subgenre number {i}' for i in range(60)]
+    songs = spotify_songs(pd.DataFrame({
+        'track_id': ['t1'] * len(subgenres),
+        'track_name': ['Long'] * len(subgenres),
+        'track_artist': ['A'] * len(subgenres),
+        'playlist_genre': ['rock'] * len(subgenres),
+        'playlist_subgenre': subgenres,
+        'energy': 0.7,
+        'tempo': 120.0,
+    }))
+    features = songs.loc[0, 'features']
+    assert len(features) <= catalog_ingest.FEATURES_MAX_LENGTH
+    assert features.startswith('subgenre number 0 ')
+    assert features.endswith(' energy:0.7 tempo:120.0')
+    # Tags are cut at a word boundary, never mid-word
+    tags, all_tags = features[:-len(' energy:0.7 tempo:120.0')], ' '.join(subgenres)
+    assert all_tags.startswith(tags) and all_tags[len(tags)] == ' '
+
+
+def test_sync_applies_only_the_difference(connection):
+    connection.execute("INSERT INTO music (title, artist, genre) VALUES ('Yesterday!', 'the beatles', 'rock')")
+    connection.commit()
+
+    songs = spotify_songs(CSV_ROWS)
+    changes = sync_songs(connection, songs, SPOTIFY_CSV_SOURCE, prune=True, batch_size=1)
+    assert sorted(song['title'] for song in changes.added) == ['Hey Jude', 'Loose Song']
+    # The legacy row was adopted, so its id is kept
+    assert [(previous['id'], song['id'], song['genre']) for previous, song in changes.updated] == [(1, 1, 'pop')]
+    assert changes.removed == []
+
+    # Unchanged content is skipped entirely
+    ids = dict(connection.execute("SELECT track_id, id FROM music").fetchall())
+    assert len(sync_songs(connection, songs, SPOTIFY_CSV_SOURCE, prune=True)) == 0
+    assert dict(connection.execute("SELECT track_id, id FROM music").fetchall()) == ids
+
+    edited = songs.copy()
+    edited.loc[edited['track_id'] == 't1', 'title'] = 'Hey Jude (Remastered)'
+    changes = sync_songs(connection, edited, SPOTIFY_CSV_SOURCE)
+    assert [song['title'] for _, song in changes.updated] == ['Hey Jude (Remastered)']
+    assert (changes.added, changes.removed) == ([], [])
+
+    # Without prune, songs missing from the feed stay
+    remaining = edited[edited['track_id'] != 't2']
+    assert sync_songs(connection, remaining, SPOTIFY_CSV_SOURCE).removed == []
+    changes = sync_songs(connection, remaining, SPOTIFY_CSV_SOURCE, prune=True)
+    assert [song['id'] for song in changes.removed] == [1]
+
+
+def test_prune_keeps_admin_songs_and_other_sources(connection):
+    connection.execute("INSERT INTO music (title, artist, genre) VALUES ('Admin Pick', 'Y', 'rock')")
+    connection.execute("INSERT INTO liked_songs (user_id, music_id) VALUES ('u1', 1)")
+    connection.commit()
+    dump = keyed_songs(pd.DataFrame({'title': ['Dump Song'], 'artist': ['D'], 'album': [''], 'genre': ['pop'],
+                                     'year': [2000], 'duration': [1], 'audio_url': [''], 'features': ['']}))
+    sync_songs(connection, dump, SQL_DUMP_SOURCE)
+
+    changes = sync_songs(connection, spotify_songs(CSV_ROWS), SPOTIFY_CSV_SOURCE, prune=True)
+    assert changes.removed == []
+    titles = {row[0] for row in connection.execute("SELECT title FROM music")}
+    assert {'Admin Pick', 'Dump Song'} <= titles
+    assert connection.execute("SELECT COUNT(*) FROM liked_songs").fetchone()[0] == 1
+
+
+def test_failed_sync_changes_nothing(connection, monkeypatch):
+    sync_songs(connection, spotify_songs(CSV_ROWS), SPOTIFY_CSV_SOURCE)
+    before = connection.execute("SELECT id, title FROM music ORDER BY id").fetchall()
+
+    def fail(cursor, music_ids):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(catalog_ingest, 'delete_songs', fail)
+    edited = spotify_songs(CSV_ROWS).iloc[:1].assign(title='Renamed')
+    with pytest.raises(RuntimeError):
+        sync_songs(connection, edited, SPOTIFY_CSV_SOURCE, prune=True, batch_size=1)
+    assert connection.execute("SELECT id, title FROM music ORDER BY id").fetchall() == before
+
+
+def test_keyed_songs_dedupes_rows_without_track_ids():
+    frame = pd.DataFrame({'title': ['A', 'a!', 'B'], 'artist': ['X', 'x', 'X'], 'album': ['', '', None],
+                          'genre': ['pop'] * 3, 'year': [2000, 2000, None], 'duration': [1, 1, 2],
+                          'audio_url': [''] * 3, 'features': [''] * 3})
+    assert list(keyed_songs(frame)['track_id']) == ['name:a - x', 'name:b - x']
@@ -0,0 +1,48 @@
+"""Tests for the memory-mapped catalog snapshot"""
+import os
+import sqlite3
+
+from catalog_snapshot import CatalogSnapshot, write_snapshot
+
+
+def make_catalog(songs):
+    connection = sqlite3.connect(':memory:')
+    connection.execute("""
+        CREATE TABLE music (id INTEGER PRIMARY KEY, title TEXT, artist TEXT, album TEXT, genre TEXT,
+                            year INTEGER, duration INTEGER, audio_url TEXT, features TEXT,
+                            popularity_score REAL, created_at TEXT DEFAULT CURRENT_TIMESTAMP)
+    """)
+    add_songs(connection, songs)
+    return connection
+
+
+def add_songs(connection, songs):
+    connection.executemany(
+        "INSERT INTO music (id, title, artist, genre, year, popularity_score) VALUES (?, ?, ?, ?, ?, ?)",
+        songs,
+    )
+
+
+def test_round_trip_through_memory_map(tmp_path):
+    path = str(tmp_path / 'catalog.arrow')
+    connection = make_catalog([(1, 'Low', 'A', 'pop', 2001, 1.0), (2, 'High', 'B', 'rock', None, 5.0)])
+    assert write_snapshot(connection, path) == 2
+
+    table = CatalogSnapshot(path).load(['id', 'title', 'year'])
+    assert table.column_names == ['id', 'title', 'year']
+    assert table.to_pydict() == {'id': [2, 1], 'title': ['High', 'Low'], 'year': [None, 2001]}
+
+
+def test_rewrite_while_old_snapshot_is_open(tmp_path):
+    path = str(tmp_path / 'catalog.arrow')
+    connection = make_catalog([(1, 'First', 'A', 'pop', 2001, 1.0)])
+    write_snapshot(connection, path)
+    reader = CatalogSnapshot(path)
+    old = reader.load()
+
+    add_songs(connection, [(2, 'Second', 'B', 'rock', 2002, 2.0)])
+    write_snapshot(connection, path)
+    # The old mapping keeps its data; the reader picks up the new file
+    assert old.column('title').to_pylist() == ['First']
+    assert reader.load().column('title').to_pylist() == ['Second', 'First']
+    assert os.listdir(tmp_path) == ['catalog.arrow']
@@ -0,0 +1,51 @@
+"""Tests for the partitioned dataset combiner"""
+import pandas as pd
+
+import combine_datasets
+from combine_datasets import KEY_COLUMNS, hash_partition, normalize_key, read_combined_dataset
+
+TITLES = ['Halo', 'HALO', '  halo ', 'Hálo', 'Halo (feat. Someone)']
+ARTISTS = ['Beyoncé', 'beyonce', 'BEYONCÉ  ', 'Beyonce', 'Beyoncé']
+
+
+def keyed(frame, title_column, artist_column):
+    frame['track_name_clean'] = normalize_key(frame[title_column])
+    frame['artist_clean'] = normalize_key(frame[artist_column])
+    return frame
+
+
+def test_spelling_variants_share_a_key_and_partition():
+    tracks = keyed(pd.DataFrame({'track_name': TITLES + ['Other'], 'track_artist': ARTISTS + ['X']}),
+                   'track_name', 'track_artist')
+    assert set(tracks['track_name_clean'][:5]) == {'halo'}
+    assert set(tracks['artist_clean'][:5]) == {'beyonce'}
+
+    parts = hash_partition(tracks, 7)
+    assert sum(len(part) for part in parts) == len(tracks)
+    assert [len(part) for part in parts if 'halo' in set(part['track_name_clean'])] == [5]
+
+
+def test_output_is_independent_of_worker_count(tmp_path, monkeypatch):
+    lyrics_path, tracks_path = tmp_path / 'lyrics.csv', tmp_path / 'tracks.csv'
+    pd.DataFrame({
+        'artist': ['beyonce', 'Adele', 'Nobody'],
+        'song': ['halo', 'Hello', 'Unmatched'],
+        'text': ['halo lyrics', 'hello lyrics', '...'],
+    }).to_csv(lyrics_path, index=False)
+    pd.DataFrame({
+        'track_name': TITLES + ['Hello', 'Solo'],
+        'track_artist': ARTISTS + ['ADELE', 'Y'],
+        'duration_ms': range(7),
+    }).to_csv(tracks_path, index=False)
+    monkeypatch.setattr(combine_datasets, 'LYRICS_PATH', str(lyrics_path))
+    monkeypatch.setattr(combine_datasets, 'TRACKS_PATH', str(tracks_path))
+
+    outputs = []
+    for workers in (1, 3):
+        output_dir = str(tmp_path / f'out-{workers}')
+        assert combine_datasets.combine_datasets(workers=workers, output_dir=output_dir) == 2
+        combined = read_combined_dataset(input_dir=output_dir)
+        outputs.append(combined.sort_values(KEY_COLUMNS).reset_index(drop=True))
+    pd.testing.assert_frame_equal(*outputs)
+    # The variants collapse to the first spelling seen
+    assert list(outputs[0]['track_name']) == ['Halo', 'Hello']
@@ -0,0 +1,67 @@
+"""Tests for the offline daily-mix job"""
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import queries
+from daily_mix_job import TIMESTAMP_FORMAT, load_user_seeds, stale_cutoff, write_mixes
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    connection = storage.get_connection()
+    connection.executemany("INSERT INTO music (id, title, artist) VALUES (?, ?, ?)",
+                           [(music_id, f'Song {music_id}', 'A') for music_id in range(1, 9)])
+    connection.commit()
+    yield connection
+    storage.close()
+
+
+def hours_ago(hours):
+    return (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT)
+
+
+def daily_mix(connection, user_id):
+    cursor = connection.cursor()
+    queries.execute(cursor, 'user_daily_mix', (user_id, stale_cutoff(), 10))
+    return [(row['id'], row['similarity_score']) for row in cursor.fetchall()]
+
+
+def test_seeds_prefer_preferences_over_history(connection):
+    connection.executemany(
+        "INSERT INTO user_preferences (user_id, music_id, preference_score) VALUES (?, ?, ?)",
+        [('liker', music_id, music_id) for music_id in range(1, 8)],
+    )
+    connection.executemany(
+        "INSERT INTO listening_history (user_id, music_id, timestamp) VALUES (?, ?, ?)",
+        [('liker', 8, hours_ago(1)), ('listener', 2, hours_ago(3)), ('listener', 3, hours_ago(2))],
+    )
+    connection.commit()
+
+    seeds = load_user_seeds(connection)
+    # The top five preferences; history only counts for users without any
+    assert sorted(seeds['liker']) == [3, 4, 5, 6, 7]
+    assert sorted(seeds['listener']) == [2, 3]
+
+
+def test_write_mixes_replaces_previous_mix(connection):
+    write_mixes(connection, [('u', [(1, 0.9), (2, 0.5)])], hours_ago(1))
+    write_mixes(connection, [('u', [(3, 0.8)]), ('v', [])], hours_ago(0))
+    assert daily_mix(connection, 'u') == [(3, 0.8)]
+    assert daily_mix(connection, 'v') == []
+
+
+def test_stale_mix_is_not_served(connection):
+    write_mixes(connection, [('fresh', [(1, 0.9)]), ('stale', [(2, 0.9)])], hours_ago(1))
+    connection.execute("UPDATE user_recommendations SET generated_at = ? WHERE user_id = 'stale'",
+                       (stale_cutoff(max_age_hours=27),))
+    connection.commit()
+    # An empty mix is what makes /home fall back to live scoring
+    assert daily_mix(connection, 'fresh') == [(1, 0.9)]
+    assert daily_mix(connection, 'stale') == []
@@ -0,0 +1,53 @@
+"""Tests for the quantized SVD song embeddings"""
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from embeddings import SongEmbeddings, accuracy_report
+
+
+def clustered_matrix(n_songs=300, n_terms=400, n_topics=8, seed=0):
+    """Sparse L2-normalised rows drawn from a few term topics"""
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(0, n_topics, size=n_songs)
+    rows, cols = [], []
+    for song, topic in enumerate(topics):
+        terms = rng.choice(n_terms // n_topics, size=6, replace=False) + topic * (n_terms // n_topics)
+        rows.extend([song] * len(terms))
+        cols.extend(terms.tolist())
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_songs, n_terms))
+    return normalize(matrix)
+
+
+@pytest.mark.parametrize('dtype', ['int8', 'float16'])
+def test_embeddings_are_compact_and_normalised(dtype):
+    matrix = clustered_matrix()
+    embeddings = SongEmbeddings.fit(matrix, dim=32, dtype=dtype)
+    assert embeddings.vectors.shape == (300, 32)
+    assert embeddings.dtype == dtype
+    np.testing.assert_allclose(np.linalg.norm(embeddings.rows(np.arange(300)), axis=1), 1.0, atol=0.02)
+
+
+def test_scores_track_exact_cosine_ranking():
+    matrix = clustered_matrix()
+    embeddings = SongEmbeddings.fit(matrix, dim=32, dtype='int8')
+    report = accuracy_report(matrix, embeddings, sample=50, top_k=10)
+    assert report['seeds'] == 50
+    assert report['embedding_bytes'] < report['sparse_bytes']
+    # Top songs share the seed's topic, so the reduced space should keep most of them
+    assert report['recall_at_10'] > 0.3
+    assert report['mean_abs_score_error'] < 0.5
+
+
+def test_empty_seed_set_scores_zero():
+    embeddings = SongEmbeddings.fit(clustered_matrix(), dim=16)
+    scores = embeddings.scores(embeddings.preference_vectors([[], [0, 1]]))
+    assert scores.shape == (2, 300)
+    assert not scores[0].any()
+    assert scores[1].max() > 0.5
+
+
+def test_unknown_dtype_rejected():
+    with pytest.raises(ValueError):
+        SongEmbeddings.fit(clustered_matrix(), dim=8, dtype='int4')
@@ -0,0 +1,60 @@
+"""Tests for the genre / year / artist facet index"""
+import pyarrow as pa
+import pytest
+
+from facet_index import FacetIndex, parse_year_filter
+
+CATALOG = pa.table({
+    'id': [10, 11, 12, 13, 14, 15],
+    'genre': ['Pop', 'Rock', 'pop', 'Indie Pop', None, 'Rock'],
+    'year': [1994, 1999, 2005, 2015, 2001, None],
+    'artist': ['Ann', 'Bob', 'ann', 'Cat', 'Bob', 'Bob'],
+})
+
+
+@pytest.fixture
+def index():
+    index = FacetIndex()
+    index.build(CATALOG)
+    return index
+
+
+def test_parse_year_filter():
+    assert parse_year_filter('90s') == (1990, 1999)
+    assert parse_year_filter('2010s') == (2010, 2019)
+    assert parse_year_filter('1995 - 2004') == (1995, 2004)
+    assert parse_year_filter('2004') == (2004, 2004)
+    assert parse_year_filter('') == (None, None)
+    with pytest.raises(ValueError):
+        parse_year_filter('recent')
+
+
+def test_combined_filters_intersect_in_catalog_order(index):
+    assert index.music_ids_for(genre='pop') == [10, 12, 13]
+    assert index.music_ids_for(genre='pop', year_min=2000) == [12, 13]
+    assert index.music_ids_for(artist='ANN', year_min=1990, year_max=1999) == [10]
+    assert index.music_ids_for(artist='bob', genre='rock') == [11, 15]
+    assert index.music_ids_for(genre='jazz') == []
+    assert index.music_ids_for() == [10, 11, 12, 13, 14, 15]
+
+
+def test_facet_counts(index):
+    facets = index.facet_counts(index.rows(artist='bob'))
+    assert facets['total'] == 3
+    assert facets['genres'] == [{'genre': 'Rock', 'count': 2}]
+    assert facets['decades'] == [{'decade': '1990s', 'count': 1}, {'decade': '2000s', 'count': 1}]
+    assert facets['artists'] == [{'artist': 'Bob', 'count': 3}]
+
+
+def test_incremental_updates(index):
+    index.song_added({'id': 20, 'genre': 'Rock', 'year': 1995, 'artist': 'Dee'})
+    assert index.music_ids_for(genre='rock', year_min=1990, year_max=1999) == [11, 20]
+
+    index.song_updated({'id': 11, 'genre': 'Rock', 'year': 1999, 'artist': 'Bob'},
+                       {'id': 11, 'genre': 'Jazz', 'year': 1999, 'artist': 'Bob'})
+    assert index.music_ids_for(genre='rock') == [15, 20]
+    assert index.music_ids_for(genre='jazz') == [11]
+
+    index.song_removed({'id': 10})
+    assert index.music_ids_for(artist='ann') == [12]
+    assert 10 not in index.music_ids_for()
@@ -0,0 +1,39 @@
+"""Tests for the TF-IDF and hashed feature builders"""
+import numpy as np
+import pytest
+
+from feature_builder import HashedTfidfBuilder, VocabularyTfidfBuilder, create_feature_builder
+
+TEXTS = [
+    'pop dance energy summer love',
+    'rock guitar energy loud',
+    'pop love ballad piano',
+    'rap beats rhymes city',
+    'rock ballad guitar love',
+]
+
+
+def batches(texts, size=2):
+    return (texts[i:i + size] for i in range(0, len(texts), size))
+
+
+def test_hashed_builder_matches_vocabulary_tfidf():
+    vocabulary = VocabularyTfidfBuilder().fit_transform(batches(TEXTS))
+    hashed = HashedTfidfBuilder(n_features=1 << 20).fit_transform(batches(TEXTS))
+    assert hashed.shape == (len(TEXTS), 1 << 20)
+    np.testing.assert_allclose((hashed @ hashed.T).toarray(), (vocabulary @ vocabulary.T).toarray(), atol=1e-6)
+
+
+def test_hashed_transform_needs_no_vocabulary():
+    builder = HashedTfidfBuilder(n_features=1 << 12)
+    matrix = builder.fit_transform(batches(TEXTS))
+    new = builder.transform(['pop love ballad piano'])
+    assert new.shape == (1, 1 << 12)
+    assert (new @ matrix[2].T).toarray()[0, 0] == pytest.approx(1.0, rel=1e-5)
+
+
+def test_create_feature_builder_modes():
+    assert create_feature_builder('hashing').mode == 'hashing'
+    assert create_feature_builder('tfidf').mode == 'tfidf'
+    with pytest.raises(ValueError):
+        create_feature_builder('word2vec')
@@ -0,0 +1,42 @@
+"""Tests for the streaming JSON serializer"""
+import datetime
+import json
+import sqlite3
+
+import json_stream
+
+
+def make_cursor(count):
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE music (id INTEGER, title TEXT)")
+    connection.executemany("INSERT INTO music VALUES (?, ?)", [(i, f"Song {i}") for i in range(count)])
+    return connection.execute("SELECT id, title FROM music ORDER BY id")
+
+
+def test_json_array_matches_json_dumps():
+    body = b''.join(json_stream.json_array(json_stream.iter_rows(make_cursor(2000)),
+                                           key='music', envelope={'success': True}))
+    document = json.loads(body)
+    assert document['success'] is True
+    assert document['count'] == 2000
+    assert document['music'][1999] == {'id': 1999, 'title': 'Song 1999'}
+
+
+def test_json_array_empty_and_chunked():
+    assert json.loads(b''.join(json_stream.json_array(iter([]), key='music'))) == {'music': [], 'count': 0}
+    chunks = list(json_stream.json_array(json_stream.iter_rows(make_cursor(5000)), key='music'))
+    assert len(chunks) > 1
+
+
+def test_ndjson_lines_and_dates():
+    rows = [{'at': datetime.datetime(2024, 1, 2, 3, 4, 5)}, {'at': None}]
+    lines = b''.join(json_stream.ndjson(rows)).splitlines()
+    assert [json.loads(line) for line in lines] == [{'at': '2024-01-02T03:04:05'}, {'at': None}]
+
+
+def test_error_mid_stream_still_ends_the_document():
+    def rows():
+        yield {'id': 1}
+        raise RuntimeError('boom')
+    document = json.loads(b''.join(json_stream.json_array(rows(), key='music')))
+    assert document == {'music': [{'id': 1}], 'error': 'boom'}
@@ -0,0 +1,127 @@
+"""Tests for the sessionized next-track model"""
+import calendar
+import os
+import tempfile
+
+import pytest
+
+from next_track import NextTrackIndex, run_transitions, transition_scale
+from storage import SQLiteStorage
+
+HOUR = 3600
+NOW = calendar.timegm((2024, 1, 15, 0, 0, 0))
+
+
+def play(connection, user_id, music_id, timestamp):
+    connection.execute(
+        "INSERT INTO listening_history (user_id, music_id, timestamp) VALUES (?, ?, datetime(?, 'unixepoch'))",
+        (user_id, music_id, timestamp)
+    )
+
+
+def transitions(connection, half_life_days=10000, now=NOW):
+    """Weights as of ``now``, undoing the lazy decay"""
+    scale = transition_scale(connection.cursor(), half_life_days, now)
+    return {(row[0], row[1]): row[2] * scale for row in
+            connection.execute("SELECT from_music_id, to_music_id, weight FROM song_transitions")}
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    connection = storage.get_connection()
+    connection.executemany("INSERT INTO music (id, title, artist) VALUES (?, ?, ?)",
+                           [(i, f'Song {i}', 'A') for i in range(1, 6)])
+    connection.commit()
+    yield connection
+    storage.close()
+
+
+def test_sessions_split_on_time_gap(connection):
+    # u1: 1 -> 2 -> 3, then a new session 4 -> 2; u2: 1 -> 2, 1 -> 1 repeat is ignored
+    for music_id, offset in [(1, 0), (2, 200), (3, 400), (4, 3 * HOUR), (2, 3 * HOUR + 200)]:
+        play(connection, 'u1', music_id, NOW - 4 * HOUR + offset)
+    for music_id, offset in [(1, 0), (1, 100), (2, 200)]:
+        play(connection, 'u2', music_id, NOW - HOUR + offset)
+    connection.commit()
+
+    assert run_transitions(connection, half_life_days=10000, now=NOW) == 8
+    weights = transitions(connection)
+    assert set(weights) == {(1, 2), (2, 3), (4, 2)}
+    assert weights[(1, 2)] == pytest.approx(2.0, rel=1e-3)
+
+    index = NextTrackIndex(reload_seconds=0)
+    assert index.get(connection, 1) == [2]
+    assert index.get(connection, 3) == []
+
+
+def test_incremental_runs_stitch_sessions_and_decay(connection):
+    play(connection, 'u1', 1, NOW - 100)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=NOW)
+    assert transitions(connection) == {}
+
+    # The next play continues the session that ended in the previous run
+    play(connection, 'u1', 2, NOW)
+    play(connection, 'u2', 3, NOW)
+    play(connection, 'u2', 2, NOW + 10)
+    connection.commit()
+    assert run_transitions(connection, half_life_days=1, now=NOW + 10) == 3
+    assert transitions(connection, 1, NOW + 10)[(1, 2)] == pytest.approx(1.0, rel=1e-3)
+
+    # One half-life later the old transition has halved, the new one is fresh
+    play(connection, 'u3', 3, NOW + 86400)
+    play(connection, 'u3', 2, NOW + 86400 + 10)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=NOW + 86410)
+    weights = transitions(connection, 1, NOW + 86410)
+    assert weights[(1, 2)] == pytest.approx(0.5, rel=1e-3)
+    assert weights[(3, 2)] == pytest.approx(1.5, rel=1e-3)
+
+    top = connection.execute("SELECT next_music_id, position FROM next_track_top WHERE music_id = 3").fetchall()
+    assert [tuple(row) for row in top] == [(2, 1)]
+
+
+def test_runs_write_only_new_edges_and_index_reloads_changed_songs(connection):
+    for user_id, first, second in [('u1', 1, 2), ('u2', 3, 4)]:
+        play(connection, user_id, first, NOW)
+        play(connection, user_id, second, NOW + 10)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=NOW + 10)
+    index = NextTrackIndex(reload_seconds=0)
+    assert index.get(connection, 1) == [2] and index.get(connection, 3) == [4]
+    stored = connection.execute("SELECT weight FROM song_transitions WHERE from_music_id = 3").fetchone()[0]
+
+    play(connection, 'u3', 1, NOW + 3600)
+    play(connection, 'u3', 5, NOW + 3610)
+    play(connection, 'u3', 1, NOW + 3620)
+    play(connection, 'u3', 5, NOW + 3630)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=NOW + 3630)
+    # The untouched edge keeps its stored weight
+    assert connection.execute("SELECT weight FROM song_transitions WHERE from_music_id = 3").fetchone()[0] == stored
+
+    # Song 3 was not rewritten, so the index keeps it without re-reading it
+    connection.execute("DELETE FROM next_track_top WHERE music_id = 3")
+    assert index.get(connection, 1) == [5, 2]
+    assert index.get(connection, 3) == [4]
+
+
+def test_rebase_prunes_decayed_edges(connection):
+    play(connection, 'u1', 1, NOW)
+    play(connection, 'u1', 2, NOW + 10)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=NOW + 10)
+    index = NextTrackIndex(reload_seconds=0)
+    assert index.get(connection, 1) == [2]
+
+    later = NOW + 10 * 86400
+    play(connection, 'u2', 3, later)
+    play(connection, 'u2', 4, later + 10)
+    connection.commit()
+    run_transitions(connection, half_life_days=1, now=later + 10)
+    assert transitions(connection, 1, later + 10) == {(3, 4): pytest.approx(1.0, rel=1e-3)}
+    assert index.get(connection, 1) == []
+    assert index.get(connection, 3) == [4]
@@ -0,0 +1,73 @@
+"""Tests for the play-event staging log and its bulk consumer"""
+import os
+import tempfile
+
+import pytest
+
+from play_events import PlayEventLog, drain, get_offset, parse_events
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage():
+    tmp = tempfile.mkdtemp()
+    backend = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    backend.migrate()
+    connection = backend.get_connection()
+    connection.executemany(
+        "INSERT INTO music (id, title, artist) VALUES (?, ?, ?)",
+        [(1, 'One', 'A'), (2, 'Two', 'B')]
+    )
+    connection.commit()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def log():
+    tmp = tempfile.mkdtemp()
+    event_log = PlayEventLog(os.path.join(tmp, 'play_events.db'))
+    yield event_log
+    event_log.close()
+
+
+def test_parse_events_accepts_single_list_and_wrapped():
+    assert parse_events({'music_id': 1}) == [('anonymous', 1, 0, 'play')]
+    assert parse_events([{'music_id': '2', 'user_id': 7, 'duration': 30}]) == [('7', 2, 30, 'play')]
+    assert len(parse_events({'events': [{'music_id': 1}, {'music_id': 2}]})) == 2
+
+
+@pytest.mark.parametrize('payload', [[], [{'music_id': 'x'}], ['nope'], {'duration': 3}])
+def test_parse_events_rejects_bad_payloads(payload):
+    with pytest.raises(ValueError):
+        parse_events(payload)
+
+
+def test_drain_folds_events_in_bulk(storage, log):
+    log.append(parse_events([{'music_id': 1, 'user_id': 'u'}] * 3 + [{'music_id': 2, 'user_id': 'u'}]))
+    log.append([('u', 2, 0, 'listen'), ('u', 999, 0, 'play')])  # 999 is not in the catalog
+
+    assert drain(storage, log, batch_size=2) == 6
+    assert log.pending() == 0
+
+    connection = storage.get_connection()
+    assert connection.execute("SELECT COUNT(*) FROM listening_history").fetchone()[0] == 5
+    preferences = dict(connection.execute(
+        "SELECT music_id, preference_score FROM user_preferences WHERE user_id = 'u'"
+    ).fetchall())
+    assert preferences == {1: 3.0, 2: 1.0}
+    assert get_offset(connection) == 6
+
+
+def test_drain_skips_events_already_folded(storage, log):
+    log.append([('u', 1, 0, 'play')])
+    drain(storage, log)
+    # Simulate a crash after the fold committed but before the log was truncated
+    log.append([('u', 1, 0, 'play')])
+    log.connection.execute("INSERT INTO play_events (id, user_id, music_id, play_duration, interaction_type) "
+                           "VALUES (1, 'u', 1, 0, 'play')")
+    log.connection.commit()
+
+    assert drain(storage, log) == 1
+    connection = storage.get_connection()
+    assert connection.execute("SELECT COUNT(*) FROM listening_history").fetchone()[0] == 2
@@ -0,0 +1,129 @@
+"""Tests for the decayed popularity rollup"""
+import calendar
+import os
+import tempfile
+
+import pytest
+
+from popularity_rollup import APPLY_INCREMENT, popularity_scale, run_rollup
+from storage import SQLiteStorage, translate_sql
+
+DAY = 86400
+NOW = calendar.timegm((2024, 1, 15, 0, 0, 0))
+
+
+def play(connection, music_id, timestamp):
+    connection.execute(
+        "INSERT INTO listening_history (user_id, music_id, timestamp) VALUES ('u', ?, datetime(?, 'unixepoch'))",
+        (music_id, timestamp)
+    )
+
+
+def stored(connection):
+    return dict(connection.execute("SELECT id, popularity_score FROM music").fetchall())
+
+
+def popularity(connection, now=NOW):
+    """Scores as of ``now``, undoing the lazy decay"""
+    scale = popularity_scale(connection.cursor(), half_life_days=7, now=now)
+    return {music_id: score * scale for music_id, score in stored(connection).items()}
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    connection = storage.get_connection()
+    connection.executemany(
+        "INSERT INTO music (id, title, artist, popularity_score) VALUES (?, ?, ?, ?)",
+        [(1, 'One', 'A', 5), (2, 'Two', 'B', 0), (3, 'Three', 'C', 0)]
+    )
+    connection.commit()
+    yield connection
+    storage.close()
+
+
+def test_first_rollup_rebuilds_scores_from_history(connection):
+    play(connection, 1, NOW)
+    play(connection, 2, NOW - 7 * DAY)
+    play(connection, 2, NOW - 7 * DAY)
+    connection.commit()
+
+    assert run_rollup(connection, half_life_days=7, now=NOW) == 3
+    scores = popularity(connection)
+    # The legacy counter on song 1 is discarded
+    assert scores[1] == pytest.approx(1.0)
+    assert scores[2] == pytest.approx(1.0)
+    assert scores[3] == 0
+
+
+def test_incremental_rollup_matches_full_recompute(connection):
+    play(connection, 1, NOW - 3 * DAY)
+    connection.commit()
+    run_rollup(connection, half_life_days=7, now=NOW - 2 * DAY)
+
+    play(connection, 1, NOW - DAY)
+    play(connection, 3, NOW)
+    connection.commit()
+    # Only the two new plays are read
+    assert run_rollup(connection, half_life_days=7, now=NOW) == 2
+
+    scores = popularity(connection)
+    expected = 0.5 ** (3 / 7) + 0.5 ** (1 / 7)
+    assert scores[1] == pytest.approx(expected)
+    assert scores[3] == pytest.approx(1.0)
+
+
+def test_mixed_precision_timestamps_are_parsed(connection):
+    connection.execute("INSERT INTO listening_history (user_id, music_id, timestamp) VALUES ('u', 1, ?)",
+                       ('2024-01-01 00:00:00',))
+    connection.execute("INSERT INTO listening_history (user_id, music_id, timestamp) VALUES ('u', 2, ?)",
+                       ('2024-01-01 00:00:00.250',))
+    connection.commit()
+
+    run_rollup(connection, half_life_days=7, now=NOW)
+    scores = popularity(connection)
+    # Both plays are two weeks old, so neither counts as a fresh play
+    assert scores[1] == pytest.approx(0.25, rel=1e-3)
+    assert scores[2] == pytest.approx(0.25, rel=1e-3)
+
+
+def test_rollup_only_writes_played_songs(connection):
+    play(connection, 1, NOW - DAY)
+    play(connection, 2, NOW - DAY)
+    connection.commit()
+    run_rollup(connection, half_life_days=7, now=NOW)
+    before = stored(connection)
+
+    play(connection, 3, NOW + DAY)
+    connection.commit()
+    run_rollup(connection, half_life_days=7, now=NOW + DAY)
+    after = stored(connection)
+    assert after[1] == before[1] and after[2] == before[2]
+    # Decay still applies when reading, and ranks song 3 first
+    scores = popularity(connection, now=NOW + DAY)
+    assert scores[1] == pytest.approx(0.5 ** (2 / 7))
+    assert scores[3] == pytest.approx(1.0)
+    assert max(scores, key=scores.get) == 3
+
+
+def test_old_epoch_is_rebased(connection):
+    play(connection, 1, NOW)
+    connection.commit()
+    run_rollup(connection, half_life_days=7, now=NOW)
+
+    later = NOW + 70 * DAY
+    play(connection, 2, later)
+    connection.commit()
+    run_rollup(connection, half_life_days=7, now=later)
+    assert popularity_scale(connection.cursor(), half_life_days=7, now=later) == pytest.approx(1.0)
+    scores = stored(connection)
+    assert scores[1] == pytest.approx(0.5 ** 10)
+    assert scores[2] == pytest.approx(1.0)
+
+
+def test_apply_statement_translates_for_mysql():
+    assert translate_sql(APPLY_INCREMENT) == (
+        "UPDATE music SET popularity_score = popularity_score + %s WHERE id = %s"
+    )
@@ -0,0 +1,42 @@
+"""Tests for the named statement registry"""
+import sqlite3
+
+import queries
+
+
+def make_connection():
+    connection = sqlite3.connect(':memory:')
+    connection.execute("CREATE TABLE music (id INTEGER PRIMARY KEY, genre TEXT)")
+    connection.executemany("INSERT INTO music (id, genre) VALUES (?, ?)",
+                           [(i, 'pop' if i % 2 else 'rock') for i in range(1, 1001)])
+    return connection
+
+
+def test_bucket_sizes():
+    assert [queries.bucket_size(n) for n in (1, 2, 4, 5, 64, 65, 256)] == [1, 4, 4, 16, 64, 256, 256]
+
+
+def test_fetch_in_pads_and_chunks():
+    cursor = make_connection().cursor()
+    ids = list(range(1, 600)) + [1, 2, 5000]
+    rows = queries.fetch_in(cursor, 'existing_music_ids', ids)
+    assert sorted(row[0] for row in rows) == list(range(1, 600))
+
+    rows = queries.fetch_in(cursor, 'existing_music_ids', [3, 7, 11])
+    assert sorted(row[0] for row in rows) == [3, 7, 11]
+
+
+def test_statement_text_is_fixed_per_bucket():
+    assert queries.statement('music_by_ids', 4).count('?') == 4
+    assert queries.statement('user_profile') == queries.STATEMENTS['user_profile']
+
+
+def test_timing_hooks_see_every_named_statement():
+    seen = []
+    queries.add_timing_hook(lambda name, sql, params, elapsed_ms: seen.append(name))
+    try:
+        queries.fetch_in(make_connection().cursor(), 'music_ids_by_genres', ['pop'])
+    finally:
+        queries.timing_hooks.pop()
+    assert seen == ['music_ids_by_genres']
+    assert any(e['name'] == 'music_ids_by_genres' for e in queries.statement_timings.summary())
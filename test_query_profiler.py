@@ -0,0 +1,66 @@
+"""Tests for the slow-query log"""
+import logging
+import sqlite3
+
+from query_profiler import ProfiledConnection, SlowQueryLog, normalize_sql, slow_query_log
+
+
+def make_connection():
+    connection = sqlite3.connect(':memory:', factory=ProfiledConnection)
+    connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    return connection
+
+
+def test_threshold_and_aggregation():
+    connection = make_connection()
+    log = SlowQueryLog(threshold_ms=10, enabled=True)
+    log.observe(connection, "SELECT * FROM users", (), 5)
+    assert log.worst() == []
+
+    for elapsed_ms in (12, 30):
+        log.observe(connection, "SELECT *\n  FROM users", (), elapsed_ms)
+    [entry] = log.worst()
+    assert (entry['sql'], entry['count'], entry['max_ms'], entry['avg_ms']) == ("SELECT * FROM users", 2, 30, 21)
+    assert entry['full_scan']
+
+    assert SlowQueryLog(threshold_ms=0, enabled=False).worst() == []
+
+
+def test_entries_are_bounded():
+    connection = make_connection()
+    log = SlowQueryLog(threshold_ms=0, enabled=True, max_entries=3)
+    for user_id in range(5):
+        log.observe(connection, f"SELECT email FROM users WHERE id = {user_id}", (), 1)
+    # Seeing the oldest survivor again keeps it over the newer ones
+    log.observe(connection, "SELECT email FROM users WHERE id = 2", (), 1)
+    log.observe(connection, "SELECT id FROM users", (), 1)
+    assert sorted(entry['sql'] for entry in log.worst()) == [
+        "SELECT email FROM users WHERE id = 2",
+        "SELECT email FROM users WHERE id = 4",
+        "SELECT id FROM users",
+    ]
+
+
+def test_literals_and_parameters_are_not_recorded(caplog):
+    connection = make_connection()
+    log = SlowQueryLog(threshold_ms=0, enabled=True)
+    with caplog.at_level(logging.WARNING, logger='query_profiler'):
+        log.observe(connection, "SELECT id FROM users WHERE email = 'a@b.com'", (), 1)
+        log.observe(connection, "SELECT id FROM users WHERE email = ?", ('secret@b.com',), 1)
+    assert normalize_sql("WHERE name = 'O''Brien' AND x = 'y'") == "WHERE name = ? AND x = ?"
+    assert [entry['sql'] for entry in log.worst()] == ["SELECT id FROM users WHERE email = ?"]
+    assert log.worst()[0]['count'] == 2
+    assert '@b.com' not in caplog.text
+
+
+def test_admin_view_lists_slow_queries(admin_client, monkeypatch):
+    monkeypatch.setattr(slow_query_log, 'enabled', True)
+    monkeypatch.setattr(slow_query_log, 'threshold_ms', 0)
+    slow_query_log.clear()
+    slow_query_log.observe(make_connection(), "SELECT email FROM users ORDER BY email", (), 75)
+
+    page = admin_client.get('/admin/slow-queries').get_data(as_text=True)
+    assert 'SELECT email FROM users ORDER BY email' in page
+
+    admin_client.post('/admin/slow-queries/reset')
+    assert slow_query_log.worst() == []
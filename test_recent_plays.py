@@ -0,0 +1,41 @@
+"""Tests for the per-user recently-played LRU"""
+import os
+import tempfile
+
+import pytest
+
+from recent_plays import RecentlyPlayed
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    yield storage.get_connection()
+    storage.close()
+
+
+def test_keeps_last_distinct_songs_most_recent_first(connection):
+    recent = RecentlyPlayed(size=3)
+    for played_at, music_id in enumerate([1, 2, 3, 2, 4]):
+        recent.record(connection, 'u', music_id, played_at=played_at)
+    connection.commit()
+
+    assert recent.get(connection, 'u') == [4, 2, 3]
+    # The table is trimmed to the same bound and agrees with a cold cache
+    assert connection.execute("SELECT COUNT(*) FROM recent_plays WHERE user_id = 'u'").fetchone()[0] == 3
+    assert RecentlyPlayed(size=3).get(connection, 'u') == [4, 2, 3]
+
+
+def test_touch_updates_cached_users_only(connection):
+    recent = RecentlyPlayed(size=3, max_users=1)
+    recent.record(connection, 'a', 1, played_at=1)
+    assert recent.get(connection, 'a') == [1]
+    recent.touch('a', 2)
+    recent.touch('b', 5)  # not cached: left to the table
+    assert recent.get(connection, 'a') == [2, 1]
+    assert recent.get(connection, 'b') == []
+    # 'b' pushed 'a' out of the one-user cache
+    assert list(recent.users) == ['b']
@@ -0,0 +1,97 @@
+"""Tests for sharded top-k scoring"""
+import threading
+
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+import sharded_scoring
+from embeddings import SongEmbeddings
+from sharded_scoring import ShardedScorer
+
+SEED_SETS = [[0, 5, 17], [42], [], [99, 3]]
+
+
+def feature_matrix(n_songs=200, n_terms=60, seed=0):
+    matrix = sparse.random(n_songs, n_terms, density=0.08, format='csr', random_state=seed, dtype=np.float32)
+    # Duplicate rows make ties, which must resolve by catalog position
+    matrix = sparse.vstack([matrix, matrix[:20]], format='csr')
+    return normalize(matrix)
+
+
+def exact_top_k(matrix, seeds, k):
+    query = normalize(sparse.csr_matrix(matrix[seeds].mean(axis=0)))
+    scores = (query @ matrix.T).toarray()[0]
+    scores[seeds] = -1.0
+    order = np.lexsort((np.arange(len(scores)), -scores))[:k]
+    return order.tolist()
+
+
+@pytest.mark.parametrize('shards,executor', [(1, 'threads'), (3, 'threads'), (7, 'processes')])
+def test_sharded_top_k_matches_exact_ranking(shards, executor):
+    matrix = feature_matrix()
+    scorer = ShardedScorer(matrix, shards=shards, executor=executor)
+    try:
+        assert scorer.shard_count == shards
+        results = scorer.top_k(SEED_SETS, k=10)
+    finally:
+        scorer.close()
+    for seeds, top in zip(SEED_SETS, results):
+        assert len(top) == 10
+        if seeds:
+            assert [idx for idx, _ in top] == exact_top_k(matrix, seeds, 10)
+            assert not set(seeds) & {idx for idx, _ in top}
+        else:
+            assert all(score == 0 for _, score in top)
+
+
+def test_sharded_embeddings_match_unsharded():
+    embeddings = SongEmbeddings.fit(feature_matrix(), dim=16)
+    single = ShardedScorer(embeddings, shards=1).top_k(SEED_SETS, k=5)
+    scorer = ShardedScorer(embeddings, shards=4)
+    try:
+        assert scorer.top_k(SEED_SETS, k=5) == single
+    finally:
+        scorer.close()
+
+
+def test_top_k_handles_zero_and_oversized_k():
+    matrix = feature_matrix()
+    scorer = ShardedScorer(matrix, shards=3, executor='threads')
+    try:
+        assert scorer.top_k(SEED_SETS, k=0) == [[] for _ in SEED_SETS]
+        results = scorer.top_k(SEED_SETS, k=500)
+    finally:
+        scorer.close()
+    for seeds, top in zip(SEED_SETS, results):
+        assert len(top) == matrix.shape[0]
+        if seeds:
+            assert [idx for idx, _ in top] == exact_top_k(matrix, seeds, matrix.shape[0])
+
+
+def test_close_waits_for_queries_in_flight(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    exact = sharded_scoring.shard_top_k
+
+    def slow_shard_top_k(*args):
+        started.set()
+        release.wait(5)
+        return exact(*args)
+
+    monkeypatch.setattr(sharded_scoring, 'shard_top_k', slow_shard_top_k)
+    scorer = ShardedScorer(feature_matrix(), shards=3, executor='threads')
+    results = []
+    query = threading.Thread(target=lambda: results.append(scorer.top_k(SEED_SETS, k=5)))
+    query.start()
+    assert started.wait(5)
+
+    scorer.close()
+    # The swap-out happened mid-query: the pool stays up until the query is done
+    assert scorer.executor is not None
+    release.set()
+    query.join(5)
+    assert len(results) == 1 and len(results[0]) == len(SEED_SETS)
+    assert scorer.executor is None
+    # Later queries on the retired scorer score inline
+    assert len(scorer.top_k(SEED_SETS, k=5)) == len(SEED_SETS)
@@ -0,0 +1,49 @@
+"""Tests for the streaming INSERT ... VALUES parser"""
+import io
+
+import pytest
+
+from sql_dump_parser import InsertStatementParser, SQLDumpParseError
+
+DUMP = r"""
+-- MySQL dump
+CREATE TABLE `music` (`id` int, `title` varchar(255));
+INSERT INTO `users` VALUES (1,'Ann','a@x.com','INSERT INTO `music` VALUES (9);');
+INSERT INTO `music` VALUES (1,'It\'s ok','Art, \"Quoted\"',NULL,'pop',1999,210,'','line\nbreak'),
+(2,'Doubled ''quote''','B','C','rock',NULL,-5,'u','f (with) parens; and semicolon');
+/*!40000 ALTER TABLE `music` ENABLE KEYS */;
+insert into music (title, artist, year) values ('Solo','Z',2001.5);
+"""
+
+
+def parse(text, chunk_size=1 << 20):
+    parser = InsertStatementParser(io.StringIO(text), table='music', chunk_size=chunk_size)
+    return list(parser), parser
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 1 << 20])
+def test_parses_rows_across_chunk_boundaries(chunk_size):
+    rows, parser = parse(DUMP, chunk_size)
+    assert rows == [
+        (None, (1, "It's ok", 'Art, "Quoted"', None, 'pop', 1999, 210, '', 'line\nbreak')),
+        (None, (2, "Doubled 'quote'", 'B', 'C', 'rock', None, -5, 'u', 'f (with) parens; and semicolon')),
+        (('title', 'artist', 'year'), ('Solo', 'Z', 2001.5)),
+    ]
+    assert parser.statements == 3
+    assert parser.stats()['rows'] == 3
+
+
+def test_rows_count_only_the_wanted_table():
+    rows, parser = parse("INSERT INTO users VALUES (1,'Ann'),(2,'Bo');")
+    assert (rows, parser.statements, parser.rows) == ([], 1, 0)
+
+
+def test_unterminated_string_raises():
+    with pytest.raises(SQLDumpParseError):
+        parse("INSERT INTO music VALUES (1,'open")
+
+
+def test_long_values_are_linear():
+    feature = 'x' * 200000 + "\\'" + 'y' * 200000
+    rows, _ = parse(f"INSERT INTO music VALUES (1,'{feature}');", chunk_size=4096)
+    assert rows[0][1][1] == 'x' * 200000 + "'" + 'y' * 200000
@@ -0,0 +1,50 @@
+"""Tests for the materialized catalog stats"""
+import os
+import tempfile
+
+import pytest
+
+from stats_service import CatalogStats
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    connection = storage.get_connection()
+    connection.executemany(
+        "INSERT INTO music (id, title, artist, genre, year, popularity_score) VALUES (?, ?, ?, ?, ?, ?)",
+        [(1, 'One', 'A', 'pop', 2001, 3), (2, 'Two', 'B', 'rock', 2001, 2), (3, 'Three', 'C', 'pop', 1999, 1)]
+    )
+    connection.commit()
+    yield connection
+    storage.close()
+
+
+def test_reconcile_builds_summary(connection):
+    stats = CatalogStats()
+    stats.reconcile(connection)
+    summary = stats.summary(popular_limit=2)
+    assert summary['total_songs'] == 3
+    assert summary['genres'] == [{'genre': 'pop', 'count': 2}, {'genre': 'rock', 'count': 1}]
+    assert summary['years'] == [{'year': 1999, 'count': 1}, {'year': 2001, 'count': 2}]
+    assert [song['title'] for song in summary['popular_songs']] == ['One', 'Two']
+
+
+def test_incremental_updates_match_reconcile(connection):
+    stats = CatalogStats()
+    stats.reconcile(connection)
+
+    connection.execute("INSERT INTO music (id, title, artist, genre, year) VALUES (4, 'Four', 'D', 'jazz', 2010)")
+    stats.song_added({'id': 4, 'title': 'Four', 'artist': 'D', 'genre': 'jazz', 'year': 2010})
+    connection.execute("UPDATE music SET title = 'Uno', genre = 'rock' WHERE id = 1")
+    stats.song_updated({'id': 1, 'genre': 'pop', 'year': 2001}, {'title': 'Uno', 'artist': 'A', 'genre': 'rock', 'year': 2001})
+    connection.execute("DELETE FROM music WHERE id = 3")
+    stats.song_removed({'id': 3, 'genre': 'pop', 'year': 1999})
+    connection.commit()
+
+    incremental = stats.summary(popular_limit=10)
+    stats.reconcile(connection)
+    assert incremental == stats.summary(popular_limit=10)
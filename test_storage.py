@@ -0,0 +1,270 @@
+"""Tests for the storage backends.
+
+Runs against a temporary SQLite file, and against MySQL (or MariaDB) when one
+is reachable with the MYSQL_* environment variables, e.g.
+
+    docker run -e MYSQL_ALLOW_EMPTY_PASSWORD=1 -e MYSQL_DATABASE=music_test -p 3306:3306 mysql:8
+    MYSQL_DATABASE=music_test python -m pytest test_storage.py
+
+Without a server, ``FakeMySQLPool`` stands in for mysql.connector's pool.
+``MySQLStorage`` and ``MySQLCursor`` run unchanged on top of it, and every
+statement they send is checked for SQLite-only syntax, leftover ``?``
+placeholders, parameter counts and temporary tables opened twice in one
+statement.
+"""
+import os
+import re
+import tempfile
+import types
+
+import pandas as pd
+import pytest
+
+import queries
+import storage as storage_module
+from catalog_ingest import SPOTIFY_CSV_SOURCE, spotify_songs, sync_songs
+from migrations import MIGRATIONS
+from next_track import run_transitions
+from play_events import fold_events
+from popularity_rollup import run_rollup
+from storage import MySQLStorage, SQLiteStorage, translate_sql
+
+
+def make_sqlite_storage():
+    tmp = tempfile.mkdtemp()
+    return SQLiteStorage(os.path.join(tmp, 'test.db'))
+
+
+def make_mysql_storage():
+    try:
+        storage = MySQLStorage(pool_size=2, pool_name='music_test_pool')
+    except Exception as e:
+        pytest.skip(f"MySQL not available: {e}")
+    connection = storage.get_connection()
+    for table in ['song_transitions', 'next_track_top', 'next_track_session_tails', 'next_track_state',
+                  'recent_plays', 'popularity_rollup_state', 'play_event_offsets', 'user_recommendations',
+                  'playlist_songs', 'playlists', 'liked_songs', 'listening_history',
+                  'user_preferences', 'music', 'users', 'schema_version']:
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+    return storage
+
+
+@pytest.fixture(params=['sqlite', 'mysql'])
+def storage(request):
+    backend = make_sqlite_storage() if request.param == 'sqlite' else make_mysql_storage()
+    backend.migrate()
+    yield backend
+    backend.close()
+
+
+def test_migrations_reach_latest_version(storage):
+    connection = storage.get_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    assert cursor.fetchone()[0] == MIGRATIONS[-1][0]
+    # Running again is a no-op
+    assert storage.migrate() == MIGRATIONS[-1][0]
+
+
+def test_rows_support_key_and_index_access(storage):
+    connection = storage.get_connection()
+    cursor = connection.cursor()
+    cursor.execute(
+        "INSERT INTO music (title, artist, genre, year) VALUES (?, ?, ?, ?)",
+        ("It's Alive?", 'Artist', 'rock', 1999)
+    )
+    connection.commit()
+    cursor.execute("SELECT id, title, genre FROM music WHERE title = ?", ("It's Alive?",))
+    row = cursor.fetchone()
+    assert row['title'] == "It's Alive?"
+    assert row[2] == 'rock'
+    assert dict(row)['genre'] == 'rock'
+
+
+def test_upsert_and_insert_or_ignore(storage):
+    connection = storage.get_connection()
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO music (title, artist) VALUES (?, ?)", ('Song', 'Artist'))
+    music_id = cursor.lastrowid
+    upsert = """
+    INSERT INTO user_preferences (user_id, music_id, preference_score, interaction_type)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id, music_id) DO UPDATE SET
+    preference_score = preference_score + excluded.preference_score
+    """
+    cursor.execute(upsert, ('1', music_id, 1.0, 'play'))
+    cursor.execute(upsert, ('1', music_id, 0.5, 'play'))
+    cursor.execute("INSERT OR IGNORE INTO playlists (user_id, name) VALUES (?, ?)", ('1', 'Mix'))
+    cursor.execute("INSERT OR IGNORE INTO playlists (user_id, name) VALUES (?, ?)", ('1', 'Mix'))
+    connection.commit()
+
+    cursor.execute("SELECT preference_score FROM user_preferences WHERE user_id = ?", ('1',))
+    assert cursor.fetchone()['preference_score'] == pytest.approx(1.5)
+    cursor.execute("SELECT COUNT(*) FROM playlists WHERE user_id = ?", ('1',))
+    assert cursor.fetchone()[0] == 1
+
+
+def test_translate_sql_for_mysql():
+    assert translate_sql("SELECT * FROM music WHERE id = ? AND title = '?'") == \
+        "SELECT * FROM music WHERE id = %s AND title = '?'"
+    assert translate_sql("INSERT OR IGNORE INTO t (a) VALUES (?)") == "INSERT IGNORE INTO t (a) VALUES (%s)"
+    assert translate_sql("SELECT * FROM music ORDER BY RANDOM() LIMIT 8") == \
+        "SELECT * FROM music ORDER BY RAND() LIMIT 8"
+    translated = translate_sql(
+        "INSERT INTO p (a, b) VALUES (?, ?) ON CONFLICT(a) DO UPDATE SET b = b + excluded.b"
+    )
+    assert translated == "INSERT INTO p (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = b + VALUES(b)"
+    assert translate_sql("CREATE INDEX IF NOT EXISTS idx ON t(a)") == "CREATE INDEX idx ON t(a)"
+
+
+QUOTED_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+SQLITE_ONLY_PATTERNS = [
+    r"\bON\s+CONFLICT\b", r"\bexcluded\.", r"\bINSERT\s+OR\b", r"\bAUTOINCREMENT\b", r"\bPRAGMA\b",
+    r"\bINDEX\s+IF\s+NOT\s+EXISTS\b", r"\bRANDOM\(\)", r"\bstrftime\(", r"\bdatetime\(",
+    # MySQL can't key a TEXT column without a prefix length
+    r"\bTEXT\s+(NOT\s+NULL\s+)?PRIMARY\s+KEY\b",
+]
+TEMPORARY_TABLE_PATTERN = re.compile(r"CREATE\s+TEMPORARY\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+class FakeMySQLConnection:
+    """Records statements like mysql.connector would receive them; SELECTs return canned rows"""
+
+    def __init__(self, results=None):
+        self.results = results or {}  # SQL substring -> (columns, rows)
+        self.statements = []
+        self.temporary_tables = set()
+        self.last_id = 0
+
+    def check(self, sql, params):
+        self.statements.append(sql)
+        text = QUOTED_PATTERN.sub("''", sql)
+        for pattern in SQLITE_ONLY_PATTERNS:
+            assert not re.search(pattern, text, re.IGNORECASE), f"SQLite-only syntax {pattern!r} in: {sql}"
+        assert '?' not in text, f"Untranslated placeholder in: {sql}"
+        assert text.count('%s') == len(params or ()), f"{len(params or ())} parameters for: {sql}"
+        created = TEMPORARY_TABLE_PATTERN.search(text)
+        if created:
+            self.temporary_tables.add(created.group(1).lower())
+        for table in self.temporary_tables:
+            assert len(re.findall(rf"\b{table}\b", text, re.IGNORECASE)) <= 1, f"Reopens {table} in: {sql}"
+
+    def cursor(self, buffered=False):
+        return FakeMySQLCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeMySQLCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.column_names = ()
+        self.lastrowid = None
+        self.rowcount = 0
+        self.description = None
+
+    def execute(self, sql, params=None):
+        self.connection.check(sql, params)
+        self.column_names, self.rows = (), []
+        for fragment, (columns, rows) in self.connection.results.items():
+            if fragment in sql:
+                self.column_names, self.rows = tuple(columns), list(rows)
+                break
+        else:
+            if re.match(r"\s*SELECT\s+(MAX|COUNT)\(", sql, re.IGNORECASE):
+                self.column_names, self.rows = ('value',), [(None,)]
+        if sql.lstrip().upper().startswith('INSERT'):
+            self.connection.last_id += 1
+            self.lastrowid = self.connection.last_id
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.connection.check(sql, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size=1):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_mysql(monkeypatch):
+    """``(MySQLStorage, FakeMySQLConnection)`` running on the fake pool"""
+    connection = FakeMySQLConnection()
+
+    class FakeMySQLPool:
+        def __init__(self, **config):
+            self.config = config
+
+        def get_connection(self):
+            return connection
+
+    monkeypatch.setattr(storage_module, 'pooling', types.SimpleNamespace(MySQLConnectionPool=FakeMySQLPool))
+    backend = MySQLStorage(config={'host': 'fake'}, pool_size=1, pool_name='fake')
+    yield backend, connection
+    backend.close()
+
+
+def test_mysql_migrations_use_mysql_ddl(fake_mysql):
+    backend, connection = fake_mysql
+    assert backend.migrate() == MIGRATIONS[-1][0]
+    ddl = '\n'.join(connection.statements)
+    assert 'AUTO_INCREMENT' in ddl
+    assert 'CREATE UNIQUE INDEX idx_music_track_id ON music(track_id)' in ddl
+    assert 'ALTER TABLE music ADD COLUMN source VARCHAR(20)' in ddl
+    assert 'ALTER TABLE music MODIFY popularity_score DOUBLE DEFAULT 0' in ddl
+
+
+def test_mysql_statements_are_translated(fake_mysql):
+    backend, connection = fake_mysql
+    connection.results = {
+        'SELECT id FROM music WHERE id IN': (('id',), [(1,)]),
+        'SELECT music_id, timestamp FROM listening_history': (
+            ('music_id', 'timestamp'), [(1, '2024-01-01 00:00:00')]),
+        'SELECT id, user_id, music_id, timestamp FROM listening_history': (
+            ('id', 'user_id', 'music_id', 'timestamp'),
+            [(1, 'u1', 1, '2024-01-01 00:00:00'), (2, 'u1', 2, '2024-01-01 00:01:00')]),
+        'SELECT MAX(id) FROM listening_history': (('value',), [(2,)]),
+    }
+    db = backend.get_connection()
+    cursor = db.cursor()
+    for (name, in_size), sql in queries.COMPILED.items():
+        cursor.execute(sql, [1] * sql.count('?'))
+
+    fold_events(db, [{'id': 1, 'user_id': 'u1', 'music_id': 1, 'play_duration': 30,
+                      'received_at': '2024-01-01 00:00:00.000', 'interaction_type': 'play'}])
+    run_rollup(db, now=1704067200)
+    run_transitions(db, now=1704067200)
+    songs = spotify_songs(pd.DataFrame({'track_id': ['t1'], 'track_name': ['Song'], 'track_artist': ['A']}))
+    sync_songs(db, songs, SPOTIFY_CSV_SOURCE, prune=True)
+    executed = '\n'.join(connection.statements)
+    assert 'ON DUPLICATE KEY UPDATE' in executed
+    assert 'CREATE TEMPORARY TABLE' in executed
+
+
+def test_mysql_cursor_rows_support_key_access(fake_mysql):
+    backend, connection = fake_mysql
+    connection.results = {'FROM music WHERE title': (('id', 'title'), [(7, "It's Alive?")])}
+    cursor = backend.get_connection().cursor()
+    cursor.execute("SELECT id, title FROM music WHERE title = ?", ("It's Alive?",))
+    row = cursor.fetchone()
+    assert (row['title'], row[0], dict(row)) == ("It's Alive?", 7, {'id': 7, 'title': "It's Alive?"})
+    cursor.execute("INSERT OR IGNORE INTO playlists (user_id, name) VALUES (?, ?)", ('1', 'Mix'))
+    assert connection.statements[-1] == "INSERT IGNORE INTO playlists (user_id, name) VALUES (%s, %s)"
@@ -0,0 +1,78 @@
+"""Tests for the sliding-window trending tracker and its sketches"""
+import os
+import tempfile
+
+import pytest
+
+from trending import HyperLogLog, SpaceSaving, TrendingTracker
+
+NOW = 1_700_000_000.0
+
+
+def test_hyperloglog_estimates_within_error():
+    sketch = HyperLogLog()
+    for user in range(20000):
+        sketch.add(f'user-{user}')
+        sketch.add(f'user-{user}')
+    assert sketch.estimate() == pytest.approx(20000, rel=0.15)
+
+    small = HyperLogLog()
+    for user in range(7):
+        small.add(user)
+    assert round(small.estimate()) == 7
+
+
+def test_space_saving_keeps_heavy_hitters():
+    summary = SpaceSaving(capacity=10)
+    for i in range(2000):
+        summary.add('hot' if i % 3 == 0 else f'noise-{i}')
+    count, error = summary.counters['hot']
+    assert count - error <= 667 <= count
+    assert len(summary.counters) == 10
+
+
+def test_trending_window_slides_and_counts_listeners():
+    tracker = TrendingTracker(window=600, bucket_seconds=60, capacity=50, refresh_seconds=0)
+    for user in range(30):
+        tracker.record(1, f'u{user}', 'pop', now=NOW)
+    for user in range(5):
+        tracker.record(2, 'same-user', 'rock', now=NOW + 120)
+        tracker.record(3, f'u{user}', 'rock', now=NOW + 120)
+
+    songs = tracker.trending_songs(3, now=NOW + 130)
+    assert [(music_id, plays) for music_id, plays, _ in songs] == [(1, 30), (2, 5), (3, 5)]
+    listeners = {music_id: unique for music_id, _, unique in songs}
+    assert listeners[1] == pytest.approx(30, abs=2)
+    assert (listeners[2], listeners[3]) == (1, 5)
+    assert tracker.trending_genres(1, now=NOW + 130)[0][:2] == ('pop', 30)
+    assert tracker.unique_listeners(genre='rock', now=NOW + 130) == 6
+
+    # Song 1's bucket has left the window
+    songs = tracker.trending_songs(3, now=NOW + 650)
+    assert [music_id for music_id, _, _ in songs] == [2, 3]
+
+
+def test_snapshot_round_trip():
+    tracker = TrendingTracker(window=600, bucket_seconds=60, refresh_seconds=0)
+    for user in range(4):
+        tracker.record(7, f'u{user}', 'jazz', now=NOW)
+    path = os.path.join(tempfile.mkdtemp(), 'trending.npz')
+    tracker.save(path)
+
+    restored = TrendingTracker(window=600, bucket_seconds=60, refresh_seconds=0)
+    assert restored.load(path, now=NOW + 10)
+    assert restored.trending_songs(now=NOW + 10) == [(7, 4, 4)]
+    assert not TrendingTracker().load(path + '.missing')
+
+
+def test_unusable_snapshot_starts_empty():
+    path = os.path.join(tempfile.mkdtemp(), 'trending.npz')
+    with open(path, 'wb') as f:
+        f.write(b'not a snapshot')
+    tracker = TrendingTracker(window=600, bucket_seconds=60, refresh_seconds=0)
+    assert not tracker.load(path, now=NOW)
+    assert tracker.trending_songs(now=NOW) == []
+
+    # A snapshot written with another bucket size is ignored too
+    TrendingTracker(window=600, bucket_seconds=30).save(path)
+    assert not tracker.load(path, now=NOW)
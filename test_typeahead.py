@@ -0,0 +1,47 @@
+"""Tests for the trigram type-ahead index"""
+import pyarrow as pa
+
+from typeahead import TrigramIndex, normalize, normalize_query
+
+
+def catalog():
+    # Snapshot order is popularity order
+    return pa.table({
+        'id': [10, 20, 30, 40],
+        'title': ['Yesterday', 'Hey Jude', 'Héy Judé (Live)', None],
+        'artist': ['The Beatles', 'The Beatles', 'Cover Band', 'Beyoncé'],
+        'album': ['Help!', None, 'Covers', 'Lemonade'],
+    })
+
+
+def ids(suggestions):
+    return [suggestion['id'] for suggestion in suggestions[0]]
+
+
+def test_query_normalization_matches_arrow():
+    for text in ['Héy  Judé!', 'AC/DC', 'Sigur Rós — Hoppípolla', 'snake_case']:
+        assert normalize_query(text) == normalize(pa.array([text]))[0].as_py()
+
+
+def test_suggest_tolerates_typos_and_ranks_by_popularity():
+    index = TrigramIndex()
+    index.build(catalog())
+    assert ids(index.suggest('hey jde')) == [20, 30]
+    assert ids(index.suggest('beatls')) == [10, 20]
+    assert ids(index.suggest('yesterdy')) == [10]
+    assert ids(index.suggest('BEYONCE')) == [40]
+    assert ids(index.suggest('b', limit=2)) == [10, 20]
+    assert ids(index.suggest('zzzz')) == []
+    assert index.suggest('hey jude')[0][0]['score'] == 1.0
+
+
+def test_admin_edits_update_the_index():
+    index = TrigramIndex()
+    index.build(catalog())
+    index.song_added({'id': 50, 'title': 'Heyday', 'artist': 'Mint Royale', 'album': None})
+    index.song_removed({'id': 20})
+    assert ids(index.suggest('hey')) == [30, 50, 10]
+    index.song_updated({'id': 50}, {'id': 50, 'title': 'Holiday', 'artist': 'Mint Royale', 'album': None})
+    assert 50 not in ids(index.suggest('heyd'))
+    assert ids(index.suggest('holid')) == [50]
+    assert ids(index.suggest('b', limit=1)) == [10]
@@ -0,0 +1,40 @@
+"""Tests for the user profile/role cache"""
+import os
+import tempfile
+
+import pytest
+
+from storage import SQLiteStorage
+from user_cache import UserCache
+
+
+@pytest.fixture
+def connection():
+    tmp = tempfile.mkdtemp()
+    storage = SQLiteStorage(os.path.join(tmp, 'test.db'))
+    storage.migrate()
+    connection = storage.get_connection()
+    connection.execute("INSERT INTO users (id, name, email, password, role) VALUES (1, 'Ann', 'a@x', 'h', 'Admin')")
+    connection.commit()
+    yield connection
+    storage.close()
+
+
+def test_hits_skip_the_database_until_the_ttl_expires(connection):
+    cache = UserCache(ttl=60)
+    assert cache.get(connection, 1)['role'] == 'Admin'
+    connection.execute("UPDATE users SET role = 'User' WHERE id = 1")
+    assert cache.get(connection, 1)['role'] == 'Admin'
+
+    expired = UserCache(ttl=0)
+    expired.get(connection, 1)
+    assert expired.get(connection, 1)['role'] == 'User'
+
+
+def test_invalidate_drops_the_entry(connection):
+    cache = UserCache(ttl=60)
+    cache.get(connection, 1)
+    connection.execute("UPDATE users SET role = 'User' WHERE id = 1")
+    cache.invalidate(1)
+    assert cache.get(connection, 1)['role'] == 'User'
+    assert cache.get(connection, 2) is None
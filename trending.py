@@ -0,0 +1,302 @@
+"""Real-time "trending now" tracker.
+
+Every play recorded through ``/api/play``, ``/listen`` and
+``/update_recommendation`` is fed to ``TrendingTracker.record()``. A full
+scan of ``listening_history`` per request is never needed. The tracker keeps
+a sliding window of ``TRENDING_WINDOW_SECONDS`` made of
+``TRENDING_BUCKET_SECONDS`` buckets. Each bucket holds:
+
+* a Space-Saving summary of the heaviest songs and genres. It has a fixed
+  ``TRENDING_CAPACITY`` counters, and any item played more than
+  ``plays / capacity`` times is guaranteed to be tracked;
+* a HyperLogLog sketch of unique listeners per tracked song and per genre.
+  It uses ``2**HLL_PRECISION`` one-byte registers, about 4.6% standard
+  error.
+
+Buckets that slide out of the window are dropped whole. Every
+``TRENDING_REFRESH_SECONDS`` the buckets are merged into ranked top-k lists,
+so ``trending_songs()`` and ``trending_genres()`` are O(k) slices.
+``unique_listeners()`` merges at most one sketch per bucket. The state is
+saved to ``TRENDING_SNAPSHOT_PATH`` (next to the app by default) every
+``TRENDING_SNAPSHOT_SECONDS`` and reloaded at start-up, so trending survives
+restarts. The snapshot is an ``.npz`` of plain arrays: bucket starts, and per
+bucket the tracked items, their counts and errors, and their listener
+registers as one matrix. It is loaded without pickle. A corrupt snapshot, or
+one written with a different bucket size or sketch precision, is logged and
+ignored, and the tracker starts empty.
+"""
+import hashlib
+import heapq
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TRENDING_WINDOW_SECONDS = float(os.environ.get('TRENDING_WINDOW_SECONDS', str(60 * 60)))
+TRENDING_BUCKET_SECONDS = float(os.environ.get('TRENDING_BUCKET_SECONDS', str(5 * 60)))
+TRENDING_CAPACITY = 1000
+TRENDING_TOP_K = 50
+TRENDING_REFRESH_SECONDS = 10
+TRENDING_SNAPSHOT_PATH = os.environ.get(
+    'TRENDING_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trending_snapshot.npz')
+)
+TRENDING_SNAPSHOT_SECONDS = float(os.environ.get('TRENDING_SNAPSHOT_SECONDS', '60'))
+HLL_PRECISION = 9
+SNAPSHOT_FORMAT = 1
+
+
+class HyperLogLog:
+    """Cardinality sketch with ``2**precision`` registers"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * np.log(m / zeros)
+        return float(raw)
+
+
+class SpaceSaving:
+    """Top-``capacity`` heavy hitters; counts overestimate by at most ``error``"""
+
+    def __init__(self, capacity=TRENDING_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}  # item -> [count, error]
+        self.heap = []  # (count, item), may hold stale entries
+
+    def add(self, item, count=1):
+        """Count ``item``; returns the item evicted to make room, if any"""
+        evicted = None
+        counter = self.counters.get(item)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[item] = [0, 0]
+            else:
+                # Replace the minimum, inheriting its count as the error bound
+                while True:
+                    min_count, min_item = heapq.heappop(self.heap)
+                    if self.counters.get(min_item, [None])[0] == min_count:
+                        break
+                del self.counters[min_item]
+                evicted = min_item
+                counter = self.counters[item] = [min_count, min_count]
+        counter[0] += count
+        heapq.heappush(self.heap, (counter[0], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+            heapq.heapify(self.heap)
+        return evicted
+
+
+class TrendingBucket:
+    """Heavy hitters and unique-listener sketches for one time slice"""
+
+    def __init__(self, start, capacity=TRENDING_CAPACITY):
+        self.start = start
+        self.songs = SpaceSaving(capacity)
+        self.genres = SpaceSaving(capacity)
+        self.song_listeners = {}
+        self.genre_listeners = {}
+
+    def record(self, music_id, user_id, genre):
+        evicted = self.songs.add(music_id)
+        if evicted is not None:
+            self.song_listeners.pop(evicted, None)
+        self.song_listeners.setdefault(music_id, HyperLogLog()).add(user_id)
+        if genre:
+            evicted = self.genres.add(genre)
+            if evicted is not None:
+                self.genre_listeners.pop(evicted, None)
+            self.genre_listeners.setdefault(genre, HyperLogLog()).add(user_id)
+
+
+class TrendingTracker:
+    """Sliding-window trending songs and genres with unique-listener estimates"""
+
+    def __init__(self, window=TRENDING_WINDOW_SECONDS, bucket_seconds=TRENDING_BUCKET_SECONDS,
+                 capacity=TRENDING_CAPACITY, top_k=TRENDING_TOP_K, refresh_seconds=TRENDING_REFRESH_SECONDS):
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.capacity = capacity
+        self.top_k = top_k
+        self.refresh_seconds = refresh_seconds
+        self.buckets = []
+        self.lock = threading.Lock()
+        self.ranked = {'songs': [], 'genres': []}
+        self.ranked_at = None
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self.buckets and self.buckets[0].start + self.bucket_seconds <= cutoff:
+            self.buckets.pop(0)
+
+    def record(self, music_id, user_id, genre=None, now=None):
+        now = time.time() if now is None else now
+        start = now - now % self.bucket_seconds
+        with self.lock:
+            if not self.buckets or self.buckets[-1].start < start:
+                self.buckets.append(TrendingBucket(start, self.capacity))
+                self._expire(now)
+            self.buckets[-1].record(music_id, user_id, genre)
+
+    def _rank(self, now):
+        """Merge the window's buckets into top-k (item, plays, unique listeners) lists"""
+        self._expire(now)
+        ranked = {}
+        for kind in ('songs', 'genres'):
+            totals = {}
+            for bucket in self.buckets:
+                for item, (count, _) in getattr(bucket, kind).counters.items():
+                    totals[item] = totals.get(item, 0) + count
+            top = heapq.nlargest(self.top_k, totals.items(), key=lambda entry: entry[1])
+            ranked[kind] = [(item, plays, self._listeners(kind, item)) for item, plays in top]
+        self.ranked = ranked
+        self.ranked_at = now
+
+    def _listeners(self, kind, item):
+        sketches = [getattr(bucket, 'song_listeners' if kind == 'songs' else 'genre_listeners').get(item)
+                    for bucket in self.buckets]
+        merged = HyperLogLog()
+        for sketch in sketches:
+            if sketch is not None:
+                merged.merge(sketch)
+        return int(round(merged.estimate()))
+
+    def _ranked(self, kind, now):
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.ranked_at is None or now - self.ranked_at >= self.refresh_seconds:
+                self._rank(now)
+            return self.ranked[kind]
+
+    def trending_songs(self, limit=10, now=None):
+        """[(music_id, plays, unique_listeners), ...] for the current window"""
+        return self._ranked('songs', now)[:limit]
+
+    def trending_genres(self, limit=10, now=None):
+        """[(genre, plays, unique_listeners), ...] for the current window"""
+        return self._ranked('genres', now)[:limit]
+
+    def unique_listeners(self, music_id=None, genre=None, now=None):
+        """Estimated distinct listeners of a song or genre within the window"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._expire(now)
+            return self._listeners('songs' if genre is None else 'genres',
+                                   music_id if genre is None else genre)
+
+    def save(self, path=TRENDING_SNAPSHOT_PATH):
+        """Atomically write the window's buckets to ``path`` as plain arrays"""
+        arrays = {'format': np.array([SNAPSHOT_FORMAT, HLL_PRECISION]),
+                  'bucket_seconds': np.array(self.bucket_seconds)}
+        with self.lock:
+            arrays['starts'] = np.array([bucket.start for bucket in self.buckets], dtype=np.float64)
+            for number, bucket in enumerate(self.buckets):
+                for kind, listeners in (('songs', bucket.song_listeners), ('genres', bucket.genre_listeners)):
+                    counters = getattr(bucket, kind).counters
+                    items = list(counters)
+                    empty = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+                    arrays[f'{number}_{kind}_items'] = np.array(items)
+                    arrays[f'{number}_{kind}_counts'] = np.array([counters[item] for item in items],
+                                                                 dtype=np.int64).reshape(-1, 2)
+                    arrays[f'{number}_{kind}_registers'] = np.array(
+                        [listeners[item].registers if item in listeners else empty for item in items],
+                        dtype=np.uint8).reshape(-1, 1 << HLL_PRECISION)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def _restore_bucket(self, snapshot, number, start):
+        bucket = TrendingBucket(start, self.capacity)
+        for kind, listeners in (('songs', bucket.song_listeners), ('genres', bucket.genre_listeners)):
+            summary = getattr(bucket, kind)
+            items = snapshot[f'{number}_{kind}_items'].tolist()
+            counts = snapshot[f'{number}_{kind}_counts'].tolist()
+            registers = snapshot[f'{number}_{kind}_registers']
+            for item, counter, item_registers in zip(items, counts, registers):
+                summary.counters[item] = counter
+                sketch = listeners[item] = HyperLogLog()
+                sketch.registers[:] = item_registers
+            summary.heap = [(counter[0], item) for item, counter in summary.counters.items()]
+            heapq.heapify(summary.heap)
+        return bucket
+
+    def load(self, path=TRENDING_SNAPSHOT_PATH, now=None):
+        """Restore buckets from a snapshot; returns False if there is none or it can't be used"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=False) as snapshot:
+                if (snapshot['format'].tolist() != [SNAPSHOT_FORMAT, HLL_PRECISION]
+                        or float(snapshot['bucket_seconds']) != self.bucket_seconds):
+                    logger.warning(f"Ignoring incompatible trending snapshot {path}")
+                    return False
+                buckets = [self._restore_bucket(snapshot, number, start)
+                           for number, start in enumerate(snapshot['starts'].tolist())]
+        except Exception as e:
+            logger.error(f"Ignoring unreadable trending snapshot {path}: {e}")
+            return False
+        with self.lock:
+            self.buckets = buckets
+            self._expire(time.time() if now is None else now)
+            self.ranked_at = None
+        logger.info(f"Restored {len(self.buckets)} trending buckets from {path}")
+        return True
+
+
+class TrendingSnapshotter(threading.Thread):
+    """Background thread snapshotting ``tracker`` every ``interval`` seconds"""
+
+    def __init__(self, tracker, path=TRENDING_SNAPSHOT_PATH, interval=TRENDING_SNAPSHOT_SECONDS):
+        super().__init__(name='trending-snapshotter', daemon=True)
+        self.tracker = tracker
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the thread on first use (so importing the app never spawns it)"""
+        if self.is_alive():
+            return
+        with self.start_lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.tracker.save(self.path)
+            except Exception as e:
+                logger.error(f"Trending snapshot error: {e}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+trending_tracker = TrendingTracker()
@@ -0,0 +1,247 @@
+"""Typo-tolerant type-ahead suggestions from an in-memory trigram index.
+
+``/search`` and ``/api/music?query=`` match with ``LIKE '%x%'``, which scans
+the table and finds nothing once a letter is wrong. ``TrigramIndex`` splits
+each song's normalised title, artist and album into character trigrams.
+Text is lower-cased, accents are stripped, punctuation becomes spaces, and
+each field is padded with a leading and trailing space, so word starts get
+their own trigrams. Each trigram is packed into one int64 of three 21-bit
+code points.
+
+``build()`` is vectorized end to end. Arrow's string kernels normalise the
+columns, and all songs are decoded into a single code-point array. The
+trigram keys of every position come from shifted slices of that array, and
+one ``lexsort`` turns the (key, row) pairs into CSR posting arrays: sorted
+unique keys, offsets, and int32 catalog row numbers.
+
+``suggest()`` ranks songs by how many of the query's trigrams they contain,
+then by popularity (snapshot row order). The last word is treated as a
+prefix, so it gets no trailing-space trigram. Rare trigrams are merged
+first. Once ``SUGGEST_BUDGET_MS`` is spent, the remaining (most common)
+trigrams are skipped and the result is flagged ``partial``. A query too short
+for a full trigram matches every trigram that starts with its characters;
+because the keys are sorted, that is a single key range.
+
+Like the facet index, the trigram index is rebuilt from the snapshot on bulk
+loads and updated on admin adds, edits and deletes. Added songs go to a small
+side table of postings, and removed rows are masked until the next rebuild.
+"""
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+TYPEAHEAD_COLUMNS = ['id', 'title', 'artist', 'album']
+TEXT_FIELDS = ('title', 'artist', 'album')
+SUGGEST_LIMIT = 10
+SUGGEST_BUDGET_MS = 20.0
+# Share of the query's trigrams a song must contain, so one typo still matches
+MIN_OVERLAP = 0.5
+MAX_QUERY_LENGTH = 64
+
+CODE_BITS = 21
+# Separates fields and songs in the concatenated text; never part of a trigram
+SEPARATOR = '\x00'
+NON_ALPHANUMERIC = re.compile(r'[\W_]+')
+
+
+def normalize(strings):
+    """Lower-case, strip accents and turn runs of non-alphanumerics into one space"""
+    strings = pc.fill_null(strings, '')
+    strings = pc.utf8_normalize(pc.utf8_lower(strings), form='NFKD')
+    strings = pc.replace_substring_regex(strings, pattern=r'\p{M}+', replacement='')
+    strings = pc.replace_substring_regex(strings, pattern=r'[^\p{L}\p{N}]+', replacement=' ')
+    return pc.utf8_trim_whitespace(strings)
+
+
+def normalize_query(query):
+    """``normalize()`` for a single string, without Arrow's per-call kernel setup"""
+    text = unicodedata.normalize('NFKD', query.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_ALPHANUMERIC.sub(' ', text).strip()
+
+
+def trigram_keys(codes):
+    """int64 key of every trigram window in a uint32 code-point array (-1 if it spans a separator)"""
+    if len(codes) < 3:
+        return np.empty(0, dtype=np.int64)
+    codes = codes.astype(np.int64)
+    keys = (codes[:-2] << (2 * CODE_BITS)) | (codes[1:-1] << CODE_BITS) | codes[2:]
+    keys[(codes[:-2] == 0) | (codes[1:-1] == 0) | (codes[2:] == 0)] = -1
+    return keys
+
+
+def code_points(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def document_text(columns):
+    """One string per song: `` field `` for each text field, each followed by SEPARATOR"""
+    padded = [pc.binary_join_element_wise(' ', normalize(column), ' ', '') for column in columns]
+    return pc.binary_join_element_wise(*padded, '', SEPARATOR)
+
+
+def document_pairs(documents):
+    """(keys, rows) for every distinct trigram of every document in an Arrow string array"""
+    documents = documents.combine_chunks() if isinstance(documents, pa.ChunkedArray) else documents
+    lengths = pc.utf8_length(documents).to_numpy(zero_copy_only=False).astype(np.int64)
+    codes = code_points(''.join(documents.to_numpy(zero_copy_only=False)))
+    rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    keys = trigram_keys(codes)
+    # Each document starts with a separator-free space and ends with SEPARATOR,
+    # so no window that survives the mask spans two documents
+    valid = keys >= 0
+    keys, rows = keys[valid], rows[:-2][valid]
+    order = np.lexsort((rows, keys))
+    keys, rows = keys[order], rows[order]
+    distinct = np.ones(len(keys), dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+    return keys[distinct], rows[distinct]
+
+
+def query_trigrams(query):
+    """Distinct trigram keys of a query, the last word treated as a prefix"""
+    text = normalize_query(query[:MAX_QUERY_LENGTH])
+    if not text:
+        return text, np.empty(0, dtype=np.int64)
+    keys = trigram_keys(code_points(' ' + text))
+    return text, np.unique(keys[keys >= 0])
+
+
+class TrigramIndex:
+    """CSR trigram posting arrays over the catalog's titles, artists and albums"""
+
+    def __init__(self, budget_ms=SUGGEST_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ready = False
+        self.keys = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.empty(0, dtype=np.int32)
+        self.music_ids = np.empty(0, dtype=np.int64)
+        self.live = np.empty(0, dtype=bool)
+        self.labels = []  # row -> (title, artist, album)
+        self.row_of = {}
+        self.removed = 0
+        self.added = {}  # key -> [rows] for songs added since the last build
+
+    def build(self, catalog):
+        """Rebuild the postings from a catalog snapshot table"""
+        started = time.perf_counter()
+        columns = [catalog.column(name) for name in TEXT_FIELDS]
+        keys, rows = document_pairs(document_text(columns))
+        unique_keys, starts = np.unique(keys, return_index=True)
+        music_ids = catalog.column('id').to_numpy()
+        with self.lock:
+            self._reset()
+            self.keys = unique_keys
+            self.offsets = np.append(starts, len(keys)).astype(np.int64)
+            self.postings = rows.astype(np.int32)
+            self.music_ids = music_ids
+            self.live = np.ones(len(music_ids), dtype=bool)
+            self.labels = list(zip(*(column.to_pylist() for column in columns)))
+            self.row_of = {music_id: row for row, music_id in enumerate(music_ids.tolist())}
+            self.ready = True
+        logger.info(f"Built trigram index: {len(music_ids)} songs, {len(unique_keys)} trigrams, "
+                    f"{len(rows)} postings in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def song_added(self, song):
+        """Index a song (dict with id, title, artist, album)"""
+        with self.lock:
+            if not self.ready or song['id'] in self.row_of:
+                return
+            row = len(self.music_ids)
+            columns = [pa.array([song.get(name)], type=pa.string()) for name in TEXT_FIELDS]
+            keys, _ = document_pairs(document_text(columns))
+            for key in keys.tolist():
+                self.added.setdefault(key, []).append(row)
+            self.music_ids = np.append(self.music_ids, song['id'])
+            self.live = np.append(self.live, True)
+            self.labels.append(tuple(song.get(name) for name in TEXT_FIELDS))
+            self.row_of[song['id']] = row
+
+    def song_removed(self, song):
+        with self.lock:
+            row = self.row_of.pop(song['id'], None)
+            if row is not None:
+                self.live[row] = False
+                self.removed += 1
+
+    def song_updated(self, previous, song):
+        self.song_removed(previous)
+        self.song_added(song)
+
+    def _postings(self, key):
+        index = np.searchsorted(self.keys, key)
+        rows = self.postings[self.offsets[index]:self.offsets[index + 1]] \
+            if index < len(self.keys) and self.keys[index] == key else self.postings[:0]
+        added = self.added.get(key)
+        return np.concatenate([rows, np.asarray(added, dtype=np.int32)]) if added else rows
+
+    def _prefix_postings(self, prefix, per_key):
+        """Lowest ``per_key`` rows of each trigram starting with the (up to two) code points in ``prefix``"""
+        low = 0
+        for position, code in enumerate(code_points(prefix).tolist()):
+            low |= code << ((2 - position) * CODE_BITS)
+        span = 1 << ((3 - len(prefix)) * CODE_BITS)
+        start, end = np.searchsorted(self.keys, [low, low + span])
+        # Posting lists are sorted, so each list's head holds its most popular songs
+        rows = [self.postings[offset:min(offset + per_key, stop)]
+                for offset, stop in zip(self.offsets[start:end].tolist(), self.offsets[start + 1:end + 1].tolist())]
+        rows += [np.asarray(added, dtype=np.int32) for key, added in self.added.items() if low <= key < low + span]
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int32)
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """({'id', 'title', 'artist', 'album', 'score'} list, partial flag) for a typed query"""
+        started = time.perf_counter()
+        text, grams = query_trigrams(query)
+        if not text or not self.ready:
+            return [], False
+        with self.lock:
+            partial = False
+            if not len(grams):
+                candidates = self._prefix_postings(' ' + text, limit + self.removed)
+                rows, counts = candidates, np.ones(len(candidates), dtype=np.int64)
+                needed = 1
+            else:
+                # Rarest trigrams first, so a blown budget only drops the common ones
+                lists = sorted((self._postings(key) for key in grams.tolist()), key=len)
+                merged, used = [], 0
+                for rows in lists:
+                    if used and (time.perf_counter() - started) * 1000 > self.budget_ms:
+                        partial = True
+                        break
+                    merged.append(rows)
+                    used += 1
+                rows, counts = np.unique(np.concatenate(merged), return_counts=True)
+                needed = max(1, math.ceil(MIN_OVERLAP * len(grams)) - (len(grams) - used))
+
+            keep = (counts >= needed) & self.live[rows]
+            rows, counts = rows[keep], counts[keep]
+            # Most shared trigrams first, then catalog (popularity) order
+            rank = counts * (len(self.live) + 1) - rows
+            if len(rank) > limit:
+                top = np.argpartition(-rank, limit)[:limit]
+                rows, counts, rank = rows[top], counts[top], rank[top]
+            order = np.argsort(-rank, kind='stable')
+            total = max(len(grams), 1)
+            suggestions = []
+            for row, count in zip(rows[order].tolist(), counts[order].tolist()):
+                title, artist, album = self.labels[row]
+                suggestions.append({'id': int(self.music_ids[row]), 'title': title, 'artist': artist,
+                                    'album': album, 'score': round(count / total, 3)})
+            return suggestions, partial
+
+
+trigram_index = TrigramIndex()
@@ -0,0 +1,67 @@
+"""Short-lived cache of logged-in users' profile and role.
+
+``admin_required`` and ``/home`` used to look the user's role up in the
+database on every request. ``UserCache`` keeps ``id``, ``name``, ``email``
+and ``role`` per user id for ``USER_CACHE_TTL_SECONDS``. It is primed at
+login and read by every authenticated route. Code that changes a user's role
+calls ``invalidate()`` (or ``clear()``, as ``ensure_admin_account`` does);
+changes made elsewhere, such as another process or a manual UPDATE, are
+picked up within the TTL. The signed session cookie is not used for the role because it cannot be revoked
+server-side.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+MAX_CACHED_USERS = 10000
+PROFILE_FIELDS = ('id', 'name', 'email', 'role')
+
+
+class UserCache:
+    """TTL cache of ``{id, name, email, role}`` keyed by user id"""
+
+    def __init__(self, ttl=USER_CACHE_TTL_SECONDS, max_users=MAX_CACHED_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, user):
+        """Cache a users row (or dict) and return the cached profile"""
+        profile = {field: user[field] for field in PROFILE_FIELDS}
+        with self.lock:
+            self.users[str(profile['id'])] = (time.monotonic() + self.ttl, profile)
+            self.users.move_to_end(str(profile['id']))
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        return profile
+
+    def get(self, connection, user_id):
+        """Return the user's profile, loading it on a miss; None if the user is gone"""
+        key = str(user_id)
+        with self.lock:
+            entry = self.users.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        cursor = connection.cursor()
+        queries.execute(cursor, 'user_profile', (user_id,))
+        user = cursor.fetchone()
+        if user is None:
+            self.invalidate(user_id)
+            return None
+        return self.put(user)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.users.pop(str(user_id), None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+
+user_cache = UserCache()